@@ -3,12 +3,22 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from config import Config
+from app.jsonprovider import init_json
+from app.engine import init_engine, tune_engines, RoutingSession
+from app.profiling import init_profiling
+from app.metrics import init_metrics
 
 app = Flask(__name__)
 app.config.from_object(Config)
+init_json(app)
+init_engine(app)
 
 # Initialize the database
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+with app.app_context():
+    tune_engines(db.engines.values(), app.config)
+    init_profiling(app, db.engines.values())
+    init_metrics(app, db.engines)
 migrate = Migrate(app, db)
 
 # Initialize the login manager
@@ -20,4 +30,4 @@ from app.api import bp as api_bp
 app.register_blueprint(api_bp, url_prefix='/api')
 
 # Import routes and models
-from app import routes, models
+from app import routes, models, cli
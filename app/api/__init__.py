@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('api', __name__)
 
-from app.api import users, movies, errors, tokens, auth
\ No newline at end of file
+from app.api import users, movies, batch, errors, tokens, auth, caches, stats, profile
\ No newline at end of file
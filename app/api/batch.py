@@ -0,0 +1,240 @@
+import io
+from itertools import groupby, islice
+
+from flask import request, url_for, current_app
+from werkzeug.http import HTTP_STATUS_CODES
+import sqlalchemy as sa
+from app.api import bp
+from app.models import Movie
+from app import db
+from app.api.errors import bad_request, error_response
+from app.api.auth import token_auth
+from app.changes import record_movie_changes
+from app.importer import import_movies, IMPORT_FORMATS
+
+
+def chunked(items, size):
+    """
+    Split a list into consecutive chunks of at most ``size`` items.
+    """
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def item_error(index, op, status_code, message):
+    """
+    Generates the result entry of an operation that was not applied.
+
+    Args:
+        index (int): Position of the operation in the batch.
+        op (str or None): The requested operation.
+        status_code (int): HTTP status code describing the failure.
+        message (str): Detailed error message.
+
+    Returns:
+        dict: The result entry for the operation.
+    """
+    return {'index': index, 'op': op, 'status': status_code,
+            'error': HTTP_STATUS_CODES.get(status_code, 'Unknown error'), 'message': message}
+
+
+@bp.route('/movies/batch', methods=['POST'])
+@token_auth.login_required
+def batch_movies():
+    """
+    Create, update and delete many movies in one request.
+
+    Operations are applied in request order, in a single transaction, with
+    one executemany statement per chunk of at most ``BATCH_CHUNK_SIZE``
+    consecutive operations of the same kind, so that an operation can
+    refer to a movie created earlier in the batch. Ownership of the movies
+    referenced by each run of updates or deletes is checked with a single
+    query. Invalid operations are skipped and reported without affecting
+    the others; should the database reject the batch anyway, nothing is
+    applied.
+
+    Request Body:
+        list: Operations, each one of
+            ``{"op": "create", "data": {...}}``,
+            ``{"op": "update", "id": 1, "data": {...}}`` or
+            ``{"op": "delete", "id": 1}``.
+
+    Returns:
+        dict: One result per operation, in request order, with its status code.
+    """
+    operations = request.get_json(silent=True)
+    if not isinstance(operations, list):
+        return bad_request('Request body must be a list of operations')
+    if len(operations) > current_app.config['MAX_BATCH_OPERATIONS']:
+        return error_response(413, 'A batch can hold at most {} operations'.format(
+            current_app.config['MAX_BATCH_OPERATIONS']))
+    user_id = token_auth.current_user().id
+    results = [None] * len(operations)
+    valid = []
+    seen = set()
+
+    # Validate every operation and the values it sets
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op not in ('create', 'update', 'delete'):
+            results[index] = item_error(index, op, 400, 'op must be create, update or delete')
+            continue
+        data = operation.get('data', {})
+        if not isinstance(data, dict):
+            results[index] = item_error(index, op, 400, 'data must be an object')
+            continue
+        error = Movie.validate(data) if op == 'create' else None
+        row, error = (None, error) if error else Movie.clean(data)
+        if error:
+            results[index] = item_error(index, op, 400, error)
+            continue
+        if op == 'create':
+            valid.append((index, op, dict(row, user_id=user_id)))
+            continue
+        id = operation.get('id')
+        if not isinstance(id, int) or isinstance(id, bool):
+            results[index] = item_error(index, op, 400, 'Must include an integer id field')
+        elif id in seen:
+            results[index] = item_error(index, op, 400, f'Movie {id} appears more than once')
+        else:
+            seen.add(id)
+            valid.append((index, op, dict(row, id=id)))
+
+    # Apply runs of the same operation in order, in one transaction
+    chunk_size = current_app.config['BATCH_CHUNK_SIZE']
+    existing = {}
+    try:
+        for op, run in groupby(valid, key=lambda item: item[1]):
+            for chunk in chunked([(index, row) for index, _, row in run], chunk_size):
+                if op == 'create':
+                    create_movies(chunk, existing, results)
+                else:
+                    chunk = owned_movies(chunk, op, user_id, existing, results)
+                    (update_movies if op == 'update' else delete_movies)(chunk, existing, results)
+        db.session.commit()
+    except sa.exc.IntegrityError as e:
+        db.session.rollback()
+        return bad_request(f'Batch rejected by the database: {e.orig}')
+
+    applied = sum(result['status'] < 300 for result in results)
+    data = {
+        'results': results,
+        '_meta': {
+            'total': len(results),
+            'applied': applied,
+            'failed': len(results) - applied,
+        },
+    }
+    return data, 200
+
+
+def create_movies(chunk, existing, results):
+    """
+    Insert a chunk of new movies and remember them for later operations.
+    """
+    ids = db.session.scalars(
+        sa.insert(Movie).returning(Movie.id, sort_by_parameter_order=True),
+        [row for _, row in chunk]).all()
+    record_movie_changes([(None, dict(row, id=id)) for (_, row), id in zip(chunk, ids)])
+    for (index, row), id in zip(chunk, ids):
+        existing[id] = dict(row, id=id)
+        results[index] = {'index': index, 'op': 'create', 'status': 201, 'id': id,
+                          '_links': {'self': url_for('api.get_movie', id=id, _external=True)}}
+
+
+def owned_movies(chunk, op, user_id, existing, results):
+    """
+    Keep the operations of a chunk on movies of the user, reporting the others.
+
+    Movies not seen before in the batch are loaded with a single query.
+
+    Returns:
+        list: The ``(index, row)`` tuples of the allowed operations.
+    """
+    missing = [row['id'] for _, row in chunk if row['id'] not in existing]
+    if missing:
+        existing.update((movie['id'], dict(movie)) for movie in db.session.execute(
+            sa.select(Movie.__table__).where(Movie.id.in_(missing))).mappings())
+    allowed = []
+    for index, row in chunk:
+        if row['id'] not in existing:
+            results[index] = item_error(index, op, 404, f'Movie {row["id"]} not found')
+        elif existing[row['id']]['user_id'] != user_id:
+            results[index] = item_error(index, op, 403, f'Movie {row["id"]} belongs to another user')
+        else:
+            allowed.append((index, row))
+    return allowed
+
+
+def update_movies(chunk, existing, results):
+    """
+    Apply a chunk of updates with one executemany statement.
+    """
+    rows = [row for _, row in chunk if len(row) > 1]
+    if rows:
+        db.session.execute(sa.update(Movie), rows)
+        changes = [(existing[row['id']], dict(existing[row['id']], **row)) for row in rows]
+        record_movie_changes(changes)
+        existing.update((after['id'], after) for _, after in changes)
+    for index, row in chunk:
+        results[index] = {'index': index, 'op': 'update', 'status': 200, 'id': row['id']}
+
+
+def delete_movies(chunk, existing, results):
+    """
+    Delete a chunk of movies with one statement.
+    """
+    if chunk:
+        db.session.execute(sa.delete(Movie).where(Movie.id.in_([row['id'] for _, row in chunk])))
+        record_movie_changes([(existing.pop(row['id']), None) for _, row in chunk])
+    for index, row in chunk:
+        results[index] = {'index': index, 'op': 'delete', 'status': 204, 'id': row['id']}
+
+
+# Upload content types and the import format they imply
+IMPORT_MIMETYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+@bp.route('/movies/import', methods=['POST'])
+@token_auth.login_required
+def import_movies_upload():
+    """
+    Import movies from a CSV or NDJSON upload.
+
+    The upload is parsed as it is read and inserted in chunks, each in its
+    own transaction. Invalid rows are reported with their line numbers and
+    do not stop the import.
+
+    Query Parameters:
+        format (str): ``csv`` or ``ndjson``; defaults to the format implied
+            by the Content-Type of the upload.
+
+    Request Body:
+        The file itself, or a multipart form with the file in ``file``. CSV
+        files need a header row naming the movie fields.
+
+    Returns:
+        dict: Number of imported and failed rows and the first row errors.
+    """
+    if request.files:
+        upload = request.files.get('file')
+        if upload is None:
+            return bad_request('Upload the file in the file field')
+        stream, mimetype = upload.stream, upload.mimetype
+    else:
+        stream, mimetype = request.stream, request.mimetype
+    import_format = request.args.get('format') or IMPORT_MIMETYPES.get(mimetype)
+    if import_format not in IMPORT_FORMATS:
+        return bad_request('format must be csv or ndjson')
+    lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    try:
+        result = import_movies(lines, import_format, token_auth.current_user().id)
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return bad_request('The upload must be UTF-8 encoded')
+    return result, 200
@@ -0,0 +1,23 @@
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.conditional import response_cache
+from app.models import token_cache, password_cache, user_cache
+
+
+@bp.route('/caches', methods=['GET'])
+@token_auth.login_required
+def get_caches():
+    """
+    Report the counters of the caches held by the worker process serving
+    the request.
+
+    Returns:
+        dict: Hits, misses, hit ratio, evictions and size of every cache;
+        the response cache reports one entry per tier, with bytes used.
+    """
+    return {
+        'response': response_cache.stats(),
+        'tokens': token_cache.stats(),
+        'passwords': password_cache.stats(),
+        'users': user_cache.stats(),
+    }, 200
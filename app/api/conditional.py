@@ -0,0 +1,107 @@
+import hashlib
+
+from flask import request, abort, current_app
+import sqlalchemy as sa
+from app import app, db
+from app.cache import LRUByteCache, SQLiteByteCache, TieredCache
+from app.models import Generation
+
+
+def make_response_cache(config):
+    """
+    Build the response cache described by the configuration.
+    """
+    tiers = []
+    if config['RESPONSE_CACHE_BYTES']:
+        tiers.append(LRUByteCache(config['RESPONSE_CACHE_BYTES']))
+    if config['RESPONSE_CACHE_PATH']:
+        tiers.append(SQLiteByteCache(config['RESPONSE_CACHE_PATH'],
+                                     config['RESPONSE_CACHE_SHARED_BYTES']))
+    return TieredCache(*tiers)
+
+
+# Serialized responses keyed by their ETag. An ETag covers the URL and the
+# version stamps of the data behind it, so writes never need to find and
+# delete entries: they move the stamps, and outdated entries are evicted
+# once they fall out of use.
+response_cache = make_response_cache(app.config)
+
+
+def resource_etag(*keys):
+    """
+    Compute the strong ETag of the resource the current request addresses.
+
+    The representation of a resource only changes when the data behind it
+    does, and every write bumps the version stamps of the data it touches.
+    Hashing those stamps together with the request URL therefore yields a
+    validator without loading or serializing anything but the stamps.
+
+    The ETag has two parts separated by a dot: the version of the resource,
+    from its path and stamps, and the representation, from the query
+    string. `require_match` only compares the first.
+
+    Args:
+        *keys (str): The version stamps the representation depends on.
+
+    Returns:
+        str: The unquoted ETag.
+    """
+    stamps = dict(db.session.execute(
+        sa.select(Generation.key, Generation.value).where(Generation.key.in_(keys))).all())
+    version = hashlib.sha1(request.base_url.encode())
+    for key in keys:
+        version.update(f'|{key}={stamps.get(key, 0)}'.encode())
+    return f'{version.hexdigest()}.{hashlib.sha1(request.query_string).hexdigest()}'
+
+
+def not_modified(etag):
+    """
+    Answer a conditional GET whose cached copy is still current.
+
+    Returns:
+        tuple or None: A 304 response if ``If-None-Match`` matches ``etag``,
+        None if the full representation has to be sent.
+    """
+    if request.if_none_match.contains_weak(etag):
+        return '', 304, {'ETag': f'"{etag}"'}
+    return None
+
+
+def require_match(etag):
+    """
+    Enforce the ``If-Match`` precondition of a write, if the client sent one.
+
+    The ETag of any representation of the resource matches, whichever
+    query string the client read it with or the write is sent with, as
+    long as the resource has not changed since.
+
+    Raises:
+        HTTPException: 412 if the resource changed since the client read it.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return
+    version = etag.partition('.')[0]
+    if not any(tag.partition('.')[0] == version for tag in request.if_match):
+        abort(412, 'The resource has been modified since it was retrieved')
+
+
+def cached_json(etag, build):
+    """
+    Serve the JSON representation identified by ``etag`` from the response
+    cache, building and caching it on a miss.
+
+    Args:
+        etag (str): ETag of the representation, as given by `resource_etag`.
+        build (callable): Returns the data to serialize.
+
+    Returns:
+        Response: The JSON response with its ETag.
+    """
+    body = response_cache.get(etag)
+    if body is None:
+        response = current_app.json.response(build())
+        response_cache.set(etag, response.get_data())
+    else:
+        response = current_app.response_class(body, mimetype=current_app.json.mimetype)
+    response.set_etag(etag)
+    return response
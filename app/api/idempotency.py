@@ -0,0 +1,164 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+from functools import wraps
+
+from flask import request, current_app
+import sqlalchemy as sa
+from app import db
+from app.models import IdempotencyKey, utcnow
+from app.api.errors import bad_request, error_response
+from app.api.auth import token_auth
+
+# Claims of the same key from this process take turns on one of these locks
+# instead of racing each other into integrity errors
+KEY_LOCKS = [threading.Lock() for _ in range(64)]
+
+# Response headers stored with a response and sent again on replay
+REPLAYED_HEADERS = ['Location', 'ETag']
+
+# Expired keys are deleted at most once per IDEMPOTENCY_SWEEP_INTERVAL
+# seconds per process; until then `claim` ignores them
+SWEEP_LOCK = threading.Lock()
+next_sweep = 0.0
+
+
+def sweep(now):
+    """
+    Delete the keys older than ``IDEMPOTENCY_KEY_TTL``, unless this process
+    did so recently.
+    """
+    global next_sweep
+    with SWEEP_LOCK:
+        if time.monotonic() < next_sweep:
+            return
+        next_sweep = time.monotonic() + current_app.config['IDEMPOTENCY_SWEEP_INTERVAL']
+    ttl = timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+    db.session.execute(sa.delete(IdempotencyKey).where(IdempotencyKey.created_at < now - ttl))
+    db.session.commit()
+
+
+def claim(scope, key, fingerprint, now):
+    """
+    Take a key for the current request, or find the request that took it.
+
+    A key whose stored response has expired, or whose request has held it
+    for longer than ``IDEMPOTENCY_LEASE`` seconds without finishing, is
+    taken over as if it were free.
+
+    Args:
+        now (datetime): The time of the claim; `idempotent` only stores the
+            response if the key still carries it.
+
+    Returns:
+        Row or None: None if the key is now held by the current request,
+        otherwise the stored row of the request that holds it.
+    """
+    ttl = timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+    lease = timedelta(seconds=current_app.config['IDEMPOTENCY_LEASE'])
+    where = (IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+    while True:
+        try:
+            db.session.add(IdempotencyKey(scope=scope, key=key, fingerprint=fingerprint,
+                                          created_at=now))
+            db.session.commit()
+            return None
+        except sa.exc.IntegrityError:
+            db.session.rollback()
+        record = db.session.execute(sa.select(IdempotencyKey.__table__).where(*where)).first()
+        if record is None:
+            # Released in the meantime
+            continue
+        age = now.replace(tzinfo=None) - record.created_at
+        if age < (ttl if record.status is not None else lease):
+            return record
+        # Only one of the requests finding the key stale gets to take it over
+        taken = db.session.execute(sa.update(IdempotencyKey).where(
+            *where, IdempotencyKey.created_at == record.created_at).values(
+            fingerprint=fingerprint, status=None, headers=None, body=None, created_at=now))
+        db.session.commit()
+        if taken.rowcount:
+            return None
+
+
+def replay(record):
+    """
+    Rebuild the response stored for a key.
+    """
+    response = current_app.response_class(record.body, status=record.status,
+                                          mimetype='application/json')
+    response.headers.update(json.loads(record.headers))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Make a POST endpoint safe to retry with an ``Idempotency-Key`` header.
+
+    The first request with a key runs the view and stores its response for
+    ``IDEMPOTENCY_KEY_TTL`` seconds; later requests with the same key and
+    body get the stored response back without running the view again.
+    Requests arriving while the first one is still running wait for it for
+    up to ``IDEMPOTENCY_WAIT`` seconds. Should the first request not finish
+    within ``IDEMPOTENCY_LEASE`` seconds, for instance because its worker
+    died, the next request with the key runs the view instead. Keys are
+    scoped to the authenticated user, and responses with a 5xx status are
+    not stored so that they can be retried.
+
+    Responses:
+        409: The first request with the key is still running.
+        422: The key was used with a different request body.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > 255:
+            return bad_request('Idempotency-Key must hold 1 to 255 characters')
+        user = token_auth.current_user()
+        scope = str(user.id) if user else ''
+        fingerprint = hashlib.sha256(
+            f'{request.method} {request.full_path}\n'.encode() + request.get_data()).hexdigest()
+
+        now = utcnow()
+        sweep(now)
+        lock = KEY_LOCKS[hash((scope, key)) % len(KEY_LOCKS)]
+        deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT']
+        while True:
+            with lock:
+                record = claim(scope, key, fingerprint, now)
+            if record is None:
+                break
+            if record.fingerprint != fingerprint:
+                return error_response(422, 'Idempotency-Key was used for a different request')
+            if record.status is not None:
+                return replay(record)
+            if time.monotonic() > deadline:
+                return error_response(409, 'A request with this Idempotency-Key is in progress')
+            time.sleep(0.05)
+            now = utcnow()
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            response = None
+            raise
+        finally:
+            db.session.rollback()
+            # Unless the claim was taken over in the meantime
+            held = (IdempotencyKey.scope == scope, IdempotencyKey.key == key,
+                    IdempotencyKey.created_at == now)
+            if response is None or response.status_code >= 500:
+                db.session.execute(sa.delete(IdempotencyKey).where(*held))
+            else:
+                db.session.execute(sa.update(IdempotencyKey).where(*held).values(
+                    status=response.status_code, body=response.get_data(),
+                    headers=json.dumps({name: response.headers[name] for name in
+                                        REPLAYED_HEADERS if name in response.headers})))
+            db.session.commit()
+        return response
+    return wrapper
@@ -1,28 +1,334 @@
-from flask import request, url_for, abort
+import re
+from types import SimpleNamespace
+
+from flask import request, url_for, abort, current_app
+import sqlalchemy as sa
 from app.api import bp
-from app.models import Movie
+from app.models import Movie, MovieChange, movie_fts, utcnow, isoformat
 from app import db
-from app.api.errors import bad_request
+from app.api.errors import bad_request, error_response
 from app.api.auth import token_auth
+from app.changes import movie_snapshot, record_movie_changes
+from app.groupcommit import group_committer
+from app.api.conditional import resource_etag, not_modified, require_match, cached_json
+from app.api.idempotency import idempotent
+from app.api.pagination import page_args, sort_args, field_args, keyset_page, \
+    collection_dict, encode_cursor, decode_cursor, url_template
+
+
+def name_prefix_clause(prefix):
+    """
+    Match names starting with ``prefix`` using an index friendly range.
+
+    ``LIKE 'x%'`` can only use the index on ``name`` under case-insensitive
+    collation, so the prefix is expressed as ``name >= x AND name < x'``
+    where ``x'`` is the prefix with its last character incremented.
+    """
+    if not prefix:
+        raise ValueError('name_prefix must not be empty')
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return sa.and_(Movie.name >= prefix, Movie.name < upper)
+
+
+# Query parameters accepted as filters on movie collections, with the type
+# their value is converted to and the clause they add to the query. Each of
+# them is backed by an index on the movie table.
+MOVIE_FILTERS = {
+    'year_min': (int, lambda value: Movie.year >= value),
+    'year_max': (int, lambda value: Movie.year <= value),
+    'genre': (str, lambda value: Movie.genre == value),
+    'min_oscars': (int, lambda value: Movie.oscars >= value),
+    'name_prefix': (str, name_prefix_clause),
+}
+
+# Fields movie collections can be sorted by with the ``sort`` parameter.
+MOVIE_SORT_FIELDS = {
+    'id': Movie.id,
+    'name': Movie.name,
+    'year': Movie.year,
+    'oscars': Movie.oscars,
+}
+
+
+def filter_movies(query):
+    """
+    Apply the filters given in the query string to a movie query.
+
+    Args:
+        query (Select): The select statement to filter.
+
+    Returns:
+        tuple: The filtered statement and whether any filter was applied.
+
+    Raises:
+        ValueError: If a filter value cannot be converted to its type.
+    """
+    filtered = False
+    for name, (type_, clause) in MOVIE_FILTERS.items():
+        if name in request.args:
+            try:
+                value = type_(request.args[name])
+            except ValueError:
+                raise ValueError(f'{name} must be of type {type_.__name__}')
+            query = query.where(clause(value))
+            filtered = True
+    return query, filtered
+
+
+# Fields of the movie representation that ``fields`` can select.
+MOVIE_FIELDS = ['id', 'name', 'year', 'oscars', 'genre', 'user_id', 'updated_at']
+
+
+def movie_columns(fields, links, *extra):
+    """
+    List the columns to select for a sparse movie representation.
+
+    Args:
+        fields (list): The requested fields, which come first.
+        links (bool): Whether ``_links`` is requested, which needs the ids.
+        *extra (str): Other columns the caller needs, such as sort keys.
+
+    Returns:
+        list: Columns of the movie table, without duplicates.
+    """
+    names = list(fields)
+    for name in (['id', 'user_id'] if links else []) + list(extra):
+        if name not in names:
+            names.append(name)
+    return [Movie.__table__.c[name] for name in names]
+
+
+def movie_serializer(fields=MOVIE_FIELDS, links=True):
+    """
+    Build the function serializing movies, the one representation of a
+    movie every endpoint returns, or a sparse version of it.
+
+    It reads attributes only, so collections can select plain rows rather
+    than ORM objects, and builds the links from URL templates computed once
+    per request instead of calling ``url_for`` per movie.
+
+    Args:
+        fields (list): The fields to include.
+        links (bool): Whether to include the ``_links`` section.
+
+    Returns:
+        callable: Maps a row or a `Movie` with the needed columns to a dictionary.
+    """
+    timestamp = 'updated_at' in fields
+
+    def values(row):
+        data = {field: getattr(row, field) for field in fields}
+        if timestamp:
+            data['updated_at'] = isoformat(row.updated_at)
+        return data
+
+    if not links:
+        return values
+    movie_url = url_template('api.get_movie')
+    user_url = url_template('api.get_user')
+
+    def serialize(row):
+        data = values(row)
+        data['_links'] = {
+            'self': movie_url(row.id),
+            'user': user_url(row.user_id),
+        }
+        return data
+    return serialize
+
+
+def movie_collection(query, endpoint, **kwargs):
+    """
+    Filter, sort and paginate a movie query according to the query string.
+
+    Args:
+        query (Select): The select statement for the rows of the movie
+            table in the collection.
+        endpoint (str): Endpoint used to build the ``_links`` URLs.
+        **kwargs: Extra URL arguments for ``endpoint``.
+
+    Returns:
+        dict: A page of movies with ``_meta`` and ``_links`` sections.
+
+    Raises:
+        ValueError: If any query parameter is invalid.
+    """
+    limit, after = page_args()
+    order = sort_args(MOVIE_SORT_FIELDS, Movie.id)
+    fields, links = field_args(MOVIE_FIELDS)
+    # Only read the columns the response and the cursor need
+    query = query.with_only_columns(*movie_columns(fields, links, *(c.key for c, _ in order)))
+    query, filtered = filter_movies(query)
+    movies, next_cursor = keyset_page(query, order, limit, after, filtered)
+    return collection_dict('movies', movies, limit, next_cursor, endpoint,
+                           serialize=movie_serializer(fields, links), **kwargs)
 
 
 @bp.route('/movies', methods=['GET'])
 @token_auth.login_required
 def get_movies():
     """
-    Retrieve all movies.
+    Retrieve all movies, one page at a time.
+
+    Query Parameters:
+        limit (int): Page size, capped at ``MAX_MOVIES_PER_PAGE``.
+        after (str): Cursor returned as ``next_cursor`` by the previous page.
+        year_min, year_max (int): Only movies released within these years.
+        genre (str): Only movies of this genre.
+        min_oscars (int): Only movies that won at least this many Oscars.
+        name_prefix (str): Only movies whose name starts with this string.
+        sort (str): Comma separated fields, ``-`` prefixed for descending.
+        fields (str): Comma separated fields to return, all by default.
+        links (bool): ``false`` to leave out the ``_links`` of each movie.
+
+    Returns:
+        dict: A dictionary containing a page of movies and related links,
+        or an empty 304 response if the ``If-None-Match`` ETag is current.
+    """
+    etag = resource_etag('movies')
+    if response := not_modified(etag):
+        return response
+    try:
+        return cached_json(etag, lambda: movie_collection(sa.select(Movie.__table__), 'api.get_movies'))
+    except ValueError as e:
+        return bad_request(str(e))
+
+
+def fts_query(text):
+    """
+    Turn free text typed by a user into an FTS5 query.
+
+    Every word is quoted so that FTS5 operators in the input are treated as
+    plain text, and the last word becomes a prefix query for type-ahead.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        raise ValueError('q must contain at least one word')
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+@bp.route('/movies/search', methods=['GET'])
+@token_auth.login_required
+def search_movies():
+    """
+    Search movies by name and genre, best matches first.
+
+    Query Parameters:
+        q (str): The text to search for; the last word matches as a prefix.
+        limit (int): Page size, capped at ``MAX_MOVIES_PER_PAGE``.
+        after (str): Cursor returned as ``next_cursor`` by the previous page.
+        fields, links: Same sparse fieldset parameters as ``GET /api/movies``.
+
+    Returns:
+        dict: A dictionary containing a page of matching movies and related links,
+        or an empty 304 response if the ``If-None-Match`` ETag is current.
+    """
+    etag = resource_etag('movies')
+    if response := not_modified(etag):
+        return response
+    try:
+        limit, after = page_args()
+        fields, links = field_args(MOVIE_FIELDS)
+        match = fts_query(request.args.get('q', ''))
+        query = (sa.select(*movie_columns(fields, links, 'id'), movie_fts.c.rank)
+                 .join(movie_fts, movie_fts.c.rowid == Movie.id)
+                 .where(sa.literal_column('movie_fts').op('MATCH')(match)))
+        if after is not None:
+            rank, id = decode_cursor(after, [(movie_fts.c.rank, False), (Movie.id, False)])
+            query = query.where(sa.or_(movie_fts.c.rank > rank,
+                                       sa.and_(movie_fts.c.rank == rank, Movie.id > id)))
+    except ValueError as e:
+        return bad_request(str(e))
+    # rank is the BM25 score of the match, lower is better
+    rows = db.session.execute(
+        query.order_by(movie_fts.c.rank, Movie.id).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1].rank, rows[-1].id])
+    data = collection_dict('movies', rows, limit, next_cursor, 'api.search_movies',
+                           serialize=movie_serializer(fields, links))
+    return data, 200, {'ETag': f'"{etag}"'}
+
+
+def movie_changes(since, limit, fields, links):
+    """
+    Read one page of the movie changes committed after ``since``.
 
     Returns:
-        dict: A dictionary containing a list of movies and related links.
+        dict: The changes with ``_meta`` and ``_links`` sections.
     """
-    movies = Movie.query.all()
-    data = {
-        'movies': [movie.to_dict() for movie in movies],
+    change = MovieChange.__table__
+    query = (sa.select(change.c.seq, change.c.movie_id, change.c.deleted,
+                       *movie_columns(fields, links))
+             .select_from(change.outerjoin(Movie.__table__, Movie.id == change.c.movie_id))
+             .where(change.c.seq > since))
+    if 'user_id' in request.args:
+        try:
+            query = query.where(change.c.user_id == int(request.args['user_id']))
+        except ValueError:
+            raise ValueError('user_id must be of type int')
+    rows = db.session.execute(query.order_by(change.c.seq).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = rows[-1].seq if rows else since
+
+    serialize = movie_serializer(fields, links)
+    args = dict(request.args.to_dict(), limit=limit)
+    return {
+        'changes': [{'id': row.movie_id, 'deleted': True} if row.deleted
+                    else dict(serialize(row), deleted=False) for row in rows],
+        '_meta': {
+            'limit': limit,
+            'count': len(rows),
+            'cursor': str(cursor),
+            'has_more': has_more,
+        },
         '_links': {
-            'self': url_for('api.get_movies', _external=True),
+            'self': url_for('api.get_movie_changes', _external=True, **args),
+            'next': url_for('api.get_movie_changes', _external=True, **dict(args, since=cursor)),
         }
     }
-    return data, 200
+
+
+@bp.route('/movies/changes', methods=['GET'])
+@token_auth.login_required
+def get_movie_changes():
+    """
+    Retrieve the movies created, updated or deleted since a sync cursor.
+
+    Every movie appears at most once, at the position of its latest change:
+    as its current representation with ``deleted`` false, or as a tombstone
+    holding only its ``id`` with ``deleted`` true. Clients keep the
+    ``cursor`` of the last page and send it back as ``since`` to fetch what
+    changed in the meantime, so a sync costs as much as the number of
+    changes rather than the size of the catalog. Changes are ordered by
+    commit, so a cursor never skips a change committed after it was issued.
+
+    Query Parameters:
+        since (str): ``cursor`` returned by a previous call; omit for a full sync.
+        user_id (int): Only changes to movies of this user.
+        limit (int): Page size, capped at ``MAX_MOVIES_PER_PAGE``.
+        fields, links: Same sparse fieldset parameters as ``GET /api/movies``.
+
+    Returns:
+        dict: A dictionary containing a page of changes, the cursor to
+        continue from and whether more changes are waiting, or an empty 304
+        response if the ``If-None-Match`` ETag is current.
+    """
+    etag = resource_etag('movies')
+    if response := not_modified(etag):
+        return response
+    try:
+        limit, _ = page_args()
+        fields, links = field_args(MOVIE_FIELDS)
+        try:
+            since = int(request.args.get('since', 0))
+        except ValueError:
+            raise ValueError('Invalid since cursor')
+        return cached_json(etag, lambda: movie_changes(since, limit, fields, links))
+    except ValueError as e:
+        return bad_request(str(e))
 
 
 @bp.route('/movies/<int:id>', methods=['GET'])
@@ -34,41 +340,99 @@ def get_movie(id):
     Args:
         id (int): The ID of the movie to retrieve.
 
+    Query Parameters:
+        fields, links: Same sparse fieldset parameters as ``GET /api/movies``.
+
     Returns:
-        dict: A dictionary containing movie details.
+        dict: A dictionary containing movie details, or an empty 304
+        response if the ``If-None-Match`` ETag is current.
     """
-    movie = Movie.query.get_or_404(id)
-    return movie.to_dict(), 200
+    try:
+        fields, links = field_args(MOVIE_FIELDS)
+    except ValueError as e:
+        return bad_request(str(e))
+    movie = db.session.execute(sa.select(*movie_columns(fields, links, 'user_id'))
+                               .where(Movie.id == id)).first()
+    if movie is None:
+        abort(404)
+    etag = resource_etag(f'user:{movie.user_id}')
+    if response := not_modified(etag):
+        return response
+    return movie_serializer(fields, links)(movie), 200, {'ETag': f'"{etag}"'}
 
 
 @bp.route('/movies', methods=['POST'])
 @token_auth.login_required
+@idempotent
 def create_movie():
     """
     Create a new movie.
 
+    With ``GROUP_COMMIT`` enabled, the movie is inserted by the process's
+    group committer together with the other movies created at the same time.
+
     Request Body:
         dict: Must include 'name', 'year', and 'oscars' fields.
 
+    Query Parameters:
+        fields, links: Sparse fieldset of the returned movie, as for
+            ``GET /api/movies``.
+
+    Headers:
+        Idempotency-Key: Optional; a retry with the same key and body gets
+            the response of the first request instead of creating another.
+
     Returns:
         dict: A dictionary containing the created movie's details.
     """
+    try:
+        fields, links = field_args(MOVIE_FIELDS)
+    except ValueError as e:
+        return bad_request(str(e))
     data = request.get_json() or {}
-    # Validate required fields
-    required_fields = ['name', 'year', 'oscars', 'genre']
-    for field in required_fields:
-        if field not in data:
-            return bad_request(f'Must include {field} field')
-
-    # Create new movie
-    movie = Movie()
-    movie.from_dict(data)
-    # Associate the movie with the authenticated user
-    movie.user_id = token_auth.current_user().id
-    db.session.add(movie)
-    db.session.commit()
+    # Validate required fields and their values
+    error = Movie.validate(data)
+    if error:
+        return bad_request(error)
+    data, error = Movie.clean(data)
+    if error:
+        return bad_request(error)
 
-    response = movie.to_dict()
+    if current_app.config['GROUP_COMMIT']:
+        # Share a transaction with the movies created concurrently
+        row = dict(data)
+        row['user_id'] = token_auth.current_user().id
+        row['updated_at'] = utcnow()
+        future = group_committer.submit(row)
+        try:
+            id = future.result(timeout=current_app.config['GROUP_COMMIT_TIMEOUT'])
+        except TimeoutError:
+            if future.cancel():
+                return error_response(503, 'The movie could not be saved in time')
+            # Already being committed, so it may well be saved. 5xx responses
+            # release the Idempotency-Key, so a retry would insert it again.
+            return error_response(503, 'The movie may have been saved; check '
+                                       'GET /api/movies/changes before retrying')
+        except sa.exc.IntegrityError as e:
+            return bad_request(f'Movie rejected by the database: {e.orig}')
+        except sa.exc.OperationalError as e:
+            return error_response(503, f'The database is unavailable: {e.orig}')
+        except sa.exc.SQLAlchemyError:
+            current_app.logger.exception('Group commit failed')
+            return error_response(500, 'The movie could not be saved')
+        movie = SimpleNamespace(id=id, **row)
+    else:
+        # Create new movie
+        movie = Movie()
+        movie.from_dict(data)
+        # Associate the movie with the authenticated user
+        movie.user_id = token_auth.current_user().id
+        db.session.add(movie)
+        db.session.flush()
+        record_movie_changes([(None, movie_snapshot(movie))])
+        db.session.commit()
+
+    response = movie_serializer(fields, links)(movie)
     response_status = 201
     response_headers = {'Location': url_for('api.get_movie', id=movie.id, _external=True)}
     return response, response_status, response_headers
@@ -86,6 +450,13 @@ def update_movie(id):
     Request Body:
         dict: Fields to update (e.g., 'name', 'year', 'oscars').
 
+    Query Parameters:
+        fields, links: Sparse fieldset of the returned movie, as for
+            ``GET /api/movies``.
+
+    Headers:
+        If-Match: Only update the movie if its ETag is still this one.
+
     Returns:
         dict: A dictionary containing the updated movie's details.
     """
@@ -93,13 +464,24 @@ def update_movie(id):
     # Ensure that only the owner can update the movie
     if movie.user_id != token_auth.current_user().id:
         abort(403)  # Forbidden
-    data = request.get_json() or {}
+    require_match(resource_etag(f'user:{movie.user_id}'))
+    try:
+        fields, links = field_args(MOVIE_FIELDS)
+    except ValueError as e:
+        return bad_request(str(e))
+    data, error = Movie.clean(request.get_json() or {})
+    if error:
+        return bad_request(error)
 
     # Update movie
+    before = movie_snapshot(movie)
     movie.from_dict(data)
+    db.session.flush()
+    record_movie_changes([(before, movie_snapshot(movie))])
     db.session.commit()
 
-    return movie.to_dict(), 200
+    etag = resource_etag(f'user:{movie.user_id}')
+    return movie_serializer(fields, links)(movie), 200, {'ETag': f'"{etag}"'}
 
 
 @bp.route('/movies/<int:id>', methods=['DELETE'])
@@ -111,6 +493,9 @@ def delete_movie(id):
     Args:
         id (int): The ID of the movie to delete.
 
+    Headers:
+        If-Match: Only delete the movie if its ETag is still this one.
+
     Returns:
         tuple: An empty tuple with a 204 No Content status code.
     """
@@ -118,6 +503,8 @@ def delete_movie(id):
     # Ensure that only the owner can delete the movie
     if movie.user_id != token_auth.current_user().id:
         abort(403)  # Forbidden
+    require_match(resource_etag(f'user:{movie.user_id}'))
+    record_movie_changes([(movie_snapshot(movie), None)])
     db.session.delete(movie)
     db.session.commit()
     return {}, 204
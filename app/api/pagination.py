@@ -0,0 +1,244 @@
+import base64
+import json
+
+from flask import request, url_for, current_app
+import sqlalchemy as sa
+from app import db
+
+
+def page_args():
+    """
+    Read the keyset pagination parameters from the query string.
+
+    Returns:
+        tuple: ``(limit, after)`` where ``limit`` is capped at
+        ``MAX_MOVIES_PER_PAGE`` and ``after`` is the opaque cursor of the
+        last item already seen, or None for the first page.
+
+    Raises:
+        ValueError: If ``limit`` is not a positive integer.
+    """
+    try:
+        limit = int(request.args.get('limit', current_app.config['MOVIES_PER_PAGE']))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, current_app.config['MAX_MOVIES_PER_PAGE']), request.args.get('after')
+
+
+def sort_args(allowed, key):
+    """
+    Parse the ``sort`` query parameter against an allowlist of columns.
+
+    The parameter is a comma separated list of field names, each optionally
+    prefixed with ``-`` for descending order, e.g. ``sort=-oscars,year``.
+    ``key`` is always appended as the final tie breaker so that the order
+    is total, which keyset pagination requires.
+
+    Args:
+        allowed (dict): Maps public field names to columns.
+        key (Column): The unique column used as the tie breaker.
+
+    Returns:
+        list: ``(column, descending)`` tuples.
+
+    Raises:
+        ValueError: If a field is not in the allowlist or is repeated.
+    """
+    order = []
+    for field in filter(None, request.args.get('sort', '').split(',')):
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        if name not in allowed:
+            raise ValueError(f'Cannot sort by {name}')
+        if any(column is allowed[name] for column, _ in order):
+            raise ValueError(f'Cannot sort by {name} more than once')
+        order.append((allowed[name], descending))
+    if not any(column is key for column, _ in order):
+        order.append((key, False))
+    return order
+
+
+def field_args(allowed):
+    """
+    Parse the sparse fieldset parameters from the query string.
+
+    ``fields`` is a comma separated list of the fields to return, e.g.
+    ``fields=id,name,year``, and ``links=false`` leaves out the ``_links``
+    section of every item.
+
+    Args:
+        allowed (list): The fields a representation can have, in order.
+
+    Returns:
+        tuple: ``(fields, links)``; ``fields`` defaults to all of ``allowed``.
+
+    Raises:
+        ValueError: If ``fields`` is empty or names a field not in
+            ``allowed``, or ``links`` is not a boolean.
+    """
+    fields = allowed
+    if 'fields' in request.args:
+        fields = []
+        for name in filter(None, request.args['fields'].split(',')):
+            if name not in allowed:
+                raise ValueError(f'Unknown field {name}')
+            if name not in fields:
+                fields.append(name)
+        if not fields:
+            raise ValueError('fields must name at least one field')
+    links = request.args.get('links', 'true').lower()
+    if links not in ('true', 'false', '1', '0'):
+        raise ValueError('links must be true or false')
+    return fields, links in ('true', '1')
+
+
+def encode_cursor(values):
+    """
+    Encode the sort key values of the last item of a page into a cursor.
+
+    A page ordered only by id uses the plain id so the common case stays
+    readable; any other order uses an opaque URL safe token.
+    """
+    if len(values) == 1:
+        return str(values[0])
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, order):
+    """
+    Decode a cursor produced by `encode_cursor` for the given order.
+
+    Every value must have the type of its sort column, so that a tampered
+    cursor is rejected here instead of reaching the database.
+
+    Raises:
+        ValueError: If the cursor does not match the requested order.
+    """
+    try:
+        if len(order) == 1:
+            return [int(cursor)]
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid after cursor')
+    if not isinstance(values, list) or len(values) != len(order) or not all(
+            cursor_value_matches(value, column) for value, (column, _) in zip(values, order)):
+        raise ValueError('Invalid after cursor')
+    return values
+
+
+def cursor_value_matches(value, column):
+    """
+    Check that a decoded cursor value can be compared with a sort column.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return False
+    expected = column.type.python_type
+    if expected is float:
+        return not isinstance(value, str)
+    return isinstance(value, expected)
+
+
+def keyset_page(query, order, limit, after, filtered=False):
+    """
+    Fetch one page of a query using keyset pagination.
+
+    Rows are read with ``WHERE (sort key) > (cursor) ORDER BY sort key
+    LIMIT limit + 1``, so the cost of a page does not depend on how deep
+    into the collection it is. The extra row only tells us whether a next
+    page exists.
+
+    Args:
+        query (Select): The select statement to paginate; its rows must
+            carry the ``order`` columns as attributes.
+        order (list): ``(column, descending)`` tuples ending with a unique column.
+        limit (int): Maximum number of items to return.
+        after (str or None): Cursor of the last item already returned.
+        filtered (bool): Whether ``query`` carries indexed filters.
+
+    Returns:
+        tuple: ``(rows, next_cursor)``; ``next_cursor`` is None on the last page.
+
+    Raises:
+        ValueError: If ``after`` is not a valid cursor for ``order``.
+    """
+    if after is not None:
+        values = decode_cursor(after, order)
+        clauses = []
+        for i, (column, descending) in enumerate(order):
+            step = column < values[i] if descending else column > values[i]
+            clauses.append(sa.and_(*[c == v for (c, _), v in zip(order[:i], values)], step))
+        query = query.where(sa.or_(*clauses))
+    order_by = [c.desc() if descending else c for c, descending in order]
+    if filtered and len(order) == 1:
+        # Without statistics SQLite prefers walking the whole table in key
+        # order over searching the filter's index and sorting the matches.
+        # Ordering by an expression takes that plan off the table.
+        column, descending = order[0]
+        order_by = [(column + 0).desc() if descending else column + 0]
+    query = query.order_by(*order_by)
+    items = db.session.execute(query.limit(limit + 1)).all()
+    if len(items) > limit:
+        items = items[:limit]
+        return items, encode_cursor([getattr(items[-1], c.key) for c, _ in order])
+    return items, None
+
+
+def url_template(endpoint, **kwargs):
+    """
+    Build the URLs of ``endpoint`` for many ids without calling ``url_for``
+    for each of them.
+
+    The URL is built once with a placeholder id, which must be the last
+    component of the rule, and the returned function substitutes real ids
+    into it.
+
+    Args:
+        endpoint (str): An endpoint whose rule ends with ``<int:id>``.
+        **kwargs: Other URL arguments for ``endpoint``.
+
+    Returns:
+        callable: Maps an id to its external URL.
+    """
+    prefix, _, suffix = url_for(endpoint, id=0, _external=True, **kwargs).rpartition('/0')
+    prefix += '/'
+    return lambda id: f'{prefix}{id}{suffix}'
+
+
+def collection_dict(name, items, limit, next_cursor, endpoint, serialize, **kwargs):
+    """
+    Build the JSON representation of a paginated collection.
+
+    The ``_links`` URLs carry over every query parameter of the current
+    request, so filters and sort order are preserved from page to page.
+
+    Args:
+        name (str): Key under which the serialized items are returned.
+        items (list): Model instances or rows.
+        limit (int): Page size that was applied.
+        next_cursor (str or None): Cursor for the following page.
+        endpoint (str): Endpoint used to build the ``_links`` URLs.
+        serialize (callable): Turns an item into a dictionary.
+        **kwargs: Extra URL arguments for ``endpoint``.
+
+    Returns:
+        dict: The items with ``_meta`` and ``_links`` sections.
+    """
+    args = request.args.to_dict()
+    args.update(kwargs, limit=limit)
+    data = {
+        name: [serialize(item) for item in items],
+        '_meta': {
+            'limit': limit,
+            'count': len(items),
+            'next_cursor': next_cursor,
+        },
+        '_links': {
+            'self': url_for(endpoint, _external=True, **args),
+            'next': url_for(endpoint, _external=True, **dict(args, after=next_cursor))
+            if next_cursor is not None else None,
+        }
+    }
+    return data
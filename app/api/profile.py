@@ -0,0 +1,23 @@
+from flask import current_app, abort
+from app.api import bp
+from app.api.auth import token_auth
+
+
+@bp.route('/profile', methods=['GET'])
+@token_auth.login_required
+def get_profile():
+    """
+    Report the database load of every endpoint, as measured by the worker
+    process serving the request.
+
+    The report quotes SQL statements, so it is only served while
+    ``PROFILING`` is enabled and is a 404 otherwise.
+
+    Returns:
+        dict: Per endpoint number of requests, total and maximum queries
+        per request, database, serialization and slowest statement times
+        in milliseconds, and whether the endpoint runs N+1 queries.
+    """
+    if not current_app.config['PROFILING']:
+        abort(404)
+    return {'profiling': True, 'endpoints': current_app.extensions['profiling'].stats()}, 200
@@ -0,0 +1,93 @@
+from flask import request, url_for
+import sqlalchemy as sa
+from app.api import bp
+from app.models import MovieRollup
+from app import db
+from app.api.errors import bad_request
+from app.api.auth import token_auth
+from app.api.conditional import resource_etag, not_modified, cached_json
+
+# Dimensions statistics can be grouped by with the ``group_by`` parameter.
+STATS_GROUPS = {
+    'user_id': MovieRollup.user_id,
+    'year': MovieRollup.year,
+    'genre': MovieRollup.genre,
+}
+
+# Query parameters accepted as filters on statistics.
+STATS_FILTERS = {
+    'user_id': (int, lambda value: MovieRollup.user_id == value),
+    'year_min': (int, lambda value: MovieRollup.year >= value),
+    'year_max': (int, lambda value: MovieRollup.year <= value),
+    'genre': (str, lambda value: MovieRollup.genre == value),
+}
+
+
+def stats_dict():
+    """
+    Aggregate the movie rollups according to the query string.
+
+    Returns:
+        dict: One entry per group, ordered by the grouped fields.
+
+    Raises:
+        ValueError: If any query parameter is invalid.
+    """
+    groups = []
+    for name in filter(None, request.args.get('group_by', '').split(',')):
+        if name not in STATS_GROUPS:
+            raise ValueError(f'Cannot group by {name}')
+        if name not in groups:
+            groups.append(name)
+    columns = [STATS_GROUPS[name] for name in groups]
+    query = sa.select(*columns, sa.func.coalesce(sa.func.sum(MovieRollup.movies), 0),
+                      sa.func.coalesce(sa.func.sum(MovieRollup.oscars), 0))
+    for name, (type_, clause) in STATS_FILTERS.items():
+        if name in request.args:
+            try:
+                value = type_(request.args[name])
+            except ValueError:
+                raise ValueError(f'{name} must be of type {type_.__name__}')
+            query = query.where(clause(value))
+    rows = db.session.execute(query.group_by(*columns).order_by(*columns)).all()
+    stats = []
+    for row in rows:
+        group = dict(zip(groups, row))
+        if 'genre' in group:
+            group['genre'] = group['genre'] or None
+        group['movies'], group['oscars'] = row[-2:]
+        stats.append(group)
+    return {
+        'stats': stats,
+        '_meta': {'group_by': groups, 'count': len(stats)},
+        '_links': {'self': url_for('api.get_stats', _external=True, **request.args.to_dict())},
+    }
+
+
+@bp.route('/stats', methods=['GET'])
+@token_auth.login_required
+def get_stats():
+    """
+    Retrieve movie counts and Oscar totals, optionally grouped.
+
+    Statistics are read from rollups maintained on every write, so the
+    cost of a request depends on the number of groups, not of movies.
+
+    Query Parameters:
+        group_by (str): Comma separated dimensions among ``user_id``,
+            ``year`` and ``genre``; totals over all movies by default.
+        user_id (int): Only movies of this user.
+        year_min, year_max (int): Only movies released within these years.
+        genre (str): Only movies of this genre.
+
+    Returns:
+        dict: A dictionary containing one entry per group, with its
+        ``movies`` count and ``oscars`` total.
+    """
+    etag = resource_etag('movies')
+    if response := not_modified(etag):
+        return response
+    try:
+        return cached_json(etag, stats_dict)
+    except ValueError as e:
+        return bad_request(str(e))
@@ -1,9 +1,61 @@
-from flask import request, url_for, abort
+import csv
+import io
+import json
+
+from flask import request, url_for, abort, current_app, Response, stream_with_context
+import sqlalchemy as sa
 from app.api import bp
-from app.models import User
+from app.models import User, Movie
 from app import db
 from app.api.errors import bad_request
 from app.api.auth import token_auth
+from app.api.movies import movie_collection
+from app.api.conditional import resource_etag, not_modified, require_match, cached_json
+from app.api.idempotency import idempotent
+from app.events import event_stream
+from app.api.pagination import field_args, url_template
+
+# Fields of the user representation that ``fields`` can select; the email
+# address is only shown to the user who just registered.
+USER_FIELDS = ['id', 'username', 'movies_count']
+
+
+def user_columns(fields, links):
+    """
+    List the columns to select for a sparse user representation, the
+    requested fields first.
+    """
+    names = list(fields)
+    if links and 'id' not in names:
+        names.append('id')
+    return [User.__table__.c[name] for name in names]
+
+
+def user_serializer(fields=USER_FIELDS, links=True):
+    """
+    Build the function serializing users, the one representation of a user
+    every endpoint returns, or a sparse version of it.
+
+    Args:
+        fields (list): The fields to include.
+        links (bool): Whether to include the ``_links`` section.
+
+    Returns:
+        callable: Maps a row or a `User` with the needed columns to a dictionary.
+    """
+    if not links:
+        return lambda row: {field: getattr(row, field) for field in fields}
+    user_url = url_template('api.get_user')
+    movies_url = url_template('api.get_user_movies')
+
+    def serialize(row):
+        data = {field: getattr(row, field) for field in fields}
+        data['_links'] = {
+            'self': user_url(row.id),
+            'movies': movies_url(row.id),
+        }
+        return data
+    return serialize
 
 
 @bp.route('/users', methods=['GET'])
@@ -12,12 +64,21 @@ def get_users():
     """
     Retrieve all users.
 
+    Query Parameters:
+        fields (str): Comma separated fields to return, all by default.
+        links (bool): ``false`` to leave out the ``_links`` of each user.
+
     Returns:
         dict: A dictionary containing a list of users and related links.
     """
-    users = User.query.all()
+    try:
+        fields, links = field_args(USER_FIELDS)
+    except ValueError as e:
+        return bad_request(str(e))
+    users = db.session.execute(sa.select(*user_columns(fields, links))).all()
+    serialize = user_serializer(fields, links)
     data = {
-        'users': [user.to_dict() for user in users],
+        'users': [serialize(user) for user in users],
         '_links': {
             'self': url_for('api.get_users', _external=True),
         }
@@ -34,16 +95,28 @@ def get_user(id):
     Args:
         id (int): The ID of the user to retrieve.
 
+    Query Parameters:
+        fields, links: Same sparse fieldset parameters as ``GET /api/users``.
+
     Returns:
-        dict: A dictionary containing user details.
+        dict: A dictionary containing user details, or an empty 304
+        response if the ``If-None-Match`` ETag is current.
     """
     user = User.query.get_or_404(id)
     if user != token_auth.current_user():
         abort(403)  # Forbidden
-    return user.to_dict(), 200
+    try:
+        fields, links = field_args(USER_FIELDS)
+    except ValueError as e:
+        return bad_request(str(e))
+    etag = resource_etag(f'user:{id}')
+    if response := not_modified(etag):
+        return response
+    return user_serializer(fields, links)(user), 200, {'ETag': f'"{etag}"'}
 
 
 @bp.route('/users', methods=['POST'])
+@idempotent
 def create_user():
     """
     Create a new user.
@@ -51,9 +124,21 @@ def create_user():
     Request Body:
         dict: Must include 'username', 'email', and 'password' fields.
 
+    Query Parameters:
+        fields, links: Sparse fieldset of the returned user, as for
+            ``GET /api/users``; ``email`` can be selected as well.
+
+    Headers:
+        Idempotency-Key: Optional; a retry with the same key and body gets
+            the response of the first request instead of creating another.
+
     Returns:
         dict: A dictionary containing the created user's details.
     """
+    try:
+        fields, links = field_args(USER_FIELDS + ['email'])
+    except ValueError as e:
+        return bad_request(str(e))
     data = request.get_json() or {}
     # Validate required fields
     required_fields = ['username', 'email', 'password']
@@ -73,7 +158,7 @@ def create_user():
     db.session.add(user)
     db.session.commit()
 
-    response = user.to_dict(include_email=True)
+    response = user_serializer(fields, links)(user)
     response_status = 201
     response_headers = {'Location': url_for('api.get_user', id=user.id, _external=True)}
     return response, response_status, response_headers
@@ -91,12 +176,24 @@ def update_user(id):
     Request Body:
         dict: Fields to update (e.g., 'username', 'email', 'password').
 
+    Query Parameters:
+        fields, links: Sparse fieldset of the returned user, as for
+            ``GET /api/users``.
+
+    Headers:
+        If-Match: Only update the user if its ETag is still this one.
+
     Returns:
         dict: A dictionary containing the updated user's details.
     """
     user = User.query.get_or_404(id)
     if user != token_auth.current_user():
         abort(403)  # Forbidden
+    require_match(resource_etag(f'user:{id}'))
+    try:
+        fields, links = field_args(USER_FIELDS)
+    except ValueError as e:
+        return bad_request(str(e))
     data = request.get_json() or {}
 
     # Check for username and email uniqueness if they are being updated
@@ -111,30 +208,140 @@ def update_user(id):
     user.from_dict(data, new_user=False)
     db.session.commit()
 
-    return user.to_dict(), 200
+    etag = resource_etag(f'user:{id}')
+    return user_serializer(fields, links)(user), 200, {'ETag': f'"{etag}"'}
 
 
 @bp.route('/users/<int:id>/movies', methods=['GET'])
 @token_auth.login_required
 def get_user_movies(id):
     """
-    Retrieve all movies associated with a specific user.
+    Retrieve the movies associated with a specific user, one page at a time.
 
     Args:
         id (int): The ID of the user whose movies to retrieve.
 
+    Query Parameters:
+        Same filter, sort, pagination and sparse fieldset parameters as
+        ``GET /api/movies``.
+
     Returns:
-        dict: A dictionary containing a list of movies and related links.
+        dict: A dictionary containing a page of movies and related links,
+        or an empty 304 response if the ``If-None-Match`` ETag is current.
     """
     user = User.query.get_or_404(id)
     if user != token_auth.current_user():
         abort(403)  # Forbidden
-    movies = user.movies.all()
-    data = {
-        'movies': [movie.to_dict() for movie in movies],
-        '_links': {
-            'self': url_for('api.get_user_movies', id=id, _external=True),
-            'user': url_for('api.get_user', id=id, _external=True)
-        }
-    }
-    return data, 200
\ No newline at end of file
+    etag = resource_etag(f'user:{id}')
+    if response := not_modified(etag):
+        return response
+
+    def build():
+        data = movie_collection(sa.select(Movie.__table__).where(Movie.user_id == id),
+                                'api.get_user_movies', id=id)
+        data['_links']['user'] = url_for('api.get_user', id=id, _external=True)
+        return data
+
+    try:
+        return cached_json(etag, build)
+    except ValueError as e:
+        return bad_request(str(e))
+
+
+@bp.route('/users/<int:id>/movies/events', methods=['GET'])
+@token_auth.login_required
+def get_user_movie_events(id):
+    """
+    Push the creation, update and deletion of a user's movies as
+    Server-Sent Events, instead of having clients poll for them.
+
+    Each event is named ``created``, ``updated`` or ``deleted`` and carries
+    the movie's fields as JSON. A client dropped for falling too far behind
+    receives a ``dropped`` event, and should catch up with
+    ``GET /api/movies/changes`` before subscribing again.
+
+    Args:
+        id (int): The ID of the user whose movie events to stream.
+
+    Headers:
+        Last-Event-ID: Resume after this event; only supported when
+            ``EVENT_LOG_PATH`` is set.
+
+    Returns:
+        Response: A ``text/event-stream`` that stays open.
+    """
+    if id != token_auth.current_user().id:
+        abort(403)  # Forbidden
+    return event_stream(id)
+
+
+# Fields of an exported movie that ``fields`` can select, in file order
+EXPORT_FIELDS = ['id', 'name', 'year', 'oscars', 'genre', 'user_id']
+
+
+def ndjson_chunk(fields, rows):
+    """
+    Write rows as NDJSON, one object per line keyed by ``fields``.
+    """
+    return ''.join(json.dumps(dict(zip(fields, row))) + '\n' for row in rows)
+
+
+def csv_chunk(fields, rows):
+    """
+    Write rows as CSV records; the header row is written once, by the caller.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_chunk, 'application/x-ndjson'),
+    'csv': (csv_chunk, 'text/csv'),
+}
+
+
+@bp.route('/users/<int:id>/movies/export', methods=['GET'])
+@token_auth.login_required
+def export_user_movies(id):
+    """
+    Stream every movie of a user as NDJSON or CSV.
+
+    Rows are read from a server-side cursor ``EXPORT_CHUNK_SIZE`` at a time
+    and written out as soon as they are read, so memory use does not depend
+    on the size of the catalog.
+
+    Args:
+        id (int): The ID of the user whose movies to export.
+
+    Query Parameters:
+        format (str): ``ndjson`` (default) or ``csv``.
+        fields (str): Comma separated fields to export, all by default.
+
+    Returns:
+        Response: A streamed response with one movie per line.
+    """
+    user = User.query.get_or_404(id)
+    if user != token_auth.current_user():
+        abort(403)  # Forbidden
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return bad_request('format must be ndjson or csv')
+    try:
+        fields, _ = field_args(EXPORT_FIELDS)
+    except ValueError as e:
+        return bad_request(str(e))
+    query = (sa.select(*(Movie.__table__.c[name] for name in fields))
+             .where(Movie.user_id == id).order_by(Movie.id)
+             .execution_options(yield_per=current_app.config['EXPORT_CHUNK_SIZE']))
+    write_chunk, mimetype = EXPORT_FORMATS[export_format]
+
+    def generate():
+        if export_format == 'csv':
+            yield ','.join(fields) + '\r\n'
+        for rows in db.session.execute(query).partitions():
+            yield write_chunk(fields, rows)
+
+    filename = f'user_{id}_movies.{export_format}'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
@@ -0,0 +1,315 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A thread-safe, in-process LRU cache whose entries expire after a TTL.
+
+    Each worker process holds its own copy. To let a write in one process
+    invalidate the copies in the others, the cache can follow a version
+    stamp shared through the database: ``version`` is a callable returning
+    the current stamp, checked at most every ``version_interval`` seconds,
+    and the whole cache is dropped whenever the stamp has moved.
+
+    Args:
+        maxsize (int): Maximum number of entries before the least recently
+            used one is evicted.
+        ttl (float): Default lifetime of an entry in seconds; 0 disables
+            the cache.
+        version (callable, optional): Returns the shared version stamp.
+        version_interval (float): Minimum seconds between stamp checks.
+    """
+
+    def __init__(self, maxsize, ttl, version=None, version_interval=1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self.version_interval = version_interval
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._seen_version = None
+        self._version_checked = 0.0
+
+    def _sync_version(self):
+        now = time.monotonic()
+        if self.version is None or now - self._version_checked < self.version_interval:
+            return
+        self._version_checked = now
+        current = self.version()
+        if current != self._seen_version:
+            self._seen_version = current
+            self.clear()
+
+    def get(self, key):
+        """
+        Return the live value stored under ``key``, or None.
+        """
+        if not self.ttl:
+            return None
+        self._sync_version()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        """
+        Store ``value`` under ``key`` for ``ttl`` seconds, or the default TTL.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Drop the entry stored under ``key``, if any.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard(self, predicate):
+        """
+        Drop every entry whose key satisfies ``predicate``.
+        """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        """
+        Drop every entry.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Report the cache's counters.
+
+        Returns:
+            dict: Hits, misses, hit ratio, evictions and current number of entries.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': hit_ratio(self.hits, self.misses),
+                'evictions': self.evictions, 'size': len(self._data)}
+
+
+def hit_ratio(hits, misses):
+    return round(hits / (hits + misses), 4) if hits + misses else 0.0
+
+
+class LRUByteCache:
+    """
+    A thread-safe, in-process LRU cache of byte strings bounded by their
+    total size rather than by their number.
+
+    Args:
+        max_bytes (int): Budget for keys and values together; the least
+            recently used entries are evicted to stay within it.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the bytes stored under ``key``, or None.
+        """
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Store ``value`` under ``key``, unless it alone exceeds the budget.
+        """
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= len(key) + len(old)
+            self._data[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key, old = self._data.popitem(last=False)
+                self.bytes -= len(old_key) + len(old)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drop every entry.
+        """
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Report the cache's counters.
+
+        Returns:
+            dict: Hits, misses, hit ratio, evictions, number of entries and
+            bytes used.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': hit_ratio(self.hits, self.misses),
+                'evictions': self.evictions, 'size': len(self._data), 'bytes': self.bytes}
+
+
+class SQLiteByteCache:
+    """
+    A cache of byte strings kept in an SQLite file, shared by every process
+    that opens the same file.
+
+    The file is separate from the application database so that cache
+    writes never contend with data writes. Reads do not record access
+    times, which would turn every hit into a write, so the oldest entries
+    are evicted first once the total size exceeds the budget.
+
+    Args:
+        path (str): Location of the cache file, created if missing.
+        max_bytes (int): Budget for keys and values together.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+            'stored REAL NOT NULL)')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """
+        Return the bytes stored under ``key``, or None.
+        """
+        row = self._connect().execute(
+            'SELECT value FROM response_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value):
+        """
+        Store ``value`` under ``key`` and evict the oldest entries over budget.
+        """
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)',
+                               (key, value, size, time.time()))
+            excess = connection.execute(
+                'SELECT coalesce(sum(size), 0) FROM response_cache').fetchone()[0] - self.max_bytes
+            if excess > 0:
+                # Delete the oldest entries until their sizes add up to the excess
+                evicted = connection.execute(
+                    'DELETE FROM response_cache WHERE key IN ('
+                    ' SELECT key FROM (SELECT key, size, sum(size) OVER (ORDER BY stored, key)'
+                    ' AS total FROM response_cache) WHERE total - size < ?)', (excess,)).rowcount
+                self.evictions += evicted
+            connection.execute('COMMIT')
+        except sqlite3.OperationalError:
+            # A busy cache file is not worth failing the request for
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+
+    def clear(self):
+        """
+        Drop every entry.
+        """
+        self._connect().execute('DELETE FROM response_cache')
+
+    def stats(self):
+        """
+        Report the cache's counters.
+
+        Returns:
+            dict: Hits, misses and evictions seen by this process, and the
+            number of entries and bytes in the shared file.
+        """
+        size, used = self._connect().execute(
+            'SELECT count(*), coalesce(sum(size), 0) FROM response_cache').fetchone()
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': hit_ratio(self.hits, self.misses),
+                'evictions': self.evictions, 'size': size, 'bytes': used}
+
+
+class TieredCache:
+    """
+    Chain byte caches from the fastest to the most widely shared.
+
+    A lookup tries each tier in turn and copies a value found in a slower
+    tier into the faster ones; a store goes to every tier.
+
+    Args:
+        *tiers: Caches with ``get``, ``set``, ``clear`` and ``stats`` methods.
+    """
+
+    def __init__(self, *tiers):
+        self.tiers = tiers
+
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster in self.tiers[:i]:
+                    faster.set(key, value)
+                return value
+        return None
+
+    def set(self, key, value):
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def stats(self):
+        """
+        Report the counters of every tier, fastest first.
+        """
+        return [tier.stats() for tier in self.tiers]
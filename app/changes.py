@@ -0,0 +1,97 @@
+from collections import Counter
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+from app import db
+from app.models import User, Movie, MovieRollup, Generation
+from app.events import stage_movie_events
+
+
+def movie_snapshot(movie):
+    """
+    Capture the column values of a movie.
+
+    Args:
+        movie (Movie): A movie, flushed if its id is needed.
+
+    Returns:
+        dict: The movie's column values.
+    """
+    return {column.key: getattr(movie, column.key) for column in Movie.__table__.columns}
+
+
+def as_int(value):
+    """
+    Read a number the way SQLite sums an integer column, where anything
+    that is not a number counts as 0.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def update_rollups(changes):
+    """
+    Apply movie changes to the `MovieRollup` rows with one upsert for all
+    the groups they touch, and drop the groups left empty.
+    """
+    movies, oscars = Counter(), Counter()
+    for before, after in changes:
+        for snapshot, sign in ((before, -1), (after, 1)):
+            if snapshot is not None:
+                key = (snapshot['user_id'], as_int(snapshot['year']), snapshot.get('genre') or '')
+                movies[key] += sign
+                oscars[key] += sign * as_int(snapshot['oscars'])
+    keys = [key for key in movies if movies[key] or oscars[key]]
+    if not keys:
+        return
+    statement = sqlite.insert(MovieRollup).values([
+        {'user_id': user_id, 'year': year, 'genre': genre,
+         'movies': movies[user_id, year, genre], 'oscars': oscars[user_id, year, genre]}
+        for user_id, year, genre in keys])
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['user_id', 'year', 'genre'],
+        set_={'movies': MovieRollup.movies + statement.excluded.movies,
+              'oscars': MovieRollup.oscars + statement.excluded.oscars}))
+    db.session.execute(sa.delete(MovieRollup).where(
+        sa.tuple_(MovieRollup.user_id, MovieRollup.year, MovieRollup.genre).in_(keys),
+        MovieRollup.movies == 0))
+
+
+def record_movie_changes(changes):
+    """
+    Keep the data derived from the movie table in step with a write to it.
+
+    Every code path that inserts, updates or deletes movies calls this in
+    the same transaction as the write, once per statement or chunk, so the
+    derived data commits or rolls back together with the movies.
+
+    This keeps each user's ``movies_count`` and the `MovieRollup`
+    statistics up to date, bumps the version stamps the API derives its
+    ETags from: ``movies`` for the whole table and ``user:<id>`` for every
+    user whose movies changed, and queues the live events published to
+    subscribers once the transaction commits.
+
+    Args:
+        changes (list): ``(before, after)`` tuples of movie snapshots as
+            returned by `movie_snapshot`; ``before`` is None for a created
+            movie and ``after`` is None for a deleted one. Snapshots of
+            created movies may leave out a missing genre.
+    """
+    if not changes:
+        return
+    deltas = Counter()
+    for before, after in changes:
+        if before is not None:
+            deltas[before['user_id']] -= 1
+        if after is not None:
+            deltas[after['user_id']] += 1
+    for user_id, delta in deltas.items():
+        if delta:
+            db.session.execute(sa.update(User).where(User.id == user_id)
+                               .values(movies_count=User.movies_count + delta))
+    update_rollups(changes)
+    Generation.bump('movies', *(f'user:{user_id}' for user_id in deltas))
+    stage_movie_events(changes)
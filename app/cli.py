@@ -0,0 +1,68 @@
+import time
+
+import click
+import sqlalchemy as sa
+
+from app import app, db
+from app.models import User, Movie, MovieRollup, Generation
+from app.importer import import_movies, IMPORT_FORMATS
+
+
+@app.cli.command('import-movies')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--user', 'username', required=True, help='Username of the owner of the movies.')
+@click.option('--format', 'import_format', type=click.Choice(IMPORT_FORMATS),
+              help='File format; guessed from the file extension by default.')
+def import_movies_command(file, username, import_format):
+    """Import movies from a CSV or NDJSON FILE ('-' for stdin)."""
+    user = db.session.scalar(sa.select(User).where(User.username == username))
+    if user is None:
+        raise click.UsageError(f'Unknown user {username}')
+    if import_format is None:
+        import_format = 'csv' if file.name.endswith('.csv') else 'ndjson'
+    start = time.perf_counter()
+    result = import_movies(file, import_format, user.id)
+    elapsed = time.perf_counter() - start
+    for error in result['errors']:
+        click.echo(f"line {error['line']}: {error['message']}", err=True)
+    if result['errors_truncated']:
+        click.echo('further errors omitted', err=True)
+    click.echo(f"Imported {result['imported']} movies, {result['failed']} failed, "
+               f"in {elapsed:.2f}s ({result['imported'] / elapsed if elapsed else 0:.0f} rows/s)")
+
+
+@app.cli.command('check-movie-counts')
+@click.option('--repair', is_flag=True, help='Overwrite drifted counters with the real counts.')
+def check_movie_counts_command(repair):
+    """Compare each user's movies_count with the movie table."""
+    actual = (sa.select(sa.func.count(Movie.id)).where(Movie.user_id == User.id)
+              .correlate(User).scalar_subquery())
+    drifted = db.session.execute(
+        sa.select(User.id, User.username, User.movies_count, actual.label('actual'))
+        .where(User.movies_count != actual)).all()
+    for user in drifted:
+        click.echo(f'{user.username} (id {user.id}): stored {user.movies_count}, actual {user.actual}')
+    if not drifted:
+        click.echo('All movie counters are consistent')
+        return
+    if not repair:
+        raise click.ClickException(f'{len(drifted)} users have a drifted movie counter; '
+                                   'run again with --repair to fix them')
+    db.session.execute(sa.update(User).where(User.id.in_([user.id for user in drifted]))
+                       .values(movies_count=actual))
+    # Representations with the drifted counts must not be served as current
+    Generation.bump(*(f'user:{user.id}' for user in drifted))
+    db.session.commit()
+    click.echo(f'Repaired {len(drifted)} users')
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the movie statistics rollups from the movie table."""
+    start = time.perf_counter()
+    MovieRollup.rebuild()
+    # Statistics served from the old rollups must not be served as current
+    Generation.bump('movies')
+    db.session.commit()
+    groups = db.session.scalar(sa.select(sa.func.count()).select_from(MovieRollup))
+    click.echo(f'Rebuilt {groups} groups in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,137 @@
+import sqlite3
+import weakref
+
+from flask import request, has_request_context
+from flask_sqlalchemy.session import Session
+import sqlalchemy as sa
+from sqlalchemy.engine import make_url
+
+# Bind key of the read-only engine configured by ``SQLALCHEMY_READ_DATABASE_URI``
+REPLICA_BIND = 'replica'
+
+# Request methods whose queries may be answered by the replica
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class RoutingSession(Session):
+    """
+    A session sending the queries of read requests to the replica engine.
+
+    Queries of ``GET``, ``HEAD`` and ``OPTIONS`` requests go to the replica, when one is
+    configured; everything else, and everything outside of a request, goes
+    to the primary. As soon as a session flushes, executes an INSERT,
+    UPDATE or DELETE, or locks rows, it sticks to the primary until it is
+    removed at the end of the request, so a request always reads its own
+    writes.
+    """
+
+    def __init__(self, db, **kwargs):
+        super().__init__(db, **kwargs)
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self.wrote:
+            if self._flushing or (clause is not None and (
+                    getattr(clause, 'is_dml', False)
+                    or getattr(clause, '_for_update_arg', None) is not None)):
+                self.wrote = True
+            elif has_request_context() and request.method in READ_METHODS:
+                replica = self._db.engines.get(REPLICA_BIND)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def engine_options(config):
+    """
+    Build the SQLAlchemy engine options described by the configuration.
+
+    Pool settings only apply to databases held in files: Flask-SQLAlchemy
+    gives in-memory SQLite databases a single static connection.
+
+    Args:
+        config (Config): The application configuration.
+
+    Returns:
+        dict: Keyword arguments for ``create_engine``.
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def sqlite_pragmas(config):
+    """
+    List the pragmas every new SQLite connection runs, in order.
+    """
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA temp_store={config['SQLITE_TEMP_STORE']}",
+    ]
+
+
+def init_engine(app):
+    """
+    Configure the connection pool of the application, and add the replica
+    engine to the binds when a read database is configured.
+
+    Must run before Flask-SQLAlchemy creates its engines, as it reads the
+    ``SQLALCHEMY_ENGINE_OPTIONS`` and ``SQLALCHEMY_BINDS`` set here; the
+    pragmas are set up by `tune_engines` once the engines exist.
+    """
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    if app.config['SQLALCHEMY_READ_DATABASE_URI']:
+        app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **{
+            REPLICA_BIND: app.config['SQLALCHEMY_READ_DATABASE_URI']})
+
+
+# Engines whose new connections already run the pragmas
+tuned_engines = weakref.WeakSet()
+
+
+def tune_engines(engines, config):
+    """
+    Run the pragmas of `sqlite_pragmas` on every new connection of the
+    given engines, and of no other engine in the process.
+
+    Write-ahead logging lets readers proceed while a writer commits, and
+    the busy timeout makes a connection wait for a lock instead of failing
+    at once with "database is locked". Engines tuned before are skipped, so calling it again is harmless.
+
+    Args:
+        engines (iterable): The engines of the application.
+        config (Config): The application configuration.
+    """
+    pragmas = sqlite_pragmas(config)
+
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            try:
+                cursor.execute(pragma)
+            except sqlite3.OperationalError:
+                # Read-only connections cannot change the journal mode,
+                # which the primary sets for the whole file
+                if not pragma.startswith('PRAGMA journal_mode'):
+                    raise
+        cursor.close()
+
+    for engine in engines:
+        if engine not in tuned_engines:
+            sa.event.listen(engine, 'connect', set_sqlite_pragmas)
+            tuned_engines.add(engine)
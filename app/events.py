@@ -0,0 +1,399 @@
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import request, current_app, Response, abort
+import sqlalchemy as sa
+
+from app import app, db
+from app.engine import RoutingSession
+
+# Movie fields sent with every event
+EVENT_FIELDS = ['id', 'name', 'year', 'oscars', 'genre', 'user_id']
+
+# Key of the events waiting in ``Session.info`` for their transaction to commit
+PENDING_EVENTS = 'movie_events'
+
+
+class Subscription:
+    """
+    The events waiting to be sent to one client.
+
+    At most ``size`` events are held. A client that falls further behind is
+    dropped instead of being buffered without bound: its events are thrown
+    away and `dropped` is set, after which the client is expected to catch
+    up with ``GET /api/movies/changes`` and subscribe again.
+
+    Args:
+        user_id (int): The user whose movie events the client receives.
+        size (int): Maximum number of queued events.
+    """
+
+    def __init__(self, user_id, size):
+        self.user_id = user_id
+        self.size = size
+        self.dropped = False
+        self._events = deque()
+        self._ready = threading.Condition(threading.Lock())
+
+    def put(self, event):
+        """
+        Queue an event, or drop the subscription if its queue is full.
+
+        Returns:
+            bool: False if the subscription is dropped.
+        """
+        with self._ready:
+            if len(self._events) >= self.size:
+                self.dropped = True
+                self._events.clear()
+            elif not self.dropped:
+                self._events.append(event)
+            self._ready.notify()
+        return not self.dropped
+
+    def get(self, timeout):
+        """
+        Wait up to ``timeout`` seconds for the next event.
+
+        Returns:
+            tuple or None: ``(id, kind, data)``, or None on timeout or once
+            the subscription is dropped.
+        """
+        with self._ready:
+            if not self._events and not self.dropped:
+                self._ready.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+class EventLog:
+    """
+    Movie events kept in an SQLite file shared by the worker processes.
+
+    Like the shared response cache, the file is separate from the
+    application database so that events never contend with data writes.
+    ``seq`` is allocated under the file's write lock, so the events of all
+    processes are read back in the order they were appended.
+
+    Args:
+        path (str): Location of the log file, created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS movie_event ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, '
+            'kind TEXT NOT NULL, data TEXT NOT NULL, stored REAL NOT NULL)')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def append(self, events):
+        """
+        Append ``(user_id, kind, data)`` events in one transaction.
+        """
+        connection = self._connect()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT INTO movie_event (user_id, kind, data, stored) VALUES (?, ?, ?, ?)',
+                [(user_id, kind, data, now) for user_id, kind, data in events])
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+
+    def read(self, after, user_id=None, limit=1000):
+        """
+        Read the events appended after the one numbered ``after``.
+
+        Returns:
+            list: ``(seq, user_id, kind, data)`` tuples, oldest first.
+        """
+        query = 'SELECT seq, user_id, kind, data FROM movie_event WHERE seq > ?'
+        params = [after]
+        if user_id is not None:
+            query += ' AND user_id = ?'
+            params.append(user_id)
+        return self._connect().execute(query + ' ORDER BY seq LIMIT ?', params + [limit]).fetchall()
+
+    def last_seq(self):
+        """
+        Return the number of the latest event, or 0.
+        """
+        return self._connect().execute(
+            'SELECT coalesce(max(seq), 0) FROM movie_event').fetchone()[0]
+
+    def prune(self, max_age):
+        """
+        Delete the events older than ``max_age`` seconds.
+        """
+        self._connect().execute('DELETE FROM movie_event WHERE stored < ?',
+                                (time.time() - max_age,))
+
+
+class EventBus:
+    """
+    Publish movie events to the clients subscribed to them in this process.
+
+    Events are published once the transaction that wrote them commits, and
+    fanned out to the subscriptions of the movie's owner. Publishing never
+    waits for a client: subscriptions that fall ``buffer_size`` events
+    behind are dropped, so one slow client cannot hold up the others, and
+    an idle subscription costs no more than its empty queue. At most
+    ``max_subscribers`` subscriptions are held at a time.
+
+    With a ``log``, published events are appended to it instead, and a
+    thread of every process that has subscribers reads them back every
+    ``poll_interval`` seconds, so clients hear about the writes of every
+    worker. Event ids are then the log's sequence numbers, which lets
+    reconnecting clients resume from their ``Last-Event-ID``.
+
+    Args:
+        buffer_size (int): Events queued per subscription before it is dropped.
+        log (EventLog, optional): Log shared with the other processes.
+        poll_interval (float): Seconds between reads of the log.
+        retention (float): Seconds events are kept in the log.
+        max_subscribers (int): Subscriptions held at a time, 0 for no limit.
+    """
+
+    def __init__(self, buffer_size, log=None, poll_interval=0.25, retention=3600,
+                 max_subscribers=0):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.log = log
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.published = self.delivered = self.dropped = 0
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pid = None
+
+    def _ensure_polling(self):
+        # Like the group committer's writer, the poller does not survive a
+        # fork, so each worker process starts its own on first use
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                last = self.log.last_seq()
+                threading.Thread(target=self._poll, args=(last,), name='event-log',
+                                 daemon=True).start()
+
+    def _poll(self, last):
+        pruned = time.monotonic()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                while rows := self.log.read(last):
+                    last = rows[-1][0]
+                    self.deliver(rows)
+                if time.monotonic() - pruned > 60:
+                    pruned = time.monotonic()
+                    self.log.prune(self.retention)
+            except sqlite3.OperationalError:
+                # Busy log file; try again on the next round
+                continue
+
+    def subscribe(self, user_id):
+        """
+        Start receiving the movie events of a user.
+
+        Returns:
+            Subscription or None: The queue of events for the new client,
+            or None if ``max_subscribers`` are already subscribed.
+        """
+        if self.log is not None:
+            self._ensure_polling()
+        subscription = Subscription(user_id, self.buffer_size)
+        with self._lock:
+            if self.max_subscribers and \
+                    sum(map(len, self._subscriptions.values())) >= self.max_subscribers:
+                return None
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Stop delivering events to a subscription.
+        """
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, events):
+        """
+        Publish ``(user_id, kind, data)`` events, in order.
+        """
+        self.published += len(events)
+        if self.log is not None:
+            self.log.append(events)
+        else:
+            self.deliver([(next(self._ids), user_id, kind, data) for user_id, kind, data in events])
+
+    def deliver(self, events):
+        """
+        Hand ``(id, user_id, kind, data)`` events to the subscriptions of
+        this process.
+        """
+        with self._lock:
+            targets = {user_id: list(self._subscriptions.get(user_id, ()))
+                       for user_id in {event[1] for event in events}}
+        dropped = set()
+        for id, user_id, kind, data in events:
+            for subscription in targets[user_id]:
+                if subscription.put((id, kind, data)):
+                    self.delivered += 1
+                elif subscription not in dropped:
+                    dropped.add(subscription)
+                    self.unsubscribe(subscription)
+        self.dropped += len(dropped)
+
+    def replay(self, user_id, after):
+        """
+        Read back the events of a user after the id ``after`` from the log.
+
+        Returns:
+            list: ``(id, kind, data)`` tuples, empty without a log.
+        """
+        if self.log is None:
+            return []
+        return [(seq, kind, data) for seq, _, kind, data in self.log.read(after, user_id)]
+
+    def stats(self):
+        """
+        Report the number of subscriptions and of events handled.
+        """
+        with self._lock:
+            subscriptions = sum(len(s) for s in self._subscriptions.values())
+        return {'subscriptions': subscriptions, 'published': self.published,
+                'delivered': self.delivered, 'dropped': self.dropped}
+
+
+def make_event_bus(config):
+    """
+    Build the event bus described by the configuration.
+    """
+    log = EventLog(config['EVENT_LOG_PATH']) if config['EVENT_LOG_PATH'] else None
+    return EventBus(config['EVENTS_BUFFER'], log, config['EVENT_LOG_POLL_INTERVAL'],
+                    config['EVENT_LOG_RETENTION'], config['EVENTS_MAX_SUBSCRIBERS'])
+
+
+event_bus = make_event_bus(app.config)
+
+
+def stage_movie_events(changes):
+    """
+    Queue the events of movie changes until the current transaction commits.
+
+    Args:
+        changes (list): ``(before, after)`` snapshot tuples, as taken by
+            `app.changes.record_movie_changes`; they must include the ids.
+    """
+    events = db.session.info.setdefault(PENDING_EVENTS, [])
+    for before, after in changes:
+        kind = 'created' if before is None else 'deleted' if after is None else 'updated'
+        movie = after if after is not None else before
+        data = json.dumps({field: movie.get(field) for field in EVENT_FIELDS})
+        events.append((movie['user_id'], kind, data))
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def publish_movie_events(session):
+    events = session.info.pop(PENDING_EVENTS, None)
+    if events:
+        try:
+            event_bus.publish(events)
+        except sqlite3.Error as e:
+            # The data is committed already; live clients catch up through
+            # GET /api/movies/changes once they reconnect
+            app.logger.warning('Could not publish %d movie events: %s', len(events), e)
+
+
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def discard_movie_events(session):
+    session.info.pop(PENDING_EVENTS, None)
+
+
+def event_stream(user_id):
+    """
+    Stream the movie events of a user as Server-Sent Events.
+
+    The subscription is taken before the response is returned, so no
+    event committed after the request is missed. The stream holds no
+    application context or database connection while it waits, and sends
+    a comment every ``EVENTS_HEARTBEAT`` seconds to keep proxies from
+    closing it and to notice clients that went away. A client dropped for
+    being too slow receives a ``dropped`` event before the stream ends.
+
+    Waiting costs no CPU, but each open stream occupies a thread of the
+    WSGI server for as long as it lasts, so a threaded or sync server holds
+    only as many streams as it has threads to spare. Large numbers of idle
+    clients need an async server such as gevent; ``EVENTS_MAX_SUBSCRIBERS``
+    caps the streams of a process so that they cannot take every thread.
+
+    Args:
+        user_id (int): The user whose movie events are sent.
+
+    Returns:
+        Response: A ``text/event-stream`` response.
+
+    Raises:
+        HTTPException: 503 if the process already holds
+            ``EVENTS_MAX_SUBSCRIBERS`` streams.
+    """
+    subscription = event_bus.subscribe(user_id)
+    if subscription is None:
+        abort(503, 'Too many event streams are open, try again later')
+    try:
+        heartbeat = current_app.config['EVENTS_HEARTBEAT']
+        last_id = request.headers.get('Last-Event-ID', '')
+        # Resuming is only possible from the ids of the shared log
+        sent = int(last_id) if last_id.isdigit() and event_bus.log is not None else 0
+        backlog = event_bus.replay(user_id, sent) if sent else []
+    except BaseException:
+        event_bus.unsubscribe(subscription)
+        raise
+
+    def frame(id, kind, data):
+        return f'id: {id}\nevent: {kind}\ndata: {data}\n\n'
+
+    def generate():
+        nonlocal sent
+        for event in backlog:
+            sent = event[0]
+            yield frame(*event)
+        while True:
+            event = subscription.get(heartbeat)
+            if subscription.dropped:
+                yield 'event: dropped\ndata: {}\n\n'
+                return
+            if event is None:
+                yield ': keep-alive\n\n'
+            elif event[0] > sent:
+                # Skips the events already sent from the backlog
+                sent = event[0]
+                yield frame(*event)
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The server closes the response however the stream ends, even if the
+    # body was never read, which a generator's finally would not notice
+    response.call_on_close(lambda: event_bus.unsubscribe(subscription))
+    return response
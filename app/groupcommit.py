@@ -0,0 +1,136 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import sqlalchemy as sa
+
+from app import app, db
+from app.models import Movie
+from app.changes import record_movie_changes
+
+
+class GroupCommitter:
+    """
+    Coalesce movie inserts from concurrent requests into shared transactions.
+
+    Request threads hand their row to `submit` and wait on the returned
+    future. A single writer thread per process takes the first pending row,
+    collects whatever else arrives within ``window`` seconds, up to
+    ``max_batch`` rows, and inserts them all with one statement and one
+    commit, so a burst of requests pays for one commit instead of one each.
+
+    Args:
+        window (float): Seconds to wait for more rows after the first one.
+        max_batch (int): Maximum number of rows committed together.
+    """
+
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = self.rows = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        # The writer thread does not survive a fork, so each worker process
+        # starts its own on first use
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='group-commit', daemon=True).start()
+
+    def submit(self, row):
+        """
+        Queue a movie row for insertion.
+
+        Args:
+            row (dict): Column values of the new movie, without its id.
+
+        Returns:
+            Future: Resolves to the id of the inserted movie, or raises the
+            database error that rejected the row. Cancelling it before the
+            writer picks the row up keeps the row from being inserted.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((row, future))
+        return future
+
+    def _collect(self):
+        batch = []
+        while not batch:
+            self._take(batch, self._queue.get())
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                self._take(batch, self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _take(batch, item):
+        # Rows whose request gave up waiting are dropped
+        if item[1].set_running_or_notify_cancel():
+            batch.append(item)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            with app.app_context():
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    db.session.rollback()
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def _commit(self, batch):
+        rows = [row for row, _ in batch]
+        try:
+            ids = db.session.scalars(
+                sa.insert(Movie).returning(Movie.id, sort_by_parameter_order=True), rows).all()
+            record_movie_changes([(None, dict(row, id=id)) for row, id in zip(rows, ids)])
+            db.session.commit()
+        except sa.exc.IntegrityError:
+            db.session.rollback()
+            ids = self._commit_one_by_one(batch)
+        self.batches += 1
+        self.rows += len(batch)
+        for (_, future), id in zip(batch, ids):
+            if id is not None:
+                future.set_result(id)
+
+    def _commit_one_by_one(self, batch):
+        # Isolate the rows the database rejects, each in its own savepoint
+        ids = []
+        for row, future in batch:
+            try:
+                with db.session.begin_nested():
+                    id = db.session.scalar(sa.insert(Movie).returning(Movie.id), row)
+                ids.append(id)
+            except sa.exc.IntegrityError as e:
+                future.set_exception(e)
+                ids.append(None)
+        record_movie_changes([(None, dict(row, id=id))
+                              for (row, _), id in zip(batch, ids) if id is not None])
+        db.session.commit()
+        return ids
+
+    def stats(self):
+        """
+        Report how many rows were committed in how many transactions.
+        """
+        return {'batches': self.batches, 'rows': self.rows,
+                'rows_per_batch': round(self.rows / self.batches, 2) if self.batches else 0.0}
+
+
+group_committer = GroupCommitter(app.config['GROUP_COMMIT_WINDOW'],
+                                 app.config['GROUP_COMMIT_MAX_BATCH'])
@@ -0,0 +1,227 @@
+import csv
+import json
+from itertools import islice
+
+import sqlalchemy as sa
+from flask import current_app
+
+from app import db
+from app.models import Movie, defer_movie_fts, index_movie_fts
+from app.changes import record_movie_changes
+
+IMPORT_FORMATS = ['csv', 'ndjson']
+
+
+def parse_ndjson(lines):
+    """
+    Parse newline delimited JSON one line at a time.
+
+    Args:
+        lines (iterable): Text lines of the upload.
+
+    Yields:
+        tuple: ``(line_number, data, error)``; exactly one of ``data`` and
+        ``error`` is set.
+    """
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f'Invalid JSON: {e}'
+            continue
+        if isinstance(data, dict):
+            yield line_number, data, None
+        else:
+            yield line_number, None, 'Each line must be a JSON object'
+
+
+def parse_csv(lines):
+    """
+    Parse CSV with a header row one record at a time.
+
+    Empty cells are read as null values. A record the csv module rejects is
+    reported with the line it failed on, and parsing resumes on the next
+    line; a header it rejects ends the import, since no record can be read
+    without it.
+
+    Args:
+        lines (iterable): Text lines of the upload.
+
+    Yields:
+        tuple: ``(line_number, data, error)``; exactly one of ``data`` and
+        ``error`` is set.
+    """
+    # The reader does not count the line it fails on, so count them here
+    consumed = 0
+
+    def counted():
+        nonlocal consumed
+        for line in lines:
+            consumed += 1
+            yield line
+
+    reader = csv.DictReader(counted())
+    try:
+        reader.fieldnames
+    except csv.Error as e:
+        yield consumed, None, f'Invalid CSV header: {e}'
+        return
+    while True:
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield consumed, None, f'Invalid CSV: {e}'
+            continue
+        data = {key: value or None for key, value in record.items()
+                if key is not None and value is not None}
+        yield reader.line_num, data, None
+
+
+PARSERS = {'csv': parse_csv, 'ndjson': parse_ndjson}
+
+
+# Rows are handed to the driver as plain tuples, skipping the per row
+# parameter processing SQLAlchemy would otherwise do. SQLite fills in
+# ``updated_at`` in the format SQLAlchemy stores datetimes in.
+INSERT_COLUMNS = ['name', 'year', 'oscars', 'genre', 'user_id']
+INSERT_VALUES = '({}, {})'.format(', '.join('?' * len(INSERT_COLUMNS)),
+                                  "strftime('%Y-%m-%d %H:%M:%f000', 'now')")
+INSERT_INTO = 'INSERT INTO movie ({}, updated_at) VALUES '.format(', '.join(INSERT_COLUMNS))
+INSERT_MOVIE = INSERT_INTO + INSERT_VALUES
+
+# sqlite3's executemany discards RETURNING rows, so chunks are inserted with
+# multi-row VALUES statements instead, within SQLite's limit of 32766 bound
+# parameters per statement
+ROWS_PER_INSERT = 32766 // len(INSERT_COLUMNS)
+RETURNED_COLUMNS = ['id'] + INSERT_COLUMNS
+
+
+def insert_movies(rows):
+    """
+    Insert rows of `INSERT_COLUMNS` values and read them back with their ids.
+
+    Returns:
+        list: A dictionary of column values per inserted row, in no
+        particular order.
+    """
+    inserted = []
+    for start in range(0, len(rows), ROWS_PER_INSERT):
+        batch = rows[start:start + ROWS_PER_INSERT]
+        statement = '{}{} RETURNING {}'.format(
+            INSERT_INTO, ', '.join([INSERT_VALUES] * len(batch)), ', '.join(RETURNED_COLUMNS))
+        inserted += db.session.connection().exec_driver_sql(
+            statement, tuple(value for row in batch for value in row)).all()
+    return [dict(zip(RETURNED_COLUMNS, row)) for row in inserted]
+
+
+def movie_row(data, user_id):
+    """
+    Validate one imported record and turn it into a row for `INSERT_MOVIE`.
+
+    Applies the same required field check as ``POST /api/movies``, and
+    converts the numeric fields, which arrive as strings from CSV.
+
+    Returns:
+        tuple: ``(row, error)``; exactly one of them is set.
+    """
+    error = Movie.validate(data)
+    if error:
+        return None, error
+    values, error = Movie.clean(data)
+    if error:
+        return None, error
+    return tuple(values[column] for column in INSERT_COLUMNS[:-1]) + (user_id,), None
+
+
+def insert_chunk(rows):
+    """
+    Insert one chunk of rows in its own transaction.
+
+    The whole chunk is written with `insert_movies`, which reads the ids
+    back as it inserts, and indexed for search in one go. Should the database reject it, the chunk
+    is retried row by row inside savepoints so that only the offending rows
+    are lost.
+
+    Args:
+        rows (list): ``(line_number, row)`` tuples.
+
+    Returns:
+        list: ``(line_number, message)`` tuples for the rows that failed.
+    """
+    errors = []
+    try:
+        after = defer_movie_fts()
+        inserted = insert_movies([row for _, row in rows])
+        index_movie_fts(after)
+        record_movie_changes([(None, movie) for movie in inserted])
+        db.session.commit()
+        return errors
+    except sa.exc.IntegrityError:
+        db.session.rollback()
+    inserted = []
+    for line_number, row in rows:
+        try:
+            with db.session.begin_nested():
+                result = db.session.connection().exec_driver_sql(INSERT_MOVIE, row)
+            inserted.append((result.lastrowid, row))
+        except sa.exc.IntegrityError as e:
+            errors.append((line_number, str(e.orig)))
+    record_movie_changes([(None, dict(zip(INSERT_COLUMNS, row), id=id)) for id, row in inserted])
+    db.session.commit()
+    return errors
+
+
+def import_movies(lines, import_format, user_id):
+    """
+    Stream movies from an upload into the database.
+
+    Records are parsed lazily and inserted in chunks of ``IMPORT_CHUNK_SIZE``,
+    so memory use is bounded by the chunk size, not by the file size.
+    Invalid records are reported and skipped. Every committed chunk stays
+    committed even if a later one fails.
+
+    Args:
+        lines (iterable): Text lines of the upload.
+        import_format (str): One of `IMPORT_FORMATS`.
+        user_id (int): Owner of the imported movies.
+
+    Returns:
+        dict: Number of imported and failed records, and the first
+        ``MAX_IMPORT_ERRORS`` errors with their line numbers.
+    """
+    chunk_size = current_app.config['IMPORT_CHUNK_SIZE']
+    max_errors = current_app.config['MAX_IMPORT_ERRORS']
+    imported = failed = 0
+    errors = []
+
+    def report(line_number, message):
+        nonlocal failed
+        failed += 1
+        if len(errors) < max_errors:
+            errors.append({'line': line_number, 'message': message})
+
+    records = PARSERS[import_format](lines)
+    while chunk := list(islice(records, chunk_size)):
+        rows = []
+        for line_number, data, error in chunk:
+            if data is not None:
+                row, error = movie_row(data, user_id)
+            if error:
+                report(line_number, error)
+            else:
+                rows.append((line_number, row))
+        if rows:
+            chunk_errors = insert_chunk(rows)
+            for line_number, message in chunk_errors:
+                report(line_number, message)
+            imported += len(rows) - len(chunk_errors)
+    return {
+        'imported': imported,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': failed > len(errors),
+    }
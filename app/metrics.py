@@ -0,0 +1,294 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import g, request
+import sqlalchemy as sa
+
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Type and help text of every metric, in the order they are exposed
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status code.'),
+    'http_request_duration_seconds': ('histogram', 'Time spent handling requests, by endpoint.'),
+    'http_requests_in_flight': ('gauge', 'Requests being handled.'),
+    'db_pool_checkouts_total': ('counter', 'Connections checked out of the database pools.'),
+    'db_pool_checked_out': ('gauge', 'Connections currently checked out of the database pools.'),
+    'cache_hits_total': ('counter', 'Lookups answered by the authentication caches.'),
+    'cache_misses_total': ('counter', 'Lookups the authentication caches could not answer.'),
+}
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """
+    Request, database pool and cache metrics in the Prometheus text format.
+
+    Recording a request only takes a lock and updates a few integers, so
+    that instrumentation stays within a few microseconds per request.
+
+    Every worker process counts on its own. With a ``directory``, each of
+    them writes a snapshot of its counters to ``<pid>-<start time>.json``
+    in it at most every ``flush_interval`` seconds, and always when it
+    serves ``/metrics``, which adds up the snapshots of all processes. The
+    start time keeps a worker that reuses the pid of an exited one from
+    overwriting its snapshot. Counters of workers that exited are kept so
+    that totals never go backwards, while gauges only count live
+    processes, and only the latest worker of a pid. The directory should
+    be emptied whenever the server is restarted, as Prometheus expects of
+    counters.
+
+    Args:
+        directory (str, optional): Directory shared by the worker processes.
+        flush_interval (float): Seconds between two snapshots of a worker.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.requests = defaultdict(int)
+        self.latency = {}
+        self.in_flight = 0
+        self.pool_checkouts = defaultdict(int)
+        self.pool_checked_out = defaultdict(int)
+        self.caches = {}
+        self.started = time.time_ns()
+        self._lock = threading.Lock()
+        self._flushed = 0.0
+
+    def add_cache(self, name, cache):
+        """
+        Expose the hits and misses of a cache with a ``stats`` method.
+        """
+        self.caches[name] = cache
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def observe(self, endpoint, method, status, duration):
+        """
+        Count a handled request and add its duration to the histogram.
+        """
+        bucket = bisect_left(LATENCY_BUCKETS, duration)
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            histogram = self.latency.get(endpoint)
+            if histogram is None:
+                # One count per bucket and +Inf, then the sum of durations
+                histogram = self.latency[endpoint] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[bucket] += 1
+            histogram[-1] += duration
+        if self.directory and time.monotonic() - self._flushed > self.flush_interval:
+            try:
+                self.flush()
+            except OSError:
+                # Not worth failing the request for; the next one retries
+                pass
+
+    def add_pool(self, name):
+        """
+        Expose a connection pool, reported from 0 until it is first used.
+        """
+        with self._lock:
+            self.pool_checkouts[name] += 0
+            self.pool_checked_out[name] += 0
+
+    def pool_checkout(self, name):
+        with self._lock:
+            self.pool_checkouts[name] += 1
+            self.pool_checked_out[name] += 1
+
+    def pool_checkin(self, name):
+        with self._lock:
+            self.pool_checked_out[name] -= 1
+
+    def snapshot(self):
+        """
+        Capture the metrics of this process.
+
+        Returns:
+            dict: The process id and start time, ``counters`` and ``gauges`` as
+            ``[name, labels, value]`` lists and the latency ``histograms``
+            by endpoint.
+        """
+        with self._lock:
+            counters = [['http_requests_total',
+                         [['endpoint', endpoint], ['method', method], ['status', status]], count]
+                        for (endpoint, method, status), count in self.requests.items()]
+            counters += [['db_pool_checkouts_total', [['pool', name]], count]
+                         for name, count in self.pool_checkouts.items()]
+            gauges = [['http_requests_in_flight', [], self.in_flight]]
+            gauges += [['db_pool_checked_out', [['pool', name]], count]
+                       for name, count in self.pool_checked_out.items()]
+            histograms = {endpoint: list(histogram) for endpoint, histogram in self.latency.items()}
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            counters.append(['cache_hits_total', [['cache', name]], stats['hits']])
+            counters.append(['cache_misses_total', [['cache', name]], stats['misses']])
+        return {'pid': os.getpid(), 'started': self.started, 'counters': counters,
+                'gauges': gauges, 'histograms': histograms}
+
+    def flush(self, snapshot=None):
+        """
+        Write the snapshot of this process to the shared directory.
+        """
+        self._flushed = time.monotonic()
+        snapshot = snapshot or self.snapshot()
+        path = os.path.join(self.directory, f"{snapshot['pid']}-{snapshot['started']}.json")
+        # Readers only ever see complete snapshots
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temporary, path)
+
+    def collect(self):
+        """
+        Add up the snapshots of every worker process.
+
+        Returns:
+            tuple: ``(samples, histograms)``; ``samples`` maps
+            ``(name, labels)`` to a value, ``histograms`` maps endpoints to
+            bucket counts followed by the sum of durations.
+        """
+        snapshot = self.snapshot()
+        snapshots = [snapshot]
+        if self.directory:
+            self.flush(snapshot)
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        # Only the latest worker of a pid can still be running
+        latest = {}
+        for other in snapshots:
+            latest[other['pid']] = max(latest.get(other['pid'], 0), other['started'])
+        samples = defaultdict(float)
+        histograms = {}
+        for other in snapshots:
+            if other['pid'] == snapshot['pid']:
+                alive = other['started'] == snapshot['started']
+            else:
+                alive = other['started'] == latest[other['pid']] and pid_alive(other['pid'])
+            for name, labels, value in other['counters'] + (other['gauges'] if alive else []):
+                samples[name, tuple(map(tuple, labels))] += value
+            for endpoint, histogram in other['histograms'].items():
+                total = histograms.setdefault(endpoint, [0] * len(histogram[:-1]) + [0.0])
+                for i, value in enumerate(histogram):
+                    total[i] += value
+        return samples, histograms
+
+    def render(self):
+        """
+        Render the metrics of all processes in the Prometheus text format.
+        """
+        samples, histograms = self.collect()
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'histogram':
+                for endpoint, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram):
+                        cumulative += count
+                        labels = format_labels((('endpoint', endpoint), ('le', bound)))
+                        lines.append(f'{name}_bucket{labels} {cumulative}')
+                    labels = format_labels((('endpoint', endpoint),))
+                    lines.append(f'{name}_sum{labels} {histogram[-1]}')
+                    lines.append(f'{name}_count{labels} {cumulative}')
+                continue
+            for (sample, labels), value in sorted(samples.items()):
+                if sample == name:
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app, engines):
+    """
+    Record metrics for every request and serve them on ``/metrics``.
+
+    Requests are labelled with the name of the endpoint that handled them,
+    as registered on the application or the ``api`` blueprint, so that the
+    number of label values stays bounded; requests matching no route are
+    counted under ``unmatched``. Only the pools of ``engines``, the engines
+    of the application by bind key, are counted, labelled ``primary`` for
+    the default bind and with the bind key otherwise. The metrics object is
+    kept in ``app.extensions['metrics']``, and calling it again does
+    nothing.
+    """
+    if 'metrics' in app.extensions:
+        return
+    metrics = app.extensions['metrics'] = Metrics(app.config['METRICS_DIR'],
+                                                  app.config['METRICS_FLUSH_INTERVAL'])
+    if metrics.directory:
+        os.makedirs(metrics.directory, exist_ok=True)
+
+    @app.before_request
+    def start_request():
+        g.request_started = time.perf_counter()
+        metrics.request_started()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.get('request_started')
+        if started is not None:
+            metrics.observe(request.endpoint or 'unmatched', request.method,
+                            response.status_code, time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def end_request(error):
+        if g.pop('request_started', None) is not None:
+            metrics.request_finished()
+
+    def watch_pool(name, pool):
+        metrics.add_pool(name)
+
+        @sa.event.listens_for(pool, 'checkout')
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            metrics.pool_checkout(name)
+
+        @sa.event.listens_for(pool, 'checkin')
+        def checkin(dbapi_connection, connection_record):
+            metrics.pool_checkin(name)
+
+    for bind, engine in engines.items():
+        watch_pool(bind or 'primary', engine.pool)
+
+    @app.route('/metrics', endpoint='metrics')
+    def serve_metrics():
+        return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
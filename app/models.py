@@ -5,10 +5,62 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from flask import url_for
+from sqlalchemy.dialects import sqlite
+import hashlib
+import hmac
 import secrets
 
-from app import db, login
+from app import app, db, login
+from app.cache import TTLCache
+
+
+# Generation model holding version stamps shared by all worker processes
+class Generation(db.Model):
+    __tablename__ = 'generation'
+    key: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    value: so.Mapped[int] = so.mapped_column(default=0)
+
+    @staticmethod
+    def current(key):
+        """
+        Return the current value of a version stamp, 0 if it was never bumped.
+        """
+        return db.session.scalar(sa.select(Generation.value).where(Generation.key == key)) or 0
+
+    @staticmethod
+    def bump(*keys):
+        """
+        Increment one or more version stamps as part of the current transaction.
+        """
+        statement = sqlite.insert(Generation).values([{'key': key, 'value': 1} for key in keys])
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['key'], set_={'value': Generation.value + 1}))
+
+
+# Bearer tokens recently verified by this process, mapped to the user id
+# and expiration of the token. Revoking or rotating a token bumps the
+# ``tokens`` stamp so that every process drops its cached tokens.
+token_cache = TTLCache(app.config['TOKEN_CACHE_SIZE'], app.config['TOKEN_CACHE_TTL'],
+                       version=lambda: Generation.current('tokens'),
+                       version_interval=app.config['CACHE_VERSION_INTERVAL'])
+
+# Passwords recently verified by this process. Keys pair the username with
+# a keyed digest of the password, never the password itself, and values are
+# the password hash the password was checked against, so a cached entry
+# stops matching as soon as the password changes anywhere.
+password_cache = TTLCache(app.config['PASSWORD_CACHE_SIZE'], app.config['PASSWORD_CACHE_TTL'])
+
+
+# Users recently loaded by Flask-Login in this process, mapped to their
+# profile fields. Profile and password changes bump the ``users`` stamp so
+# that every process drops its cached users.
+user_cache = TTLCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'],
+                      version=lambda: Generation.current('users'),
+                      version_interval=app.config['CACHE_VERSION_INTERVAL'])
+
+# Hits and misses of the caches are exposed on /metrics
+for name, cache in (('tokens', token_cache), ('passwords', password_cache), ('users', user_cache)):
+    app.extensions['metrics'].add_cache(name, cache)
 
 
 # User model representing the users table
@@ -24,35 +76,32 @@ class User(UserMixin, db.Model):
     token: so.Mapped[Optional[str]] = so.mapped_column(
         sa.String(32), index=True, unique=True)
     token_expiration: so.Mapped[Optional[datetime]]
+    # Kept in step with the movie table by `app.changes.record_movie_changes`
+    movies_count: so.Mapped[int] = so.mapped_column(default=0, server_default='0')
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
+        password_cache.discard(lambda key: key[0] == self.username)
+        if self.id is not None:
+            self.forget_profile()
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
-    def to_dict(self, include_email=False):
         """
-        Serializes the User instance to a dictionary.
-
-        Args:
-            include_email (bool): If True, includes the user's email in the output.
+        Check a password against the user's password hash.
 
-        Returns:
-            dict: A dictionary representation of the user.
-        """
-        data = {
-            'id': self.id,
-            'username': self.username,
-            'movies_count': self.movies.count(),
-            '_links': {
-                'self': url_for('api.get_user', id=self.id, _external=True),
-                'movies': url_for('api.get_user_movies', id=self.id, _external=True)
-            }
-        }
-        if include_email:
-            data['email'] = self.email
-        return data
+        Successful checks are cached for ``PASSWORD_CACHE_TTL`` seconds, so
+        clients logging in repeatedly skip the deliberately slow key
+        derivation. Failed checks are never cached and always pay its full
+        cost.
+        """
+        key = (self.username, hmac.new(app.config['SECRET_KEY'].encode(), password.encode(),
+                                       hashlib.sha256).digest())
+        if self.password_hash is not None and password_cache.get(key) == self.password_hash:
+            return True
+        if not check_password_hash(self.password_hash, password):
+            return False
+        password_cache.set(key, self.password_hash)
+        return True
 
     def from_dict(self, data, new_user=False):
         """
@@ -67,6 +116,16 @@ class User(UserMixin, db.Model):
                 setattr(self, field, data[field])
         if new_user and 'password' in data:
             self.set_password(data['password'])
+        if not new_user:
+            self.forget_profile()
+
+    def forget_profile(self):
+        """
+        Drop the user from the user caches of all processes and change the
+        ETag of its representation.
+        """
+        user_cache.invalidate(self.id)
+        Generation.bump('users', f'user:{self.id}')
 
     def get_token(self, expires_in=3600):
         """
@@ -83,6 +142,8 @@ class User(UserMixin, db.Model):
         if self.token and self.token_expiration.replace(
                 tzinfo=timezone.utc) > now + timedelta(seconds=60):
             return self.token
+        if self.token:
+            self.forget_token()
         self.token = secrets.token_hex(16)
         self.token_expiration = now + timedelta(seconds=expires_in)
         db.session.add(self)
@@ -93,51 +154,82 @@ class User(UserMixin, db.Model):
         Revoke the user's token manually expiring it.
         """
         self.token_expiration = datetime.now(timezone.utc) - timedelta(seconds=1)
+        self.forget_token()
+
+    def forget_token(self):
+        """
+        Drop the user's current token from the token caches of all processes.
+        """
+        token_cache.invalidate(self.token)
+        Generation.bump('tokens')
 
     @staticmethod
     def check_token(token):
+        """
+        Return the user owning a valid token, or None.
+
+        Tokens found valid are cached for up to ``TOKEN_CACHE_TTL`` seconds,
+        never beyond their expiration. A cache hit costs no query: the user
+        is attached to the session with only its id and token loaded, and
+        any other attribute is loaded on first access.
+        """
+        now = datetime.now(timezone.utc)
+        cached = token_cache.get(token)
+        if cached is not None:
+            user_id, expiration = cached
+            if expiration.replace(tzinfo=timezone.utc) < now:
+                token_cache.invalidate(token)
+                return None
+            user = User(id=user_id, token=token, token_expiration=expiration)
+            so.make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
         user = db.session.scalar(sa.select(User).where(User.token == token))
-        if user is None or user.token_expiration.replace(
-                tzinfo=timezone.utc) < datetime.now(timezone.utc):
+        if user is None or user.token_expiration.replace(tzinfo=timezone.utc) < now:
             return None
+        lifetime = (user.token_expiration.replace(tzinfo=timezone.utc) - now).total_seconds()
+        token_cache.set(token, (user.id, user.token_expiration), ttl=lifetime)
         return user
 
     def __repr__(self):
         return f'<User {self.username}>'
 
 
+def utcnow():
+    """
+    Return the current time in UTC, the time zone of every stored timestamp.
+    """
+    return datetime.now(timezone.utc)
+
+
+def isoformat(value):
+    """
+    Format a stored timestamp as ISO-8601 in UTC, always with microseconds.
+    """
+    return value.replace(tzinfo=timezone.utc).isoformat(timespec='microseconds')
+
+
 # Movie model representing the movies table
 class Movie(db.Model):
     __tablename__ = 'movie'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Composite indexes backing the filters and sort orders of the API
+        sa.Index('ix_movie_user_id_year', 'user_id', 'year'),
+        sa.Index('ix_movie_genre_year', 'genre', 'year'),
+        {'extend_existing': True},
+    )
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
-    name: so.Mapped[str] = so.mapped_column(sa.String(100), nullable=False)
-    year: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
-    oscars: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    name: so.Mapped[str] = so.mapped_column(sa.String(100), index=True, nullable=False)
+    year: so.Mapped[int] = so.mapped_column(sa.Integer, index=True, nullable=False)
+    oscars: so.Mapped[int] = so.mapped_column(sa.Integer, index=True, nullable=False)
     genre: so.Mapped[Optional[str]] = so.mapped_column(sa.String(50), nullable=True)
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
+    updated_at: so.Mapped[datetime] = so.mapped_column(
+        default=utcnow, onupdate=utcnow, server_default='1970-01-01 00:00:00.000000')
     user: so.Mapped['User'] = so.relationship('User', back_populates='movies')
 
-    def to_dict(self):
-        """
-        Serializes the Movie instance to a dictionary.
-
-        Returns:
-            dict: A dictionary representation of the movie.
-        """
-        data = {
-            'id': self.id,
-            'name': self.name,
-            'year': self.year,
-            'oscars': self.oscars,
-            'genre': self.genre,
-            'user_id': self.user_id,
-            '_links': {
-                'self': url_for('api.get_movie', id=self.id, _external=True),
-                'user': url_for('api.get_user', id=self.user_id, _external=True)
-            }
-        }
-        return data
+    # Fields clients may set, and the ones a new movie must include
+    FIELDS = ['name', 'year', 'oscars', 'genre']
+    REQUIRED_FIELDS = ['name', 'year', 'oscars', 'genre']
 
     def from_dict(self, data):
         """
@@ -146,10 +238,221 @@ class Movie(db.Model):
         Args:
             data (dict): A dictionary containing movie data.
         """
-        for field in ['name', 'year', 'oscars', 'genre']:
+        for field in self.FIELDS:
             if field in data:
                 setattr(self, field, data[field])
 
+    @staticmethod
+    def validate(data):
+        """
+        Check that a dictionary holds everything needed to create a movie.
+
+        Args:
+            data (dict): A dictionary containing movie data.
+
+        Returns:
+            str or None: An error message, or None if the data is valid.
+        """
+        for field in Movie.REQUIRED_FIELDS:
+            if field not in data:
+                return f'Must include {field} field'
+
+    @staticmethod
+    def clean(data):
+        """
+        Check the values of the movie fields a dictionary holds.
+
+        Numeric fields are converted to integers, so that the strings read
+        from CSV are accepted as well.
+
+        Args:
+            data (dict): A dictionary containing movie data.
+
+        Returns:
+            tuple: ``(values, error)``; the converted values of the fields
+            present in ``data``, or an error message.
+        """
+        values = {}
+        for field in Movie.FIELDS:
+            if field not in data:
+                continue
+            value = data[field]
+            if field == 'name':
+                if not isinstance(value, str) or not value:
+                    return None, 'name must be a non-empty string'
+            elif field == 'genre':
+                if value is not None and not isinstance(value, str):
+                    return None, 'genre must be a string'
+            else:
+                try:
+                    if isinstance(value, (bool, float)):
+                        raise TypeError
+                    value = int(value)
+                except (TypeError, ValueError):
+                    return None, f'{field} must be an integer'
+            values[field] = value
+        return values, None
+
+
+# Movie counts and Oscar totals per user, year and genre, kept up to date
+# by `app.changes.record_movie_changes` so that statistics are read from a
+# row per group instead of a row per movie. Movies without a genre are
+# counted under the empty string, as a primary key cannot hold NULL.
+class MovieRollup(db.Model):
+    __tablename__ = 'movie_rollup'
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), primary_key=True)
+    year: so.Mapped[int] = so.mapped_column(primary_key=True)
+    genre: so.Mapped[str] = so.mapped_column(sa.String(50), primary_key=True)
+    movies: so.Mapped[int] = so.mapped_column(default=0)
+    oscars: so.Mapped[int] = so.mapped_column(default=0)
+
+    @staticmethod
+    def rebuild():
+        """
+        Recompute every rollup from the movie table in the current transaction.
+        """
+        genre = sa.func.coalesce(Movie.genre, '')
+        db.session.execute(sa.delete(MovieRollup))
+        db.session.execute(sa.insert(MovieRollup).from_select(
+            ['user_id', 'year', 'genre', 'movies', 'oscars'],
+            sa.select(Movie.user_id, Movie.year, genre, sa.func.count(), sa.func.sum(Movie.oscars))
+            .group_by(Movie.user_id, Movie.year, genre)))
+
+
+# The latest change of every movie, for clients syncing with
+# ``GET /api/movies/changes``. Triggers on the movie table replace the row
+# of a movie on every insert, update and delete, whichever code path issues
+# them, so each movie appears once and a deleted one is left as a
+# tombstone. ``seq`` is allocated while the transaction holds SQLite's
+# write lock, which makes it grow in commit order and never be reused.
+class MovieChange(db.Model):
+    __tablename__ = 'movie_change'
+    __table_args__ = {'sqlite_autoincrement': True}
+    seq: so.Mapped[int] = so.mapped_column(primary_key=True)
+    movie_id: so.Mapped[int] = so.mapped_column(unique=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
+    deleted: so.Mapped[bool] = so.mapped_column(default=False)
+
+
+# The migration creating these triggers holds a copy of the statements.
+MOVIE_CHANGE_DDL = [
+    """CREATE TRIGGER IF NOT EXISTS movie_change_ai AFTER INSERT ON movie BEGIN
+        INSERT OR REPLACE INTO movie_change (movie_id, user_id, deleted) VALUES (new.id, new.user_id, 0);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS movie_change_au AFTER UPDATE ON movie BEGIN
+        INSERT OR REPLACE INTO movie_change (movie_id, user_id, deleted) VALUES (new.id, new.user_id, 0);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS movie_change_ad AFTER DELETE ON movie BEGIN
+        INSERT OR REPLACE INTO movie_change (movie_id, user_id, deleted) VALUES (old.id, old.user_id, 1);
+    END""",
+]
+
+for statement in MOVIE_CHANGE_DDL:
+    sa.event.listen(MovieChange.__table__, 'after_create',
+                    sa.DDL(statement).execute_if(dialect='sqlite'))
+
+
+# Responses to requests sent with an ``Idempotency-Key`` header, see
+# `app.api.idempotency`. ``scope`` is the id of the authenticated user, or
+# empty for anonymous requests, and ``status`` stays NULL while the first
+# request holding the key is still being processed.
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_key'
+    scope: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    key: so.Mapped[str] = so.mapped_column(sa.String(255), primary_key=True)
+    fingerprint: so.Mapped[str] = so.mapped_column(sa.String(64))
+    status: so.Mapped[Optional[int]]
+    headers: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    body: so.Mapped[Optional[bytes]] = so.mapped_column(sa.LargeBinary)
+    created_at: so.Mapped[datetime] = so.mapped_column(index=True)
+
+
+# Full-text index over movie names and genres. It is an external content
+# FTS5 table: the text lives only in ``movie`` and the triggers keep the
+# index in sync with every insert, update and delete, whichever code path
+# issues them. Bulk imports switch the insert trigger off for the duration
+# of their transaction and index each chunk with a single statement, see
+# `defer_movie_fts`. The migrations creating these objects hold a copy of
+# the statements.
+MOVIE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS movie_fts USING fts5(
+        name, genre, content='movie', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    'CREATE TABLE IF NOT EXISTS movie_fts_deferred (active INTEGER NOT NULL)',
+    'INSERT INTO movie_fts_deferred (active) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM movie_fts_deferred)',
+    """CREATE TRIGGER IF NOT EXISTS movie_fts_ai AFTER INSERT ON movie
+    WHEN NOT (SELECT active FROM movie_fts_deferred) BEGIN
+        INSERT INTO movie_fts(rowid, name, genre) VALUES (new.id, new.name, new.genre);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS movie_fts_ad AFTER DELETE ON movie BEGIN
+        INSERT INTO movie_fts(movie_fts, rowid, name, genre)
+        VALUES ('delete', old.id, old.name, old.genre);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS movie_fts_au AFTER UPDATE OF name, genre ON movie BEGIN
+        INSERT INTO movie_fts(movie_fts, rowid, name, genre)
+        VALUES ('delete', old.id, old.name, old.genre);
+        INSERT INTO movie_fts(rowid, name, genre) VALUES (new.id, new.name, new.genre);
+    END""",
+]
+
+# Lightweight handle for querying the index; ``rank`` is its BM25 score.
+movie_fts = sa.table('movie_fts', sa.column('rowid', sa.Integer), sa.column('rank', sa.Float))
+
+for statement in MOVIE_FTS_DDL:
+    sa.event.listen(Movie.__table__, 'after_create',
+                    sa.DDL(statement).execute_if(dialect='sqlite'))
+for table in ('movie_fts', 'movie_fts_deferred'):
+    sa.event.listen(Movie.__table__, 'before_drop',
+                    sa.DDL(f'DROP TABLE IF EXISTS {table}').execute_if(dialect='sqlite'))
+
+
+def defer_movie_fts():
+    """
+    Stop the insert trigger from indexing rows for the current transaction.
+
+    The flag is written inside the caller's transaction, so other
+    connections never see it set: it is reset by `index_movie_fts` before
+    commit, or thrown away with everything else on rollback. Since this is
+    the first write of the transaction it also takes SQLite's write lock,
+    which makes the returned id a safe lower bound for the rows about to be
+    inserted.
+
+    Returns:
+        int: The highest movie id before the bulk insert.
+    """
+    db.session.execute(sa.text('UPDATE movie_fts_deferred SET active = 1'))
+    return db.session.scalar(sa.select(sa.func.coalesce(sa.func.max(Movie.id), 0)))
+
+
+def index_movie_fts(after):
+    """
+    Index the movies inserted since `defer_movie_fts` and re-enable the trigger.
+
+    Args:
+        after (int): The id returned by `defer_movie_fts`.
+    """
+    db.session.execute(sa.text(
+        'INSERT INTO movie_fts (rowid, name, genre) '
+        'SELECT id, name, genre FROM movie WHERE id > :after'), {'after': after})
+    db.session.execute(sa.text('UPDATE movie_fts_deferred SET active = 0'))
+
+
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
\ No newline at end of file
+    """
+    Load the logged in user of a web request.
+
+    Users are cached for ``USER_CACHE_TTL`` seconds. A cache hit attaches
+    the user to the session with its profile fields loaded and costs no
+    query; any other attribute is loaded on first access.
+    """
+    id = int(id)
+    cached = user_cache.get(id)
+    if cached is not None:
+        user = User(id=id, **cached)
+        so.make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    user = db.session.get(User, id)
+    if user is not None:
+        user_cache.set(id, {'username': user.username, 'email': user.email})
+    return user
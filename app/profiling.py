@@ -0,0 +1,190 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import g, request, has_app_context, has_request_context
+import sqlalchemy as sa
+
+# Slow statements are logged as one JSON object per line
+slow_query_log = logging.getLogger('app.slow_queries')
+
+
+class RequestProfile:
+    """
+    The database and serialization work done while handling one request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.serialize_time = 0.0
+        self.statements = Counter()
+
+    def add(self, statement, duration):
+        self.queries += 1
+        self.db_time += duration
+        self.statements[statement] += 1
+        if duration > self.slowest:
+            self.slowest = duration
+            self.slowest_statement = statement
+
+    def server_timing(self):
+        """
+        Format the profile as a ``Server-Timing`` header value, in milliseconds.
+        """
+        total = time.perf_counter() - self.started
+        return (f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries", '
+                f'db-slowest;dur={self.slowest * 1000:.2f}, '
+                f'serialize;dur={self.serialize_time * 1000:.2f}, '
+                f'total;dur={total * 1000:.2f}')
+
+
+class EndpointStats:
+    """
+    Query counts and timings per endpoint, accumulated by a worker process.
+
+    An endpoint running the same statement ``n_plus_one`` times or more in
+    one request is flagged: its query count grows with the size of its
+    result, typically because it loads something for every item, and a
+    warning naming the statement is logged the first time it happens.
+
+    Args:
+        n_plus_one (int): Repetitions of one statement that flag an endpoint.
+    """
+
+    def __init__(self, n_plus_one):
+        self.n_plus_one = n_plus_one
+        self._endpoints = defaultdict(lambda: {
+            'requests': 0, 'queries': 0, 'max_queries': 0, 'db_ms': 0.0,
+            'serialize_ms': 0.0, 'slowest_ms': 0.0, 'slowest_statement': None,
+            'repeated_statement': None})
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, profile):
+        statement, repeats = (profile.statements.most_common(1) or [(None, 0)])[0]
+        with self._lock:
+            stats = self._endpoints[endpoint]
+            stats['requests'] += 1
+            stats['queries'] += profile.queries
+            stats['max_queries'] = max(stats['max_queries'], profile.queries)
+            stats['db_ms'] += profile.db_time * 1000
+            stats['serialize_ms'] += profile.serialize_time * 1000
+            if profile.slowest * 1000 > stats['slowest_ms']:
+                stats['slowest_ms'] = profile.slowest * 1000
+                stats['slowest_statement'] = profile.slowest_statement
+            flagged = repeats >= self.n_plus_one and stats['repeated_statement'] is None
+            if flagged:
+                stats['repeated_statement'] = statement
+        if flagged:
+            slow_query_log.warning(json.dumps({
+                'event': 'n_plus_one', 'endpoint': endpoint, 'repeats': repeats,
+                'statement': statement}))
+
+    def stats(self):
+        """
+        Report the counters of every endpoint, with averages per request.
+        """
+        with self._lock:
+            return {endpoint: dict(
+                stats, db_ms=round(stats['db_ms'], 2), serialize_ms=round(stats['serialize_ms'], 2),
+                slowest_ms=round(stats['slowest_ms'], 2),
+                avg_queries=round(stats['queries'] / stats['requests'], 2),
+                n_plus_one=stats['repeated_statement'] is not None)
+                for endpoint, stats in self._endpoints.items()}
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+def current_profile():
+    return g.get('profile') if has_app_context() else None
+
+
+def init_profiling(app, engines):
+    """
+    Instrument the database and the JSON provider of the application.
+
+    While ``PROFILING`` is enabled, every request records its number of
+    queries, the time spent in the database, its slowest statement and the
+    time spent serializing JSON, reports them in a ``Server-Timing`` header
+    and adds them to the per endpoint counters. Statements taking
+    ``SLOW_QUERY_MS`` or longer are logged to the ``app.slow_queries``
+    logger, a ``SLOW_QUERY_SAMPLE_RATE`` fraction of them, and to
+    ``SLOW_QUERY_LOG`` when it names a file.
+
+    Only statements run on ``engines``, the engines of the application, are
+    timed. The counters are kept in ``app.extensions['profiling']``, and
+    calling it again does nothing. Must run after `init_json`, as it wraps
+    the provider installed there.
+    """
+    if 'profiling' in app.extensions:
+        return
+    endpoint_stats = app.extensions['profiling'] = EndpointStats(app.config['N_PLUS_ONE_THRESHOLD'])
+    if app.config['SLOW_QUERY_LOG']:
+        handler = logging.FileHandler(app.config['SLOW_QUERY_LOG'])
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        slow_query_log.addHandler(handler)
+
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        if app.config['PROFILING']:
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('query_started')
+        if not started:
+            return
+        duration = time.perf_counter() - started.pop()
+        profile = current_profile()
+        if profile is not None:
+            profile.add(statement, duration)
+        if duration * 1000 >= app.config['SLOW_QUERY_MS'] \
+                and random.random() < app.config['SLOW_QUERY_SAMPLE_RATE']:
+            slow_query_log.warning(json.dumps({
+                'event': 'slow_query', 'duration_ms': round(duration * 1000, 2),
+                'statement': statement, 'executemany': executemany,
+                'endpoint': request.endpoint if has_request_context() else None,
+                'method': request.method if has_request_context() else None}))
+
+    def failed_query(context):
+        started = context.connection.info.get('query_started') if context.connection else None
+        if started:
+            started.pop()
+
+    for engine in engines:
+        sa.event.listen(engine, 'before_cursor_execute', start_query)
+        sa.event.listen(engine, 'after_cursor_execute', end_query)
+        sa.event.listen(engine, 'handle_error', failed_query)
+
+    # Serialization time is the time spent in the provider's response()
+    respond = app.json.response
+
+    def timed_response(*args, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return respond(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return respond(*args, **kwargs)
+        finally:
+            profile.serialize_time += time.perf_counter() - started
+    app.json.response = timed_response
+
+    @app.before_request
+    def start_profile():
+        if app.config['PROFILING']:
+            g.profile = RequestProfile()
+
+    @app.after_request
+    def end_profile(response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            response.headers['Server-Timing'] = profile.server_timing()
+            endpoint_stats.record(request.endpoint, profile)
+        return response
@@ -2,6 +2,8 @@ from flask import render_template, request, redirect, url_for, flash, abort
 from app.models import Movie, User
 from app.forms import LoginForm, RegistrationForm
 from app import app, db
+from app.changes import movie_snapshot, record_movie_changes
+from app.events import event_stream
 from flask_login import current_user, login_user, logout_user, login_required
 from urllib.parse import urlsplit
 import sqlalchemy as sa
@@ -64,6 +66,19 @@ def index():
     return render_template('index.html', movies=movies)
 
 
+@app.route('/events', methods=['GET'])
+@login_required
+def events():
+    """
+    Route: '/events'
+    Methods: GET
+    Purpose: Push changes to the current user's movies to the open index page.
+    Reasoning:
+        - Uses Server-Sent Events so that the page does not have to poll.
+    """
+    return event_stream(current_user.id)
+
+
 @app.route('/add_movie', methods=['GET', 'POST'])
 @login_required
 def add_movie():
@@ -85,10 +100,13 @@ def add_movie():
             movie = Movie.query.get(movie_id)
             if movie and movie.user_id == current_user.id:
                 # Update existing movie
+                before = movie_snapshot(movie)
                 movie.name = request.form['name']
                 movie.year = request.form['year']
                 movie.oscars = request.form['oscars']
 
+                db.session.flush()
+                record_movie_changes([(before, movie_snapshot(movie))])
                 db.session.commit()
                 flash('Movie updated successfully!', 'success')
             else:
@@ -102,6 +120,8 @@ def add_movie():
                 user_id=current_user.id  # Associate with current user
             )
             db.session.add(movie)
+            db.session.flush()
+            record_movie_changes([(None, movie_snapshot(movie))])
             db.session.commit()
             flash('Movie added successfully!', 'success')
 
@@ -138,6 +158,7 @@ def delete_movie(id):
 
     try:
         # Delete the movie from the database
+        record_movie_changes([(movie_snapshot(movie), None)])
         db.session.delete(movie)
         db.session.commit()
         flash('Movie deleted successfully!', 'success')
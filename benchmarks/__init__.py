@@ -0,0 +1,7 @@
+"""
+Benchmarks for the Movies App.
+
+Every benchmark is a module runnable with ``python -m benchmarks.<name>``
+from the project root. They point ``DATABASE_URL`` at a scratch SQLite file
+before importing the application, so ``movies.db`` is never touched.
+"""
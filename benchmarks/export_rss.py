@@ -0,0 +1,111 @@
+"""
+Peak memory of the streaming movie export.
+
+Seeds a scratch database per catalog size, then streams
+``/api/users/<id>/movies/export`` in a fresh process and reports the peak
+resident set size. Seeding and measuring run in separate processes because
+the peak RSS of a process never goes down.
+
+Usage:
+    python -m benchmarks.export_rss [--format ndjson|csv] [ROWS ...]
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+SEED_CHUNK = 50_000
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_app(path):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    from app import app, db
+    return app, db
+
+
+def seed(path, rows):
+    app, db = load_app(path)
+    import sqlalchemy as sa
+    from app.models import User, Movie
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        for start in range(0, rows, SEED_CHUNK):
+            db.session.execute(sa.insert(Movie), [
+                {'name': f'Movie {i}', 'year': 1900 + i % 125, 'oscars': i % 12,
+                 'genre': 'Drama', 'user_id': user.id}
+                for i in range(start, min(start + SEED_CHUNK, rows))])
+            db.session.commit()
+
+
+def measure(path, export_format):
+    app, db = load_app(path)
+    client = app.test_client()
+    credentials = base64.b64encode(b'bench:bench').decode()
+    token = client.post('/api/tokens', headers={'Authorization': f'Basic {credentials}'}).json['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    # warm up imports, the connection pool and the first chunk
+    client.get('/api/users/1/movies?limit=1', headers=headers)
+    baseline = peak_rss_mb()
+
+    start = time.perf_counter()
+    response = client.get(f'/api/users/1/movies/export?format={export_format}', headers=headers,
+                          buffered=False)
+    size = lines = 0
+    for chunk in response.response:
+        size += len(chunk)
+        lines += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'lines': lines,
+        'bytes': size,
+        'seconds': round(elapsed, 3),
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('rows', nargs='*', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--format', default='ndjson', choices=['ndjson', 'csv'])
+    parser.add_argument('--seed', metavar='PATH', help=argparse.SUPPRESS)
+    parser.add_argument('--measure', metavar='PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.seed:
+        return seed(args.seed, args.rows[0])
+    if args.measure:
+        return measure(args.measure, args.format)
+
+    results = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            command = [sys.executable, '-m', 'benchmarks.export_rss']
+            subprocess.run(command + ['--seed', path, str(rows)], check=True)
+            output = subprocess.run(command + ['--measure', path, '--format', args.format],
+                                    check=True, capture_output=True, text=True).stdout
+            result = dict(json.loads(output.splitlines()[-1]), rows=rows)
+            results.append(result)
+            print(f"{rows:>10} rows  {result['seconds']:>8.2f}s  "
+                  f"baseline {result['baseline_rss_mb']:>7.1f} MB  "
+                  f"peak {result['peak_rss_mb']:>7.1f} MB", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Throughput of POST /api/movies with group commit off and on.
+
+Runs one worker process per mode against a scratch database, in which
+client threads create movies as fast as they can for a fixed time, and
+reports movies created per second and the average number of movies per
+transaction.
+
+Usage:
+    python -m benchmarks.group_commit [--threads N] [--seconds S] [--synchronous MODE]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def work(path, threads, seconds):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    from app import app, db
+    from app.models import User
+    from app.groupcommit import group_committer
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        db.session.add(user)
+        token = user.get_token(expires_in=3600)
+        db.session.commit()
+
+    headers = {'Authorization': f'Bearer {token}'}
+    movie = {'name': 'Bench', 'year': 2000, 'oscars': 1, 'genre': 'Drama'}
+    created = [0] * threads
+    failed = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def client_thread(i):
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            if client.post('/api/movies', json=movie, headers=headers).status_code == 201:
+                created[i] += 1
+            else:
+                failed[i] += 1
+
+    workers = [threading.Thread(target=client_thread, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stats = group_committer.stats()
+    print(json.dumps({
+        'created': sum(created),
+        'failed': sum(failed),
+        'writes_per_second': round(sum(created) / seconds, 1),
+        'rows_per_transaction': stats['rows_per_batch'] if stats['batches'] else 1.0,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--synchronous', default='FULL',
+                        help='SQLite synchronous pragma; FULL syncs every commit to disk')
+    parser.add_argument('--work', metavar='PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.work:
+        return work(args.work, args.threads, args.seconds)
+
+    results = {}
+    for label, enabled in (('off', 'false'), ('on', 'true')):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, GROUP_COMMIT=enabled, SQLITE_SYNCHRONOUS=args.synchronous,
+                       DB_POOL_SIZE=str(args.threads + 1))
+            command = [sys.executable, '-m', 'benchmarks.group_commit', '--work',
+                       os.path.join(tmp, 'bench.db'), '--threads', str(args.threads),
+                       '--seconds', str(args.seconds)]
+            output = subprocess.run(command, env=env, check=True, capture_output=True,
+                                    text=True).stdout
+        results[label] = result = json.loads(output.splitlines()[-1])
+        print(f"{label:>4}: {result['writes_per_second']:8.1f} writes/s  "
+              f"{result['rows_per_transaction']:6.1f} rows per transaction  "
+              f"{result['failed']} failed", file=sys.stderr)
+    results['speedup'] = round(results['on']['writes_per_second'] /
+                               results['off']['writes_per_second'], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,595 @@
+"""
+Latency and throughput of every API and web route.
+
+Seeds a scratch database with `benchmarks.seed`, or uses ``--db`` as is
+when it exists, then sends ``--requests`` requests to each route from
+``--concurrency`` client threads, each logged in as a different seeded
+user, and reports the p50, p95 and p99 latency and the requests per second
+of every route as JSON. Requests go through the Flask test client in
+process by default. With ``--server`` the application runs on a local
+WSGI server instead: ``--workers`` processes share one listening socket
+and serve requests on threads, and clients send real HTTP requests over
+keep-alive connections.
+
+Whatever a request needs beforehand, such as a token or the movie a
+delete removes, is prepared before its timer starts; requests per second
+are measured over the wall clock time of a route and so include that
+preparation. Server-Sent Event streams never complete and are left out,
+as is the profile report, which is only served while ``PROFILING`` is on.
+CSRF protection is turned off so that the web forms can be posted.
+
+With ``--baseline``, the report is compared to a previous one: routes
+whose p95 latency grew, or whose throughput fell, by more than
+``--max-regression`` are listed under ``regressions`` and the exit status
+is 1, so that the benchmark can gate a commit.
+
+Usage:
+    python -m benchmarks.load [--users N] [--movies N] [--db PATH] [--requests N]
+                              [--concurrency N] [--server] [--workers N] [--route PATTERN]
+                              [--baseline REPORT] [--max-regression FRACTION]
+"""
+import argparse
+import base64
+import fnmatch
+import functools
+import http.client
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import secrets
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from json import dumps as dump_json
+from urllib.parse import urlencode
+
+from benchmarks.seed import PASSWORD, WORDS
+
+# Routes that cannot be timed: event streams stay open until the client
+# leaves, and the profile is only served while PROFILING is on
+SKIPPED = {'static', 'events', 'api.get_user_movie_events', 'api.get_profile'}
+
+MOVIE_QUERIES = ('', 'genre=Drama', 'year_min=1990&year_max=1999', 'min_oscars=3',
+                 'name_prefix=Night', 'sort=-year', 'fields=id,name&links=false')
+
+# Functions preparing one request to a route, by method and endpoint
+SCENARIOS = {}
+
+
+def scenario(method, endpoint):
+    def register(prepare):
+        SCENARIOS[method, endpoint] = prepare
+        return prepare
+    return register
+
+
+def load_app(path):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    from app import app
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+class TestClientTransport:
+    """
+    Requests handled in process by the Flask test client.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+
+    def request(self, method, path, headers=None, json=None, form=None, body=None):
+        response = self.client.open(path, method=method, headers=headers, json=json,
+                                    data=form if form is not None else body)
+        data = response.get_data()
+        response.close()
+        return response.status_code, data
+
+    def reset(self):
+        self.client = self.app.test_client()
+
+
+class HTTPTransport:
+    """
+    Requests sent over one keep-alive HTTP connection, with its own cookies.
+    """
+
+    def __init__(self, address):
+        self.connection = http.client.HTTPConnection(*address, timeout=60)
+        self.cookies = {}
+
+    def request(self, method, path, headers=None, json=None, form=None, body=None):
+        headers = dict(headers or {})
+        if json is not None:
+            body = dump_json(json)
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnects on the next request
+            self.connection.close()
+            raise
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            if value and 'Expires=Thu, 01 Jan 1970' not in cookie:
+                self.cookies[name.strip()] = value
+            else:
+                self.cookies.pop(name.strip(), None)
+        return response.status, data
+
+    def reset(self):
+        self.cookies.clear()
+
+
+class Client:
+    """
+    One simulated user, with its own connections, token and web session.
+
+    Args:
+        user_id (int): The seeded user to act as.
+        transport (callable): Opens a new connection.
+        movies (int): Number of seeded movies, whose ids start at 1.
+        rng (random.Random): Source of the ids and words of the requests.
+    """
+
+    # Users created by the benchmark are named after the run and a counter
+    run = secrets.token_hex(3)
+    created = itertools.count()
+
+    def __init__(self, user_id, transport, movies, rng):
+        self.user_id = user_id
+        self.movies = movies
+        self.rng = rng
+        self.api, self.web, self.anonymous = transport(), transport(), transport()
+        self.token = None
+        self.logged_in = False
+        self.movie_id = None
+        self.credentials = {'Authorization': 'Basic ' + base64.b64encode(
+            f'user{user_id}:{PASSWORD}'.encode()).decode()}
+
+    def headers(self):
+        if self.token is None:
+            status, body = self.api.request('POST', '/api/tokens', headers=self.credentials)
+            if status != 200:
+                raise RuntimeError(f'user{self.user_id} could not get a token: {status}')
+            self.token = json.loads(body)['token']
+        return {'Authorization': f'Bearer {self.token}'}
+
+    def login(self, transport):
+        status, _ = transport.request('POST', '/login', form={
+            'username': f'user{self.user_id}', 'password': PASSWORD})
+        if status != 302:
+            raise RuntimeError(f'user{self.user_id} could not log in: {status}')
+
+    def session(self):
+        if not self.logged_in:
+            self.login(self.web)
+            self.logged_in = True
+        return self.web
+
+    def create_movie(self):
+        status, body = self.api.request('POST', '/api/movies', headers=self.headers(),
+                                        json=self.movie())
+        if status != 201:
+            raise RuntimeError(f'user{self.user_id} could not create a movie: {status}')
+        return json.loads(body)['id']
+
+    def new_username(self):
+        return f'load{self.run}n{next(self.created)}'
+
+    def own_movie(self):
+        if self.movie_id is None:
+            self.movie_id = self.create_movie()
+        return self.movie_id
+
+    def movie(self):
+        return {'name': ' '.join(self.rng.choices(WORDS, k=2)).title(),
+                'year': self.rng.randint(1920, 2024), 'oscars': self.rng.randint(0, 3),
+                'genre': 'Drama'}
+
+    def random_movie_id(self):
+        return self.rng.randint(1, max(self.movies, 1))
+
+
+@scenario('GET', 'api.get_movies')
+def get_movies(client):
+    return client.api, f'/api/movies?{client.rng.choice(MOVIE_QUERIES)}', \
+        {'headers': client.headers()}
+
+
+@scenario('GET', 'api.get_movie')
+def get_movie(client):
+    return client.api, f'/api/movies/{client.random_movie_id()}', {'headers': client.headers()}
+
+
+@scenario('GET', 'api.search_movies')
+def search_movies(client):
+    query = urlencode({'q': ' '.join(client.rng.choices(WORDS, k=2))})
+    return client.api, f'/api/movies/search?{query}', {'headers': client.headers()}
+
+
+@scenario('GET', 'api.get_movie_changes')
+def get_movie_changes(client):
+    return client.api, f'/api/movies/changes?since={client.rng.randrange(client.movies + 1)}', \
+        {'headers': client.headers()}
+
+
+@scenario('POST', 'api.create_movie')
+def create_movie(client):
+    return client.api, '/api/movies', {'headers': client.headers(), 'json': client.movie()}
+
+
+@scenario('PUT', 'api.update_movie')
+def update_movie(client):
+    return client.api, f'/api/movies/{client.own_movie()}', \
+        {'headers': client.headers(), 'json': client.movie()}
+
+
+@scenario('DELETE', 'api.delete_movie')
+def delete_movie(client):
+    return client.api, f'/api/movies/{client.create_movie()}', {'headers': client.headers()}
+
+
+@scenario('POST', 'api.batch_movies')
+def batch_movies(client):
+    operations = [{'op': 'create', 'data': client.movie()} for _ in range(10)]
+    return client.api, '/api/movies/batch', {'headers': client.headers(), 'json': operations}
+
+
+@scenario('POST', 'api.import_movies_upload')
+def import_movies(client):
+    rows = ''.join(f"{movie['name']},{movie['year']},{movie['oscars']},{movie['genre']}\n"
+                   for movie in (client.movie() for _ in range(100)))
+    return client.api, '/api/movies/import', {
+        'headers': dict(client.headers(), **{'Content-Type': 'text/csv'}),
+        'body': 'name,year,oscars,genre\n' + rows}
+
+
+@scenario('GET', 'api.get_stats')
+def get_stats(client):
+    return client.api, f"/api/stats?group_by={client.rng.choice(('year', 'genre', 'user_id'))}", \
+        {'headers': client.headers()}
+
+
+@scenario('GET', 'api.get_caches')
+def get_caches(client):
+    return client.api, '/api/caches', {'headers': client.headers()}
+
+
+@scenario('GET', 'api.get_users')
+def get_users(client):
+    return client.api, '/api/users', {'headers': client.headers()}
+
+
+@scenario('GET', 'api.get_user')
+def get_user(client):
+    return client.api, f'/api/users/{client.user_id}', {'headers': client.headers()}
+
+
+@scenario('GET', 'api.get_user_movies')
+def get_user_movies(client):
+    return client.api, f'/api/users/{client.user_id}/movies', {'headers': client.headers()}
+
+
+@scenario('GET', 'api.export_user_movies')
+def export_user_movies(client):
+    return client.api, f'/api/users/{client.user_id}/movies/export', {'headers': client.headers()}
+
+
+@scenario('POST', 'api.create_user')
+def create_user(client):
+    name = client.new_username()
+    return client.api, '/api/users', {'json': {
+        'username': name, 'email': f'{name}@example.com', 'password': PASSWORD}}
+
+
+@scenario('PUT', 'api.update_user')
+def update_user(client):
+    return client.api, f'/api/users/{client.user_id}', {
+        'headers': client.headers(), 'json': {'email': f'user{client.user_id}@example.com'}}
+
+
+@scenario('POST', 'api.get_token')
+def get_token(client):
+    return client.api, '/api/tokens', {'headers': client.credentials}
+
+
+@scenario('DELETE', 'api.revoke_token')
+def revoke_token(client):
+    headers = client.headers()
+    # The next request gets a new token
+    client.token = None
+    return client.api, '/api/tokens', {'headers': headers}
+
+
+@scenario('GET', 'index')
+def index(client):
+    return client.session(), '/index', {}
+
+
+@scenario('GET', 'add_movie')
+def add_movie_form(client):
+    return client.session(), '/add_movie', {}
+
+
+@scenario('POST', 'add_movie')
+def add_movie(client):
+    return client.session(), '/add_movie', {'form': client.movie()}
+
+
+@scenario('POST', 'delete_movie')
+def delete_movie_form(client):
+    return client.session(), f'/delete_movie/{client.create_movie()}', {}
+
+
+@scenario('GET', 'login')
+def login_form(client):
+    client.anonymous.reset()
+    return client.anonymous, '/login', {}
+
+
+@scenario('POST', 'login')
+def login(client):
+    client.anonymous.reset()
+    return client.anonymous, '/login', {'form': {
+        'username': f'user{client.user_id}', 'password': PASSWORD}}
+
+
+@scenario('GET', 'logout')
+def logout(client):
+    client.anonymous.reset()
+    client.login(client.anonymous)
+    return client.anonymous, '/logout', {}
+
+
+@scenario('GET', 'register')
+def register_form(client):
+    client.anonymous.reset()
+    return client.anonymous, '/register', {}
+
+
+@scenario('POST', 'register')
+def register(client):
+    client.anonymous.reset()
+    name = client.new_username()
+    return client.anonymous, '/register', {'form': {
+        'username': name, 'email': f'{name}@example.com', 'password': PASSWORD,
+        'password2': PASSWORD}}
+
+
+@scenario('GET', 'metrics')
+def metrics(client):
+    return client.anonymous, '/metrics', {}
+
+
+def routes(app):
+    """
+    List the method and endpoint of every route of the application.
+    """
+    return sorted({(method, rule.endpoint) for rule in app.url_map.iter_rules()
+                   for method in rule.methods - {'HEAD', 'OPTIONS'}})
+
+
+def percentile(ordered, fraction):
+    # Nearest rank, so that the reported latency is one that was measured
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(latencies, errors, seconds):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'requests_per_second': round(len(ordered) / seconds, 1),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def drive(clients, route, requests):
+    """
+    Send ``requests`` requests to a route, spread over the clients.
+
+    Returns:
+        tuple: Latencies in seconds, the number of failed requests and the
+        wall clock time taken.
+    """
+    method, _ = route
+    prepare = SCENARIOS[route]
+    # (seconds, succeeded) of every request; list appends are thread safe
+    timings, problems = [], []
+
+    def run(client, count):
+        try:
+            for _ in range(count):
+                transport, path, options = prepare(client)
+                started = time.perf_counter()
+                try:
+                    status, _ = transport.request(method, path, **options)
+                except (OSError, http.client.HTTPException):
+                    status = None
+                timings.append((time.perf_counter() - started,
+                                status is not None and status < 400))
+        except Exception as e:
+            problems.append(e)
+
+    shares = [requests // len(clients) + (i < requests % len(clients)) for i in range(len(clients))]
+    threads = [threading.Thread(target=run, args=(client, count))
+               for client, count in zip(clients, shares) if count]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if problems:
+        raise problems[0]
+    seconds = time.perf_counter() - started
+    return [timing for timing, _ in timings], sum(not ok for _, ok in timings), seconds
+
+
+def benchmark(clients, selected, requests):
+    results = {}
+    latencies, errors, seconds = [], 0, 0.0
+    for route in selected:
+        # One untimed request first, so that no route pays for warming up
+        drive(clients[:1], route, 1)
+        route_latencies, route_errors, route_seconds = drive(clients, route, requests)
+        results[' '.join(route)] = result = summarize(route_latencies, route_errors, route_seconds)
+        latencies += route_latencies
+        errors += route_errors
+        seconds += route_seconds
+        print(f"{' '.join(route):<32} {result['requests_per_second']:9.1f} req/s  "
+              f"p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+              f"p99 {result['p99_ms']:8.2f} ms  {result['errors']} errors", file=sys.stderr)
+    return results, summarize(latencies, errors, seconds)
+
+
+def regressions(report, baseline, threshold):
+    """
+    Compare the routes of a report to the same routes of a baseline report.
+    """
+    found = []
+    for name, result in report['routes'].items():
+        before = baseline.get('routes', {}).get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            found.append({'route': name, 'metric': 'p95_ms', 'baseline': before['p95_ms'],
+                          'value': result['p95_ms']})
+        if result['requests_per_second'] < before['requests_per_second'] * (1 - threshold):
+            found.append({'route': name, 'metric': 'requests_per_second',
+                          'baseline': before['requests_per_second'],
+                          'value': result['requests_per_second']})
+    return found
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def serve(path, fd):
+    app = load_app(path)
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server('127.0.0.1', 0, app, threaded=True, fd=fd).serve_forever()
+
+
+def start_servers(path, workers):
+    """
+    Start the WSGI server processes, all accepting on one socket.
+
+    Returns:
+        tuple: The address of the socket and the server processes.
+    """
+    listener = socket.create_server(('127.0.0.1', 0), backlog=128)
+    listener.set_inheritable(True)
+    command = [sys.executable, '-m', 'benchmarks.load', '--serve', path,
+               '--fd', str(listener.fileno())]
+    servers = [subprocess.Popen(command, pass_fds=[listener.fileno()]) for _ in range(workers)]
+    address = listener.getsockname()
+    # Connections queue up on the socket until the servers have started
+    listener.close()
+    return address, servers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--movies', type=int, default=10_000)
+    parser.add_argument('--db', metavar='PATH',
+                        help='database to use, seeded first if it does not exist')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--server', action='store_true',
+                        help='send HTTP requests to a local WSGI server')
+    parser.add_argument('--workers', type=int, default=2, help='server processes')
+    parser.add_argument('--route', action='append', metavar='PATTERN',
+                        help="only routes matching, e.g. 'api.*' or 'GET *'")
+    parser.add_argument('--baseline', metavar='REPORT',
+                        help='a previous report to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--serve', metavar='PATH', help=argparse.SUPPRESS)
+    parser.add_argument('--fd', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve, args.fd)
+
+    tmp = tempfile.TemporaryDirectory()
+    path = args.db or os.path.join(tmp.name, 'bench.db')
+    if not os.path.exists(path):
+        subprocess.run([sys.executable, '-m', 'benchmarks.seed', path, '--users',
+                        str(args.users), '--movies', str(args.movies), '--seed',
+                        str(args.seed)], check=True, stdout=subprocess.DEVNULL)
+    with sqlite3.connect(path) as connection:
+        users = connection.execute("SELECT count(*) FROM user WHERE username LIKE 'user%'").fetchone()[0]
+        movies = connection.execute('SELECT count(*) FROM movie').fetchone()[0]
+    if args.concurrency > users:
+        parser.error(f'--concurrency cannot exceed the {users} seeded users')
+
+    app = load_app(path)
+    uncovered = [' '.join(route) for route in routes(app)
+                 if route not in SCENARIOS and route[1] not in SKIPPED]
+    selected = [route for route in routes(app) if route in SCENARIOS and (
+        not args.route or any(fnmatch.fnmatch(' '.join(route), pattern)
+                              or fnmatch.fnmatch(route[1], pattern) for pattern in args.route))]
+
+    servers = []
+    if args.server:
+        address, servers = start_servers(path, args.workers)
+        transport = functools.partial(HTTPTransport, address)
+    else:
+        transport = functools.partial(TestClientTransport, app)
+    try:
+        clients = [Client(i + 1, transport, movies, random.Random(args.seed + i))
+                   for i in range(args.concurrency)]
+        results, total = benchmark(clients, selected, args.requests)
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'commit': git_commit(),
+        'transport': 'wsgi' if args.server else 'test_client',
+        'workers': args.workers if args.server else None,
+        'concurrency': args.concurrency,
+        'users': users,
+        'movies': movies,
+        'requests_per_route': args.requests,
+        'routes': results,
+        'total': total,
+        'uncovered': uncovered,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = regressions(report, json.load(f), args.max_regression)
+    print(json.dumps(report, indent=2))
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
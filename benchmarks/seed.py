@@ -0,0 +1,128 @@
+"""
+Synthetic users and movies for the benchmarks.
+
+Creates the schema in a SQLite file and fills it with ``--users`` users and
+``--movies`` movies, from a thousand to ten million rows, with bulk inserts
+of ``--chunk`` rows per transaction. Names are drawn from a small
+vocabulary so that searches have matches, years, Oscars and genres are
+spread over realistic ranges, and movies are dealt to the users in turn.
+The same ``--seed`` always produces the same database.
+
+Every user is called ``user<N>`` and has the password ``bench``; the hash
+is derived once and shared, since deriving it per user would take longer
+than the inserts. Per user movie counts and the statistics rollups are
+computed once at the end instead of per row.
+
+Usage:
+    python -m benchmarks.seed PATH [--users N] [--movies N] [--chunk N] [--seed N]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+PASSWORD = 'bench'
+
+WORDS = ('night', 'city', 'last', 'dark', 'love', 'war', 'star', 'house', 'river', 'king',
+         'blue', 'secret', 'lost', 'empire', 'ghost', 'summer', 'iron', 'silent', 'wild',
+         'golden', 'road', 'storm', 'glass', 'shadow', 'heart', 'island', 'fire', 'time',
+         'winter', 'dream', 'stone', 'moon', 'black', 'garden', 'red', 'north', 'ocean',
+         'game', 'angel', 'crown', 'machine', 'forest', 'train', 'mirror', 'hunter', 'sky')
+GENRES = ('Drama', 'Comedy', 'Action', 'Thriller', 'Horror', 'Romance', 'Sci-Fi',
+          'Documentary', 'Animation', 'Crime', None)
+
+# Seeding runs alone, so durability and memory can be traded for speed
+SEED_ENVIRONMENT = {'SQLITE_SYNCHRONOUS': 'OFF', 'SQLITE_CACHE_SIZE': str(-256 * 1024)}
+
+
+def movie_rows(rng, count, users, start=0):
+    """
+    Generate ``count`` movie rows in the column order of `INSERT_MOVIE`.
+    """
+    for i in range(start, start + count):
+        name = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))).title()
+        # Few movies win anything, a handful win a lot
+        oscars = min(int(rng.expovariate(1.5)), 11)
+        yield f'{name} {i + 1}', rng.randint(1920, 2024), oscars, rng.choice(GENRES), \
+            i % users + 1
+
+
+def seed(path, users, movies, chunk=50_000, seed=0):
+    """
+    Create and fill a benchmark database.
+
+    Args:
+        path (str): The SQLite file, created if missing; must not hold data yet.
+        users (int): Number of users.
+        movies (int): Number of movies, dealt to the users in turn.
+        chunk (int): Rows inserted per transaction.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        dict: The number of rows and the time taken, in seconds.
+    """
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ.update({key: value for key, value in SEED_ENVIRONMENT.items()
+                       if key not in os.environ})
+    from werkzeug.security import generate_password_hash
+    from app import app, db
+    from app.importer import INSERT_MOVIE
+    from app.models import defer_movie_fts, index_movie_fts
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    password_hash = generate_password_hash(PASSWORD)
+    with app.app_context():
+        db.create_all()
+
+        def execute(statement, parameters=None):
+            return db.session.connection().exec_driver_sql(statement, parameters)
+
+        if execute('SELECT count(*) FROM user').scalar():
+            raise ValueError(f'{path} already holds users')
+        for start in range(0, users, chunk):
+            execute('INSERT INTO user (id, username, email, password_hash, movies_count) '
+                    'VALUES (?, ?, ?, ?, 0)',
+                    [(i, f'user{i}', f'user{i}@example.com', password_hash)
+                     for i in range(start + 1, min(start + chunk, users) + 1)])
+            db.session.commit()
+        for start in range(0, movies, chunk):
+            # Indexed for search once per chunk, like imports
+            after = defer_movie_fts()
+            execute(INSERT_MOVIE, list(movie_rows(rng, min(chunk, movies - start), users, start)))
+            index_movie_fts(after)
+            db.session.commit()
+            print(f'{start + min(chunk, movies - start):>10} movies', file=sys.stderr)
+        # The same statements the migrations backfill these columns with
+        execute('UPDATE user SET movies_count = '
+                '(SELECT COUNT(*) FROM movie WHERE movie.user_id = user.id)')
+        execute("INSERT INTO movie_rollup (user_id, year, genre, movies, oscars) "
+                "SELECT user_id, year, coalesce(genre, ''), count(*), sum(oscars) "
+                "FROM movie GROUP BY user_id, year, coalesce(genre, '')")
+        execute('ANALYZE')
+        db.session.commit()
+    return {'users': users, 'movies': movies,
+            'seconds': round(time.perf_counter() - started, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--movies', type=int, default=10_000)
+    parser.add_argument('--chunk', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.users < 1 or args.movies < 0:
+        parser.error('--users must be positive and --movies not negative')
+    try:
+        result = seed(args.path, args.users, args.movies, args.chunk, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Read and write throughput of concurrent worker processes on one SQLite file.
+
+Seeds a scratch database, then runs reader processes paging through
+``GET /api/movies`` alongside writer processes calling ``POST /api/movies``
+for a fixed time, like gunicorn workers sharing ``movies.db``. Runs once
+with SQLite's defaults (rollback journal, ``synchronous=FULL``) and once
+with the tuned pragmas from `Config`, and reports requests per second and
+failed requests for both.
+
+Usage:
+    python -m benchmarks.sqlite_concurrency [--readers N] [--writers N] [--seconds S]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROWS = 20_000
+
+# Environment of the run with SQLite's own defaults
+DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'DELETE',
+    'SQLITE_SYNCHRONOUS': 'FULL',
+    'SQLITE_MMAP_SIZE': '0',
+    'SQLITE_CACHE_SIZE': '-2000',
+    'SQLITE_TEMP_STORE': 'DEFAULT',
+}
+
+
+def load_app(path):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    # Every read must reach the database
+    os.environ['RESPONSE_CACHE_BYTES'] = '0'
+    from app import app, db
+    return app, db
+
+
+def seed(path):
+    app, db = load_app(path)
+    import sqlalchemy as sa
+    from app.models import User, Movie
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        db.session.add(user)
+        # One token shared by all workers, so that none of them rotates it
+        user.get_token(expires_in=3600)
+        db.session.commit()
+        db.session.execute(sa.insert(Movie), [
+            {'name': f'Movie {i}', 'year': 1900 + i % 125, 'oscars': i % 12,
+             'genre': 'Drama', 'user_id': user.id} for i in range(ROWS)])
+        db.session.commit()
+
+
+def work(path, role, seconds):
+    app, db = load_app(path)
+    import sqlalchemy as sa
+    from app.models import User
+    with app.app_context():
+        token = db.session.scalar(sa.select(User.token))
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    movie = {'name': 'Bench', 'year': 2000, 'oscars': 1, 'genre': 'Drama'}
+    done = failed = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if role == 'reader':
+            response = client.get(f'/api/movies?after={random.randrange(ROWS)}&genre=Drama',
+                                  headers=headers)
+        else:
+            response = client.post('/api/movies', json=movie, headers=headers)
+        if response.status_code < 300:
+            done += 1
+        else:
+            failed += 1
+    print(json.dumps({'role': role, 'done': done, 'failed': failed}))
+
+
+def run(readers, writers, seconds, env):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        command = [sys.executable, '-m', 'benchmarks.sqlite_concurrency']
+        env = dict(os.environ, **env)
+        subprocess.run(command + ['--seed', path], check=True, env=env)
+        workers = [subprocess.Popen(command + ['--work', path, role, '--seconds', str(seconds)],
+                                    env=env, stdout=subprocess.PIPE, text=True)
+                   for role in ['reader'] * readers + ['writer'] * writers]
+        totals = {'reads': 0, 'writes': 0, 'failed_reads': 0, 'failed_writes': 0}
+        for worker in workers:
+            result = json.loads(worker.communicate()[0].splitlines()[-1])
+            kind = 'reads' if result['role'] == 'reader' else 'writes'
+            totals[kind] += result['done']
+            totals['failed_' + kind] += result['failed']
+    return dict(totals, reads_per_second=round(totals['reads'] / seconds, 1),
+                writes_per_second=round(totals['writes'] / seconds, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', metavar='PATH', help=argparse.SUPPRESS)
+    parser.add_argument('--work', nargs=2, metavar=('PATH', 'ROLE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.seed:
+        return seed(args.seed)
+    if args.work:
+        return work(*args.work, args.seconds)
+
+    results = {}
+    for label, env in (('defaults', DEFAULTS), ('tuned', {})):
+        results[label] = result = run(args.readers, args.writers, args.seconds, env)
+        print(f"{label:>9}: {result['reads_per_second']:8.1f} reads/s "
+              f"{result['writes_per_second']:8.1f} writes/s  "
+              f"failed {result['failed_reads']} reads, {result['failed_writes']} writes",
+              file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
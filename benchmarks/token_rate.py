@@ -0,0 +1,58 @@
+"""
+Throughput of POST /api/tokens with and without the password cache.
+
+Every request authenticates with HTTP Basic, so without the cache each one
+pays for the password hash's key derivation. Runs in process through the
+Flask test client against a scratch database.
+
+Usage:
+    python -m benchmarks.token_rate [--requests N]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp.name, 'bench.db')
+    from app import app, db
+    from app.models import User, password_cache
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+
+    client = app.test_client()
+    credentials = base64.b64encode(b'bench:bench').decode()
+    headers = {'Authorization': f'Basic {credentials}'}
+    results = {}
+    for label, ttl in (('uncached', 0), ('cached', app.config['PASSWORD_CACHE_TTL'] or 60)):
+        password_cache.ttl = ttl
+        password_cache.clear()
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            assert client.post('/api/tokens', headers=headers).status_code == 200
+        elapsed = time.perf_counter() - start
+        results[label] = {'requests': args.requests, 'seconds': round(elapsed, 3),
+                          'tokens_per_second': round(args.requests / elapsed, 1)}
+        print(f'{label:>9}: {args.requests / elapsed:8.1f} tokens/s', file=sys.stderr)
+    results['speedup'] = round(results['cached']['tokens_per_second'] /
+                               results['uncached']['tokens_per_second'], 1)
+    print(json.dumps(results, indent=2))
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,5 +3,103 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'movies.db')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
+        'sqlite:///' + os.path.join(basedir, 'movies.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Optional read-only database serving GET requests, e.g. a replica or
+    # sqlite:///file:/path/to/movies.db?mode=ro&uri=true
+    SQLALCHEMY_READ_DATABASE_URI = os.environ.get('DATABASE_READ_URL')
+
+    # Connection pool, for databases held in files
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 30)
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 3600)
+    DB_POOL_PRE_PING = (os.environ.get('DB_POOL_PRE_PING') or 'true').lower() in ('true', '1')
+
+    # Pragmas run on every new SQLite connection; busy timeout in milliseconds,
+    # mmap size in bytes and a negative cache size in KiB
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -64000)
+    SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE') or 'MEMORY'
+
+    # API pagination
+    MOVIES_PER_PAGE = int(os.environ.get('MOVIES_PER_PAGE') or 25)
+    MAX_MOVIES_PER_PAGE = int(os.environ.get('MAX_MOVIES_PER_PAGE') or 100)
+
+    # Bulk movie operations
+    MAX_BATCH_OPERATIONS = int(os.environ.get('MAX_BATCH_OPERATIONS') or 10000)
+    BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE') or 500)
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 1000)
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE') or 5000)
+    MAX_IMPORT_ERRORS = int(os.environ.get('MAX_IMPORT_ERRORS') or 100)
+
+    # Group commit of movie creation: concurrent POST /api/movies requests of
+    # a worker share one transaction, opened at most GROUP_COMMIT_WINDOW
+    # seconds after the first of them arrives. A request gives up with a 503
+    # after waiting GROUP_COMMIT_TIMEOUT seconds for its transaction.
+    GROUP_COMMIT = (os.environ.get('GROUP_COMMIT') or 'false').lower() in ('true', '1')
+    GROUP_COMMIT_WINDOW = float(os.environ.get('GROUP_COMMIT_WINDOW') or 0.005)
+    GROUP_COMMIT_MAX_BATCH = int(os.environ.get('GROUP_COMMIT_MAX_BATCH') or 500)
+    GROUP_COMMIT_TIMEOUT = float(os.environ.get('GROUP_COMMIT_TIMEOUT') or 10)
+
+    # Idempotency keys: how long a stored response is replayed, how many
+    # seconds a retry waits for a request still running, after how many
+    # seconds an unfinished request is presumed dead and its key taken over,
+    # and how often each process deletes expired keys
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL') or 86400)
+    IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT') or 10)
+    IDEMPOTENCY_LEASE = float(os.environ.get('IDEMPOTENCY_LEASE') or 60)
+    IDEMPOTENCY_SWEEP_INTERVAL = float(os.environ.get('IDEMPOTENCY_SWEEP_INTERVAL') or 300)
+
+    # In-process caches
+    CACHE_VERSION_INTERVAL = float(os.environ.get('CACHE_VERSION_INTERVAL') or 1.0)
+    TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL') or 30)
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE') or 10000)
+    PASSWORD_CACHE_TTL = float(os.environ.get('PASSWORD_CACHE_TTL') or 60)
+    PASSWORD_CACHE_SIZE = int(os.environ.get('PASSWORD_CACHE_SIZE') or 10000)
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL') or 60)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)
+
+    # Per request profiling of database and serialization time, reported
+    # in Server-Timing headers and by GET /api/profile; statements slower
+    # than SLOW_QUERY_MS are logged, a SLOW_QUERY_SAMPLE_RATE fraction of
+    # them, to SLOW_QUERY_LOG if set. Endpoints running one statement
+    # N_PLUS_ONE_THRESHOLD times in a request are flagged
+    PROFILING = (os.environ.get('PROFILING') or 'false').lower() in ('true', '1')
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS') or 100)
+    SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE') or 1.0)
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD') or 10)
+
+    # Prometheus metrics on /metrics; with METRICS_DIR set, worker processes
+    # write their counters there every METRICS_FLUSH_INTERVAL seconds and
+    # /metrics adds them all up. Empty the directory when restarting
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL') or 1.0)
+
+    # JSON encoder: orjson, json, or auto to use orjson when it is installed
+    JSON_BACKEND = os.environ.get('JSON_BACKEND') or 'auto'
+
+    # Response cache for movie collections; a shared tier in an SQLite file
+    # is added when RESPONSE_CACHE_PATH is set
+    RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES') or 32 * 1024 * 1024)
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH')
+    RESPONSE_CACHE_SHARED_BYTES = int(os.environ.get('RESPONSE_CACHE_SHARED_BYTES')
+                                      or 256 * 1024 * 1024)
+
+    # Live movie events: events queued per Server-Sent Events client before
+    # the client is dropped as too slow, and seconds between keep-alive
+    # comments. With EVENT_LOG_PATH set, events go through an SQLite file
+    # that every worker polls, so clients hear about writes of all workers.
+    # Each open stream holds a server thread, so a process serves at most
+    # EVENTS_MAX_SUBSCRIBERS of them (0 for no limit) and answers 503 beyond that
+    EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS') or 100)
+    EVENTS_BUFFER = int(os.environ.get('EVENTS_BUFFER') or 256)
+    EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT') or 15)
+    EVENT_LOG_PATH = os.environ.get('EVENT_LOG_PATH')
+    EVENT_LOG_POLL_INTERVAL = float(os.environ.get('EVENT_LOG_POLL_INTERVAL') or 0.25)
+    EVENT_LOG_RETENTION = float(os.environ.get('EVENT_LOG_RETENTION') or 3600)
@@ -0,0 +1,43 @@
+"""movie full-text search
+
+Revision ID: 8d2f4a6c9e13
+Revises: 3b9c51e7a2d4
+Create Date: 2026-10-17 10:41:07.552981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2f4a6c9e13'
+down_revision = '3b9c51e7a2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""CREATE VIRTUAL TABLE movie_fts USING fts5(
+        name, genre, content='movie', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+    op.execute("""CREATE TRIGGER movie_fts_ai AFTER INSERT ON movie BEGIN
+        INSERT INTO movie_fts(rowid, name, genre) VALUES (new.id, new.name, new.genre);
+    END""")
+    op.execute("""CREATE TRIGGER movie_fts_ad AFTER DELETE ON movie BEGIN
+        INSERT INTO movie_fts(movie_fts, rowid, name, genre)
+        VALUES ('delete', old.id, old.name, old.genre);
+    END""")
+    op.execute("""CREATE TRIGGER movie_fts_au AFTER UPDATE OF name, genre ON movie BEGIN
+        INSERT INTO movie_fts(movie_fts, rowid, name, genre)
+        VALUES ('delete', old.id, old.name, old.genre);
+        INSERT INTO movie_fts(rowid, name, genre) VALUES (new.id, new.name, new.genre);
+    END""")
+    # index the movies that already exist
+    op.execute("INSERT INTO movie_fts(movie_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    op.execute('DROP TRIGGER movie_fts_au')
+    op.execute('DROP TRIGGER movie_fts_ad')
+    op.execute('DROP TRIGGER movie_fts_ai')
+    op.execute('DROP TABLE movie_fts')
@@ -0,0 +1,34 @@
+"""defer movie fts on bulk insert
+
+Revision ID: c47e0b95d1a8
+Revises: 8d2f4a6c9e13
+Create Date: 2026-10-17 13:05:44.201873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e0b95d1a8'
+down_revision = '8d2f4a6c9e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE TABLE movie_fts_deferred (active INTEGER NOT NULL)')
+    op.execute('INSERT INTO movie_fts_deferred (active) VALUES (0)')
+    op.execute('DROP TRIGGER movie_fts_ai')
+    op.execute("""CREATE TRIGGER movie_fts_ai AFTER INSERT ON movie
+    WHEN NOT (SELECT active FROM movie_fts_deferred) BEGIN
+        INSERT INTO movie_fts(rowid, name, genre) VALUES (new.id, new.name, new.genre);
+    END""")
+
+
+def downgrade():
+    op.execute('DROP TRIGGER movie_fts_ai')
+    op.execute("""CREATE TRIGGER movie_fts_ai AFTER INSERT ON movie BEGIN
+        INSERT INTO movie_fts(rowid, name, genre) VALUES (new.id, new.name, new.genre);
+    END""")
+    op.execute('DROP TABLE movie_fts_deferred')
@@ -0,0 +1,70 @@
+"""movie changes
+
+Revision ID: e7f67b35d417
+Revises: 25012d723df6
+Create Date: 2026-10-17 01:44:03.582150
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7f67b35d417'
+down_revision = '25012d723df6'
+branch_labels = None
+depends_on = None
+
+
+# Copies of the statements in `app.models.MOVIE_CHANGE_DDL`
+MOVIE_CHANGE_DDL = [
+    """CREATE TRIGGER movie_change_ai AFTER INSERT ON movie BEGIN
+        INSERT OR REPLACE INTO movie_change (movie_id, user_id, deleted) VALUES (new.id, new.user_id, 0);
+    END""",
+    """CREATE TRIGGER movie_change_au AFTER UPDATE ON movie BEGIN
+        INSERT OR REPLACE INTO movie_change (movie_id, user_id, deleted) VALUES (new.id, new.user_id, 0);
+    END""",
+    """CREATE TRIGGER movie_change_ad AFTER DELETE ON movie BEGIN
+        INSERT OR REPLACE INTO movie_change (movie_id, user_id, deleted) VALUES (old.id, old.user_id, 1);
+    END""",
+]
+
+
+def upgrade():
+    op.create_table('movie_change',
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('deleted', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('seq'),
+    sa.UniqueConstraint('movie_id'),
+    sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('movie_change', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_movie_change_user_id'), ['user_id'], unique=False)
+
+    # Added in place rather than in batch mode, which would rebuild the
+    # movie table without its full-text search triggers. SQLite needs a
+    # constant default to add a NOT NULL column; existing movies are then
+    # stamped with the time of the migration.
+    op.add_column('movie', sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                     server_default='1970-01-01 00:00:00.000000'))
+    op.execute("UPDATE movie SET updated_at = strftime('%Y-%m-%d %H:%M:%f000', 'now')")
+
+    # Every existing movie counts as changed once, in id order
+    op.execute('INSERT INTO movie_change (movie_id, user_id, deleted) '
+               'SELECT id, user_id, 0 FROM movie ORDER BY id')
+    for statement in MOVIE_CHANGE_DDL:
+        op.execute(statement)
+
+
+def downgrade():
+    for trigger in ('movie_change_ai', 'movie_change_au', 'movie_change_ad'):
+        op.execute(f'DROP TRIGGER {trigger}')
+    op.drop_column('movie', 'updated_at')
+
+    with op.batch_alter_table('movie_change', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_movie_change_user_id'))
+
+    op.drop_table('movie_change')
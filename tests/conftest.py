@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+# Run the application against a throwaway in-memory database
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db  # noqa: E402
+from app.models import User, user_cache  # noqa: E402
+from app.api.conditional import response_cache  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    with flask_app.app_context():
+        db.create_all()
+        # Cached entries outlive the database the tests start afresh each time
+        response_cache.clear()
+        user_cache.clear()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    user = User(username='susan', email='susan@example.com')
+    user.set_password('cat')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def auth_headers(user):
+    token = user.get_token()
+    db.session.commit()
+    return {'Authorization': f'Bearer {token}'}
@@ -0,0 +1,107 @@
+import base64
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import g
+
+from app import db, models
+from app.models import User, Generation, token_cache, password_cache
+
+
+def count_statements(client, method, url, headers):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sa.event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        response = client.open(url, method=method, headers=headers)
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', count)
+    return response, statements
+
+
+def test_cached_token_skips_user_lookup(client, auth_headers):
+    token_cache.clear()
+    client.get('/api/movies', headers=auth_headers)
+    hits = token_cache.hits
+    db.session.remove()
+    response, statements = count_statements(client, 'GET', '/api/movies', auth_headers)
+    assert response.status_code == 200
+    assert token_cache.hits == hits + 1
+    assert not any('FROM user' in statement for statement in statements)
+
+
+def test_revoked_and_rotated_tokens_are_rejected_at_once(client, auth_headers, user):
+    assert client.get('/api/movies', headers=auth_headers).status_code == 200
+    assert client.delete('/api/tokens', headers=auth_headers).status_code == 204
+    assert client.get('/api/movies', headers=auth_headers).status_code == 401
+
+    credentials = base64.b64encode(b'susan:cat').decode()
+    token = client.post('/api/tokens', headers={'Authorization': f'Basic {credentials}'}).json['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/movies', headers=headers).status_code == 200
+    # a token close to expiry is rotated on the next request for one
+    user.token_expiration = user.token_expiration.replace(year=2000)
+    db.session.commit()
+    client.post('/api/tokens', headers={'Authorization': f'Basic {credentials}'})
+    assert client.get('/api/movies', headers=headers).status_code == 401
+
+
+def test_cached_user_loads_other_fields_on_access(client, auth_headers, user):
+    client.get('/api/movies', headers=auth_headers)
+    db.session.remove()
+    response = client.get(f'/api/users/{user.id}', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json['username'] == 'susan'
+
+
+def test_token_cache_follows_shared_version_stamp(client, auth_headers, user, monkeypatch):
+    monkeypatch.setattr(token_cache, 'version_interval', 0)
+    client.get('/api/movies', headers=auth_headers)
+    # another process revokes the token: only the database and the stamp change
+    db.session.execute(sa.update(User).values(token_expiration=datetime(2000, 1, 1)))
+    Generation.bump('tokens')
+    db.session.commit()
+    assert client.get('/api/movies', headers=auth_headers).status_code == 401
+
+
+def test_password_cache_only_remembers_successful_checks(user, monkeypatch):
+    calls = []
+    real_check = models.check_password_hash
+    monkeypatch.setattr(models, 'check_password_hash',
+                        lambda *args: calls.append(args) or real_check(*args))
+    password_cache.clear()
+    assert user.check_password('cat') and user.check_password('cat')
+    assert len(calls) == 1
+    assert not user.check_password('dog') and not user.check_password('dog')
+    assert len(calls) == 3
+
+    user.set_password('dog')
+    assert not user.check_password('cat')
+    assert user.check_password('dog')
+
+
+def test_logged_in_pages_reuse_cached_user(client, user):
+    client.post('/login', data={'username': 'susan', 'password': 'cat'})
+    # The test app context outlives requests, and Flask-Login keeps the
+    # loaded user in it
+    g.pop('_login_user', None)
+    client.get('/index')
+    db.session.remove()
+    g.pop('_login_user', None)
+    response, statements = count_statements(client, 'GET', '/index', {})
+    assert response.status_code == 200
+    assert b"susan's Movies List" in response.data
+    assert not any('FROM user' in statement for statement in statements)
+
+
+def test_profile_change_refreshes_cached_user(client, auth_headers, user):
+    client.post('/login', data={'username': 'susan', 'password': 'cat'})
+    g.pop('_login_user', None)
+    client.get('/index')
+    client.put(f'/api/users/{user.id}', json={'username': 'suzy'}, headers=auth_headers)
+    db.session.remove()
+    g.pop('_login_user', None)
+    assert b"suzy's Movies List" in client.get('/index').data
@@ -0,0 +1,115 @@
+import sqlalchemy as sa
+
+from app import db
+from app.models import Movie, User
+
+HEAT = {'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'}
+
+
+def names():
+    return db.session.scalars(sa.select(Movie.name).order_by(Movie.id)).all()
+
+
+def test_batch_applies_valid_operations_and_reports_the_rest(client, auth_headers, user):
+    other = User(username='john', email='john@example.com')
+    db.session.add(other)
+    db.session.flush()
+    mine = Movie(name='Ronin', year=1998, oscars=0, genre='Action', user_id=user.id)
+    gone = Movie(name='Thief', year=1981, oscars=0, genre='Crime', user_id=user.id)
+    theirs = Movie(name='Collateral', year=2004, oscars=0, genre='Crime', user_id=other.id)
+    db.session.add_all([mine, gone, theirs])
+    db.session.commit()
+
+    response = client.post('/api/movies/batch', headers=auth_headers, json=[
+        {'op': 'create', 'data': HEAT},
+        {'op': 'create', 'data': {'name': 'Heat'}},
+        {'op': 'update', 'id': mine.id, 'data': {'year': 1999}},
+        {'op': 'update', 'id': theirs.id, 'data': {'year': 2005}},
+        {'op': 'delete', 'id': gone.id},
+        {'op': 'delete', 'id': gone.id},
+        {'op': 'delete', 'id': 999},
+        {'op': 'rename'},
+    ])
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [result['status'] for result in results] == [201, 400, 200, 403, 204, 400, 404, 400]
+    assert [result['index'] for result in results] == list(range(8))
+    assert results[1]['message'] == 'Must include year field'
+    assert response.json['_meta'] == {'total': 8, 'applied': 3, 'failed': 5}
+    assert names() == ['Ronin', 'Collateral', 'Heat']
+    assert db.session.get(Movie, mine.id).year == 1999
+
+
+def test_batch_shape_and_size_are_checked(app, client, auth_headers, monkeypatch):
+    assert client.post('/api/movies/batch', headers=auth_headers,
+                       json={'op': 'create', 'data': HEAT}).status_code == 400
+    monkeypatch.setitem(app.config, 'MAX_BATCH_OPERATIONS', 2)
+    response = client.post('/api/movies/batch', headers=auth_headers,
+                           json=[{'op': 'create', 'data': HEAT}] * 3)
+    assert response.status_code == 413
+    assert names() == []
+
+
+def test_batch_reports_every_operation(client, auth_headers):
+    other = User(username='john', email='john@example.com')
+    db.session.add(other)
+    db.session.flush()
+    theirs = Movie(name='Thief', year=1981, oscars=0, genre='Crime', user_id=other.id)
+    db.session.add(theirs)
+    db.session.commit()
+
+    response = client.post('/api/movies/batch', headers=auth_headers, json=[
+        {'op': 'create', 'data': HEAT},
+        {'op': 'create', 'data': dict(HEAT, name=None)},
+        {'op': 'create', 'data': {'name': 'Ronin'}},
+        {'op': 'update', 'id': theirs.id, 'data': {'year': 1982}},
+        {'op': 'delete', 'id': 999},
+        {'op': 'rename'},
+        {'op': 'create', 'data': dict(HEAT, name='Collateral', year='2004')},
+        {'op': 'create', 'data': dict(HEAT, oscars=True)},
+    ])
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [result['status'] for result in results] == [201, 400, 400, 403, 404, 400, 201, 400]
+    assert results[1]['message'] == 'name must be a non-empty string'
+    assert results[2]['message'] == 'Must include year field'
+    assert results[7]['message'] == 'oscars must be an integer'
+    assert response.json['_meta'] == {'total': 8, 'applied': 2, 'failed': 6}
+    assert names() == ['Thief', 'Heat', 'Collateral']
+    assert db.session.get(Movie, results[6]['id']).year == 2004
+
+
+def test_batch_rejects_null_updates(client, auth_headers):
+    id = client.post('/api/movies', json=HEAT, headers=auth_headers).json['id']
+    results = client.post('/api/movies/batch', headers=auth_headers, json=[
+        {'op': 'update', 'id': id, 'data': {'year': None}},
+    ]).json['results']
+    assert results[0]['status'] == 400 and results[0]['message'] == 'year must be an integer'
+    assert db.session.get(Movie, id).year == 1995
+
+
+def test_batch_applies_operations_in_order(client, auth_headers, user):
+    # Ids are assigned in order, so the batch can refer to the movies it creates
+    results = client.post('/api/movies/batch', headers=auth_headers, json=[
+        {'op': 'create', 'data': HEAT},
+        {'op': 'create', 'data': dict(HEAT, name='Ronin')},
+        {'op': 'update', 'id': 1, 'data': {'name': 'Heat (1995)'}},
+        {'op': 'delete', 'id': 2},
+        {'op': 'create', 'data': dict(HEAT, name='Thief')},
+    ]).json['results']
+    assert [result['status'] for result in results] == [201, 201, 200, 204, 201]
+    assert names() == ['Heat (1995)', 'Thief']
+    db.session.refresh(user)
+    assert user.movies_count == 2
+
+
+def test_batch_rolls_back_as_a_whole(client, auth_headers, monkeypatch):
+    def reject(*args, **kwargs):
+        raise sa.exc.IntegrityError('DELETE', {}, Exception('rejected'))
+    monkeypatch.setattr('app.api.batch.delete_movies', reject)
+    response = client.post('/api/movies/batch', headers=auth_headers, json=[
+        {'op': 'create', 'data': HEAT},
+        {'op': 'delete', 'id': 1},
+    ])
+    assert response.status_code == 400
+    assert names() == []
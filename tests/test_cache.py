@@ -0,0 +1,27 @@
+from app.cache import LRUByteCache, SQLiteByteCache, TieredCache
+
+
+def test_lru_byte_cache_stays_within_budget():
+    cache = LRUByteCache(max_bytes=30)
+    cache.set('a', b'x' * 14)
+    cache.set('b', b'x' * 14)
+    cache.get('a')
+    cache.set('c', b'x' * 14)
+    cache.set('d', b'x' * 149)
+    assert cache.get('b') is None and cache.get('d') is None
+    assert cache.get('a') and cache.get('c')
+    assert cache.stats() == {'hits': 3, 'misses': 2, 'hit_ratio': 0.6,
+                             'evictions': 1, 'size': 2, 'bytes': 30}
+
+
+def test_shared_tier_is_seen_by_other_processes(tmp_path):
+    path = str(tmp_path / 'responses.db')
+    writer = TieredCache(LRUByteCache(1000), SQLiteByteCache(path, max_bytes=30))
+    for key in 'abc':
+        writer.set(key, b'x' * 14)
+    # A fresh process only shares the file
+    reader = TieredCache(LRUByteCache(1000), SQLiteByteCache(path, max_bytes=30))
+    assert reader.get('a') is None
+    assert reader.get('c') == b'x' * 14
+    memory, shared = reader.stats()
+    assert memory['size'] == 1 and shared['size'] == 2 and shared['bytes'] == 30
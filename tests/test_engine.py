@@ -0,0 +1,65 @@
+import sqlalchemy as sa
+
+from app import db
+from app.engine import engine_options, tune_engines, REPLICA_BIND
+from app.models import Movie
+
+
+def test_file_databases_get_a_tuned_pool_and_pragmas(app, tmp_path):
+    config = dict(app.config, SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path}/movies.db')
+    assert engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI='sqlite://')) == {}
+    options = engine_options(config)
+    assert options['pool_size'] == app.config['DB_POOL_SIZE'] and options['pool_pre_ping']
+
+    engine = sa.create_engine(config['SQLALCHEMY_DATABASE_URI'], **options)
+    tune_engines([engine], config)
+    tune_engines([engine], config)
+    with engine.connect() as connection:
+        pragma = lambda name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('busy_timeout') == app.config['SQLITE_BUSY_TIMEOUT']
+        assert pragma('synchronous') == 1  # NORMAL
+    engine.dispose()
+
+    # Other engines of the process keep SQLite's defaults
+    other = sa.create_engine(f'sqlite:///{tmp_path}/other.db')
+    with other.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'delete'
+    other.dispose()
+
+
+def test_read_requests_use_the_replica_until_they_write(app, client, auth_headers, user, monkeypatch):
+    # A second engine on the same in-memory database stands in for a replica
+    connection = db.engine.raw_connection().driver_connection
+    replica = sa.create_engine('sqlite://', poolclass=sa.pool.StaticPool, creator=lambda: connection)
+    monkeypatch.setitem(db.engines, REPLICA_BIND, replica)
+    statements = {db.engine: 0, replica: 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements[conn.engine] += 1
+
+    user_id = user.id
+    movie = {'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'}
+    for engine in statements:
+        sa.event.listen(engine, 'before_cursor_execute', count)
+    try:
+        db.session.remove()
+        assert client.get('/api/movies', headers=auth_headers).status_code == 200
+        assert statements[db.engine] == 0 and statements[replica] > 0
+        reads = statements[replica]
+        assert client.post('/api/movies', json=movie, headers=auth_headers).status_code == 201
+        assert statements[replica] == reads and statements[db.engine] > 0
+
+        db.session.remove()
+        with app.test_request_context('/api/movies', method='GET'):
+            db.session.scalars(sa.select(Movie)).all()
+            assert statements[replica] == reads + 1
+            db.session.add(Movie(user_id=user_id, **movie))
+            assert len(db.session.scalars(sa.select(Movie)).all()) == 2
+            db.session.scalars(sa.select(Movie)).all()
+            assert statements[replica] == reads + 1
+            db.session.rollback()
+    finally:
+        for engine in statements:
+            sa.event.remove(engine, 'before_cursor_execute', count)
+        db.session.remove()
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+
+import pytest
+
+from app import db
+from app.models import Movie
+from app.changes import movie_snapshot, record_movie_changes
+from app.events import EventBus, EventLog, event_bus
+
+
+def next_frame(response):
+    frame = next(response.response)
+    return frame.decode() if isinstance(frame, bytes) else frame
+
+
+def test_bus_fans_out_per_user_and_drops_slow_subscribers():
+    bus = EventBus(buffer_size=2)
+    fast, slow, other = bus.subscribe(1), bus.subscribe(1), bus.subscribe(2)
+    bus.publish([(1, 'created', '{}'), (2, 'created', '{}')])
+    assert fast.get(0) == (1, 'created', '{}') and other.get(0) == (2, 'created', '{}')
+    assert fast.get(0) is None
+
+    # slow never reads, and overflows on the third event
+    bus.publish([(1, 'updated', '{}'), (1, 'deleted', '{}')])
+    assert [fast.get(0)[1], fast.get(0)[1]] == ['updated', 'deleted']
+    assert slow.dropped and slow.get(0) is None
+    assert bus.stats() == {'subscriptions': 2, 'published': 4, 'delivered': 6, 'dropped': 1}
+    bus.unsubscribe(fast)
+    assert bus.stats()['subscriptions'] == 1
+
+    bus.max_subscribers = 2
+    assert bus.subscribe(3) is not None and bus.subscribe(3) is None
+
+
+def test_events_are_published_on_commit_only(client, auth_headers, user):
+    subscription = event_bus.subscribe(user.id)
+    try:
+        movie = {'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'}
+        id = client.post('/api/movies', json=movie, headers=auth_headers).json['id']
+        client.post('/api/movies/import', data='name,year,oscars,genre\nRonin,1998,0,\n',
+                    headers=dict(auth_headers, **{'Content-Type': 'text/csv'}))
+        client.delete(f'/api/movies/{id}', headers=auth_headers)
+        events = [subscription.get(0) for _ in range(3)]
+        assert [kind for _, kind, _ in events] == ['created', 'created', 'deleted']
+        assert json.loads(events[0][2]) == dict(movie, id=id, user_id=user.id)
+        assert json.loads(events[1][2])['id'] == id + 1
+
+        thief = Movie(name='Thief', year=1981, oscars=0, user_id=user.id)
+        db.session.add(thief)
+        db.session.flush()
+        record_movie_changes([(None, movie_snapshot(thief))])
+        db.session.rollback()
+        assert subscription.get(0) is None
+    finally:
+        event_bus.unsubscribe(subscription)
+
+
+def test_event_stream(app, client, auth_headers, user, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT', 0.01)
+    response = client.get(f'/api/users/{user.id}/movies/events', headers=auth_headers)
+    assert response.mimetype == 'text/event-stream'
+    assert next_frame(response) == ': keep-alive\n\n'
+    id = client.post('/api/movies', json={'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'},
+                     headers=auth_headers).json['id']
+    frame = next_frame(response)
+    assert frame.startswith('id: ') and '\nevent: created\n' in frame and f'"id": {id}' in frame
+    response.close()
+    assert event_bus.stats()['subscriptions'] == 0
+
+    monkeypatch.setattr(event_bus, 'max_subscribers', 1)
+    response = client.get(f'/api/users/{user.id}/movies/events', headers=auth_headers)
+    assert client.get(f'/api/users/{user.id}/movies/events',
+                      headers=auth_headers).status_code == 503
+    response.close()
+    assert event_bus.stats()['subscriptions'] == 0
+
+    # Streams that fail to start, or are never read, give their slot back
+    def replay(user_id, after):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(event_bus, 'log', object())
+    monkeypatch.setattr(event_bus, '_ensure_polling', lambda: None)
+    monkeypatch.setattr(event_bus, 'replay', replay)
+    with pytest.raises(sqlite3.OperationalError):
+        client.get(f'/api/users/{user.id}/movies/events',
+                   headers=dict(auth_headers, **{'Last-Event-ID': '5'}))
+    assert event_bus.stats()['subscriptions'] == 0
+    client.get(f'/api/users/{user.id}/movies/events', headers=auth_headers).close()
+    assert event_bus.stats()['subscriptions'] == 0
+
+    assert client.get(f'/api/users/{user.id + 1}/movies/events', headers=auth_headers).status_code == 403
+
+
+def test_event_log_crosses_processes_and_replays(tmp_path):
+    writer = EventBus(16, EventLog(str(tmp_path / 'events.db')))
+    reader = EventBus(16, EventLog(str(tmp_path / 'events.db')), poll_interval=0.01)
+    subscription = reader.subscribe(1)
+    writer.publish([(1, 'created', '{"id": 1}'), (2, 'created', '{"id": 2}'),
+                    (1, 'deleted', '{"id": 1}')])
+    assert subscription.get(5) == (1, 'created', '{"id": 1}')
+    assert subscription.get(5) == (3, 'deleted', '{"id": 1}')
+    assert reader.replay(1, 1) == [(3, 'deleted', '{"id": 1}')]
+    assert writer.stats()['delivered'] == 0
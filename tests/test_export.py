@@ -0,0 +1,40 @@
+import json
+
+from app import db
+from app.models import User, Movie
+
+
+def test_export_streams_every_movie(client, auth_headers, user):
+    url = f'/api/users/{user.id}/movies/export'
+    assert client.get(url, headers=auth_headers).get_data(as_text=True) == ''
+    for name, genre in [('Heat', 'Crime'), ('Ronin, the', None)]:
+        db.session.add(Movie(name=name, year=1995, oscars=0, genre=genre, user_id=user.id))
+    db.session.commit()
+
+    response = client.get(url, headers=auth_headers)
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'id': 1, 'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime', 'user_id': user.id},
+        {'id': 2, 'name': 'Ronin, the', 'year': 1995, 'oscars': 0, 'genre': None,
+         'user_id': user.id}]
+
+    response = client.get(url + '?format=csv', headers=auth_headers)
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == \
+        f'attachment; filename=user_{user.id}_movies.csv'
+    assert response.get_data(as_text=True) == (
+        f'id,name,year,oscars,genre,user_id\r\n1,Heat,1995,0,Crime,{user.id}\r\n'
+        f'2,"Ronin, the",1995,0,,{user.id}\r\n')
+    assert client.get(url + '?format=xml', headers=auth_headers).status_code == 400
+
+    response = client.get(url + '?format=csv&fields=name,genre', headers=auth_headers)
+    assert response.get_data(as_text=True) == 'name,genre\r\nHeat,Crime\r\n"Ronin, the",\r\n'
+    assert client.get(url + '?fields=password', headers=auth_headers).status_code == 400
+
+
+def test_export_is_limited_to_the_owner(client, auth_headers):
+    db.session.add(User(username='john', email='john@example.com'))
+    db.session.commit()
+    assert client.get('/api/users/2/movies/export', headers=auth_headers).status_code == 403
+    assert client.get('/api/users/99/movies/export', headers=auth_headers).status_code == 404
@@ -0,0 +1,71 @@
+import json
+import os
+
+import sqlalchemy as sa
+
+from app.metrics import LATENCY_BUCKETS, Metrics
+
+
+def samples(client):
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    return dict(line.rsplit(' ', 1) for line in response.get_data(as_text=True).splitlines()
+                if not line.startswith('#'))
+
+
+def test_metrics_count_requests_by_endpoint(client, auth_headers):
+    requests = 'http_requests_total{endpoint="api.get_movies",method="GET",status="200"}'
+    count = 'http_request_duration_seconds_count{endpoint="api.get_movies"}'
+    client.get('/api/users', headers=auth_headers)
+    before = samples(client)
+    client.get('/api/movies', headers=auth_headers)
+    client.get('/no/such/page')
+    after = samples(client)
+
+    assert int(after[requests]) == int(before.get(requests, 0)) + 1
+    assert int(after[count]) == int(before.get(count, 0)) + 1
+    assert after['http_request_duration_seconds_bucket{endpoint="api.get_movies",le="+Inf"}'] \
+        == after[count]
+    assert 'http_requests_total{endpoint="unmatched",method="GET",status="404"}' in after
+    assert int(after['db_pool_checkouts_total{pool="primary"}']) > 0
+    assert int(after['cache_hits_total{cache="tokens"}']) \
+        > int(before['cache_hits_total{cache="tokens"}'])
+    # Only the /metrics request itself is still being handled
+    assert after['http_requests_in_flight'] == '1'
+
+
+def test_metrics_add_up_worker_processes(tmp_path):
+    metrics = Metrics(str(tmp_path))
+    metrics.observe('api.get_movies', 'GET', 200, 0.003)
+    metrics.request_started()
+
+    # A worker that has exited since, its pid taken past the kernel limit, and
+    # an earlier worker whose pid this process reuses
+    for pid, started in ((2 ** 22 + 1, metrics.started), (os.getpid(), metrics.started - 1)):
+        dead = Metrics().snapshot()
+        dead['pid'], dead['started'] = pid, started
+        dead['counters'] = [['http_requests_total', [['endpoint', 'api.get_movies'],
+                                                     ['method', 'GET'], ['status', 200]], 2]]
+        dead['gauges'] = [['http_requests_in_flight', [], 5]]
+        dead['histograms'] = {'api.get_movies': [0] * len(LATENCY_BUCKETS) + [2, 30.0]}
+        with open(os.path.join(tmp_path, f'{pid}-{started}.json'), 'w') as f:
+            json.dump(dead, f)
+
+    lines = metrics.render().splitlines()
+    assert 'http_requests_total{endpoint="api.get_movies",method="GET",status="200"} 5' in lines
+    assert 'http_requests_in_flight 1' in lines
+    assert 'http_request_duration_seconds_bucket{endpoint="api.get_movies",le="0.005"} 1' in lines
+    assert 'http_request_duration_seconds_bucket{endpoint="api.get_movies",le="+Inf"} 5' in lines
+    assert 'http_request_duration_seconds_count{endpoint="api.get_movies"} 5' in lines
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_metrics_only_count_the_application_pools(app, client, tmp_path):
+    metrics = app.extensions['metrics']
+    checkouts = dict(metrics.pool_checkouts)
+    engine = sa.create_engine(f'sqlite:///{tmp_path}/other.db')
+    with engine.connect() as connection:
+        connection.exec_driver_sql('SELECT 1')
+    engine.dispose()
+    assert metrics.pool_checkouts == checkouts
+    assert list(checkouts) == ['primary']
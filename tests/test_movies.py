@@ -0,0 +1,466 @@
+import re
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy as sa
+from flask.json.provider import DefaultJSONProvider
+
+from app import db
+from app.models import Movie, MovieRollup, IdempotencyKey
+from app.api.movies import MOVIE_FILTERS, movie_serializer
+from app.jsonprovider import OrjsonProvider
+from app.groupcommit import GroupCommitter
+
+FILTER_VALUES = {
+    'year_min': '1990',
+    'year_max': '2005',
+    'genre': 'Drama',
+    'min_oscars': '2',
+    'name_prefix': 'The',
+}
+
+
+@pytest.fixture
+def movies(user):
+    genres = ['Drama', 'Comedy', None]
+    for i in range(30):
+        db.session.add(Movie(name=f'The Movie {i:02d}', year=1980 + i, oscars=i % 5,
+                             genre=genres[i % 3], user_id=user.id))
+    db.session.commit()
+
+
+def captured_selects(client, url, headers):
+    """Run a request and return the movie SELECT statements it executed."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT') and 'FROM movie' in statement:
+            statements.append((statement, parameters))
+
+    sa.event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', capture)
+    assert response.status_code == 200
+    return statements
+
+
+def test_filters_cover_documented_parameters():
+    assert set(FILTER_VALUES) == set(MOVIE_FILTERS)
+
+
+@pytest.mark.parametrize('prefix', ['/api/movies', '/api/users/1/movies'])
+@pytest.mark.parametrize('name', sorted(FILTER_VALUES))
+@pytest.mark.parametrize('after', [None, '5'])
+def test_filters_use_an_index(client, auth_headers, movies, prefix, name, after):
+    url = f'{prefix}?{name}={FILTER_VALUES[name]}'
+    if after:
+        url += f'&after={after}'
+    statements = captured_selects(client, url, auth_headers)
+    assert statements
+    with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement,
+                                        tuple(parameters)).all()
+            details = [row[-1] for row in plan]
+            assert all(not d.startswith('SCAN movie') for d in details), details
+            assert any('USING' in d for d in details), details
+
+
+def test_filters_and_sort_across_pages(client, auth_headers, movies):
+    expected = db.session.scalars(
+        sa.select(Movie).where(Movie.year >= 1985)
+        .order_by(Movie.oscars.desc(), Movie.year, Movie.id)).all()
+    url = '/api/movies?year_min=1985&sort=-oscars,year&limit=4'
+    seen = []
+    while url:
+        response = client.get(url, headers=auth_headers)
+        assert response.status_code == 200
+        assert len(response.json['movies']) <= 4
+        seen.extend(movie['id'] for movie in response.json['movies'])
+        url = response.json['_links']['next']
+    assert seen == [movie.id for movie in expected]
+
+
+@pytest.mark.parametrize('query', ['sort=password', 'year_min=recent', 'limit=0',
+                                   'sort=year&after=not-a-cursor',
+                                   # [{"a": 1}, 1], [1, 1] and ["x", 1]
+                                   'sort=name&after=W3siYSI6MX0sMV0', 'sort=name&after=WzEsIDFd',
+                                   'sort=year&after=WyJ4IiwgMV0'])
+def test_invalid_parameters(client, auth_headers, query):
+    response = client.get(f'/api/movies?{query}', headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_writes_check_value_types(client, auth_headers, user):
+    # Values the cursors of sorted pages are checked against
+    movie = {'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'}
+    assert client.post('/api/movies', json=dict(movie, year='soon'),
+                       headers=auth_headers).status_code == 400
+    response = client.post('/api/movies', json=dict(movie, year='1996'), headers=auth_headers)
+    assert response.status_code == 201 and response.json['year'] == 1996
+    id = response.json['id']
+    assert client.put(f'/api/movies/{id}', json={'year': 'later'},
+                      headers=auth_headers).status_code == 400
+    assert client.put(f'/api/movies/{id}', json={'name': ''}, headers=auth_headers).status_code == 400
+    client.post('/api/movies', json=movie, headers=auth_headers)
+    page = client.get('/api/movies?sort=year&limit=1', headers=auth_headers).json
+    assert client.get(page['_links']['next'], headers=auth_headers).json['movies'][0]['year'] == 1996
+
+
+def test_search_tracks_writes_and_matches_prefixes(client, auth_headers, user):
+    for name in ['Star Wars', 'Stardust', 'The Matrix']:
+        db.session.add(Movie(name=name, year=1999, oscars=0, genre='Sci-Fi', user_id=user.id))
+    db.session.commit()
+    matrix = db.session.scalar(sa.select(Movie).where(Movie.name == 'The Matrix'))
+    matrix.name = 'Star Matrix'
+    db.session.delete(db.session.scalar(sa.select(Movie).where(Movie.name == 'Stardust')))
+    db.session.commit()
+
+    response = client.get('/api/movies/search?q=sta', headers=auth_headers)
+    assert response.status_code == 200
+    assert sorted(m['name'] for m in response.json['movies']) == ['Star Matrix', 'Star Wars']
+
+    response = client.get('/api/movies/search?q=star%20wa&limit=1', headers=auth_headers)
+    assert [m['name'] for m in response.json['movies']] == ['Star Wars']
+    assert response.json['_links']['next'] is None
+
+
+def test_import_reports_row_errors_and_indexes_rows(client, auth_headers):
+    upload = ('name,year,oscars,genre\n'
+              'Alien,1979,1,Horror\n'
+              'Aliens,soon,6,Action\n'
+              'Alien 3,1992,0,\n')
+    headers = dict(auth_headers, **{'Content-Type': 'text/csv'})
+    response = client.post('/api/movies/import', data=upload, headers=headers)
+    assert response.status_code == 200
+    assert response.json['imported'] == 2
+    assert response.json['errors'] == [{'line': 3, 'message': 'year must be an integer'}]
+    assert db.session.scalar(sa.select(Movie.genre).where(Movie.name == 'Alien 3')) is None
+
+    response = client.get('/api/movies/search?q=ali', headers=auth_headers)
+    assert sorted(m['name'] for m in response.json['movies']) == ['Alien', 'Alien 3']
+
+    # Rows the csv module rejects are reported and skipped, not the rest of the file
+    upload = ('name,year,oscars,genre\n'
+              f'{"x" * 200_000},1979,0,\n'
+              'Prometheus,2012,0,Horror\n')
+    response = client.post('/api/movies/import', data=upload, headers=headers)
+    assert response.json['imported'] == 1 and response.json['failed'] == 1
+    assert response.json['errors'] == [
+        {'line': 2, 'message': 'Invalid CSV: field larger than field limit (131072)'}]
+    # the insert trigger is live again once the import has committed
+    client.post('/api/movies', json={'name': 'Alien Resurrection', 'year': 1997,
+                                     'oscars': 0, 'genre': 'Horror'}, headers=auth_headers)
+    response = client.get('/api/movies/search?q=resurr', headers=auth_headers)
+    assert [m['name'] for m in response.json['movies']] == ['Alien Resurrection']
+
+
+def test_conditional_requests(client, auth_headers, user, movies):
+    response = client.get('/api/movies', headers=auth_headers)
+    etag = response.headers['ETag']
+    cached = dict(auth_headers, **{'If-None-Match': etag})
+    response = client.get('/api/movies', headers=cached)
+    assert response.status_code == 304 and response.data == b''
+    assert client.get('/api/movies?limit=5', headers=cached).status_code == 200
+
+    movie = client.get('/api/movies/1', headers=auth_headers)
+    stale = dict(auth_headers, **{'If-Match': movie.headers['ETag']})
+    updated = client.put('/api/movies/1', json={'oscars': 9}, headers=stale)
+    assert updated.status_code == 200
+    assert client.put('/api/movies/1', json={'oscars': 8}, headers=stale).status_code == 412
+    assert client.delete('/api/movies/1', headers=stale).status_code == 412
+    assert client.get('/api/movies', headers=cached).status_code == 200
+    current = dict(auth_headers, **{'If-None-Match': updated.headers['ETag']})
+    assert client.get('/api/movies/1', headers=current).status_code == 304
+
+    # The ETag of any representation of the movie validates writes to it
+    sparse = client.get('/api/movies/1?fields=name', headers=auth_headers).headers['ETag']
+    assert sparse != updated.headers['ETag']
+    updated = client.put('/api/movies/1', json={'oscars': 7}, headers=dict(
+        auth_headers, **{'If-Match': sparse}))
+    assert updated.status_code == 200
+    current = dict(auth_headers, **{'If-Match': updated.headers['ETag']})
+    assert client.put('/api/movies/1?fields=name', json={'oscars': 6},
+                      headers=current).status_code == 200
+    assert client.delete('/api/movies/1', headers=current).status_code == 412
+    sparse = client.get('/api/movies/1?fields=name', headers=auth_headers).headers['ETag']
+    assert client.delete('/api/movies/1', headers=dict(
+        auth_headers, **{'If-Match': sparse})).status_code == 204
+
+    profile = client.get(f'/api/users/{user.id}', headers=auth_headers)
+    client.put(f'/api/users/{user.id}', json={'email': 'susan@example.org'}, headers=auth_headers)
+    assert client.get(f'/api/users/{user.id}', headers=dict(
+        auth_headers, **{'If-None-Match': profile.headers['ETag']})).status_code == 200
+
+
+def test_collections_are_served_from_the_response_cache(client, auth_headers, user, movies):
+    first = client.get(f'/api/users/{user.id}/movies?genre=Drama', headers=auth_headers)
+    assert captured_selects(client, f'/api/users/{user.id}/movies?genre=Drama', auth_headers) == []
+    second = client.get(f'/api/users/{user.id}/movies?genre=Drama', headers=auth_headers)
+    assert second.data == first.data and second.headers['ETag'] == first.headers['ETag']
+
+    client.post('/api/movies', json={'name': 'New', 'year': 2020, 'oscars': 0, 'genre': 'Drama'},
+                headers=auth_headers)
+    updated = client.get(f'/api/users/{user.id}/movies?genre=Drama', headers=auth_headers)
+    assert updated.json['_meta']['count'] == first.json['_meta']['count'] + 1
+    assert client.get('/api/caches', headers=auth_headers).json['response'][0]['hits'] >= 2
+
+
+def test_collections_serialize_like_single_movies(client, auth_headers, movies):
+    data = client.get('/api/movies?limit=100', headers=auth_headers).json
+    assert len(data['movies']) == 30
+    assert data['movies'] == [client.get(f'/api/movies/{movie["id"]}', headers=auth_headers).json
+                              for movie in data['movies']]
+
+
+def test_orjson_output_matches_the_standard_library(app, movies):
+    # orjson is an optional speedup, not a requirement
+    pytest.importorskip('orjson')
+    with app.test_request_context():
+        serialize = movie_serializer()
+        expected = [serialize(movie) for movie in db.session.scalars(sa.select(Movie).order_by(Movie.id))]
+        payload = {'movies': expected, 'name': 'Amélie', 'when': datetime(2024, 5, 1)}
+        standard = DefaultJSONProvider(app).response(payload).get_data()
+        assert OrjsonProvider(app).response(payload).get_data() == \
+            standard.replace(b'Am\\u00e9lie', 'Amélie'.encode())
+
+
+def test_sparse_fieldsets_narrow_the_select(client, auth_headers, user, movies):
+    url = '/api/movies?fields=id,name,year&links=false&sort=-oscars'
+    (statement, _), = captured_selects(client, url, auth_headers)
+    assert 'movie.genre' not in statement and 'movie.user_id' not in statement
+    page = client.get(url, headers=auth_headers).json
+    assert set(page['movies'][0]) == {'id', 'name', 'year'}
+    assert client.get(page['_links']['next'], headers=auth_headers).json['_meta']['count'] == 5
+
+    movie = client.get('/api/movies/1?fields=name', headers=auth_headers).json
+    assert set(movie) == {'name', '_links'}
+    users = client.get('/api/users?fields=username&links=false', headers=auth_headers).json
+    assert users['users'] == [{'username': 'susan'}]
+    assert client.get('/api/movies?fields=name,budget', headers=auth_headers).status_code == 400
+    assert client.get('/api/movies?fields=', headers=auth_headers).status_code == 400
+    assert client.get('/api/users/1?fields=,', headers=auth_headers).status_code == 400
+    assert client.get('/api/movies/1?links=maybe', headers=auth_headers).status_code == 400
+
+
+def test_stats_rollups_follow_every_write_path(app, client, auth_headers, user):
+    def grouped_from_movies():
+        rows = db.session.execute(sa.select(Movie.year, Movie.genre, sa.func.count(),
+                                            sa.func.sum(Movie.oscars))
+                                  .group_by(Movie.year, Movie.genre)
+                                  .order_by(Movie.year, sa.func.coalesce(Movie.genre, '')))
+        return [{'year': year, 'genre': genre, 'movies': count, 'oscars': oscars}
+                for year, genre, count, oscars in rows]
+
+    movie = {'name': 'Heat', 'year': 1995, 'oscars': 2, 'genre': 'Crime'}
+    id = client.post('/api/movies', json=movie, headers=auth_headers).json['id']
+    client.put(f'/api/movies/{id}', json={'genre': 'Drama', 'oscars': 3}, headers=auth_headers)
+    ids = [result['id'] for result in client.post('/api/movies/batch', headers=auth_headers, json=[
+        {'op': 'create', 'data': movie}, {'op': 'create', 'data': dict(movie, genre=None)},
+        {'op': 'create', 'data': dict(movie, year=2001)}]).json['results']]
+    client.post('/api/movies/batch', headers=auth_headers, json=[
+        {'op': 'update', 'id': ids[0], 'data': {'year': 2001}}, {'op': 'delete', 'id': ids[2]}])
+    client.post('/api/movies/import', data='name,year,oscars,genre\nRonin,1998,1,\nHeat,1995,4,Crime\n',
+                headers=dict(auth_headers, **{'Content-Type': 'text/csv'}))
+    client.post('/login', data={'username': 'susan', 'password': 'cat'})
+    client.post('/add_movie', data={'name': 'Thief', 'year': 1981, 'oscars': 0})
+    client.post(f'/delete_movie/{id}')
+
+    stats = client.get('/api/stats?group_by=year,genre', headers=auth_headers).json
+    expected = grouped_from_movies()
+    assert stats['stats'] == expected
+    totals = client.get(f'/api/stats?user_id={user.id}', headers=auth_headers).json['stats']
+    assert totals == [{'movies': sum(g['movies'] for g in expected),
+                       'oscars': sum(g['oscars'] for g in expected)}]
+    assert client.get('/api/stats?group_by=name', headers=auth_headers).status_code == 400
+
+    rollups = db.session.execute(sa.select(MovieRollup.__table__).order_by(*MovieRollup.__table__.c)).all()
+    MovieRollup.rebuild()
+    assert db.session.execute(sa.select(MovieRollup.__table__).order_by(*MovieRollup.__table__.c)).all() == rollups
+
+    # Rebuilding from the command line replaces the statistics served before
+    response = client.get('/api/stats', headers=auth_headers)
+    db.session.execute(sa.delete(MovieRollup))
+    db.session.commit()
+    assert app.test_cli_runner().invoke(args=['rebuild-stats']).exit_code == 0
+    again = client.get('/api/stats', headers=dict(
+        auth_headers, **{'If-None-Match': response.headers['ETag']}))
+    assert again.status_code == 200 and again.json['stats'] == response.json['stats']
+
+
+def test_group_commit_shares_transactions_and_isolates_bad_rows(app, client, auth_headers, user,
+                                                                 monkeypatch):
+    committer = GroupCommitter(window=0.2, max_batch=10)
+    rows = [{'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime', 'user_id': user.id},
+            {'name': None, 'year': 1995, 'oscars': 0, 'genre': 'Crime', 'user_id': user.id},
+            {'name': 'Ronin', 'year': 1998, 'oscars': 0, 'genre': None, 'user_id': user.id}]
+    futures = [committer.submit(row) for row in rows]
+    first, failed, last = futures
+    assert last.result(timeout=5) == first.result(timeout=5) + 1
+    with pytest.raises(sa.exc.IntegrityError):
+        failed.result(timeout=5)
+    assert committer.stats() == {'batches': 1, 'rows': 3, 'rows_per_batch': 3.0}
+
+    monkeypatch.setitem(app.config, 'GROUP_COMMIT', True)
+    response = client.post('/api/movies?fields=name', json=dict(rows[0], name='Thief'),
+                           headers=auth_headers)
+    assert response.status_code == 201 and response.json['name'] == 'Thief'
+    assert client.get(response.headers['Location'], headers=auth_headers).json['year'] == 1995
+    assert client.post('/api/movies', json=rows[1], headers=auth_headers).status_code == 400
+    # The counter was updated by the committer's session
+    db.session.expire_all()
+    assert client.get(f'/api/users/{user.id}', headers=auth_headers).json['movies_count'] == 3
+
+
+def test_group_commit_waits_time_out(app, client, auth_headers, user, monkeypatch):
+    # A writer that never runs leaves the request waiting on its row
+    committer = GroupCommitter(window=0, max_batch=10)
+    monkeypatch.setattr(committer, '_ensure_started', lambda: None)
+    monkeypatch.setattr('app.api.movies.group_committer', committer)
+    monkeypatch.setitem(app.config, 'GROUP_COMMIT', True)
+    monkeypatch.setitem(app.config, 'GROUP_COMMIT_TIMEOUT', 0.05)
+    movie = {'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'}
+    assert client.post('/api/movies', json=movie, headers=auth_headers).status_code == 503
+    row, future = committer._queue.get_nowait()
+    assert future.cancelled()
+
+    # A row the writer already took may still be saved, and a 503 releases
+    # the Idempotency-Key, so the client is not told to retry with it
+    def running():
+        future = Future()
+        future.set_running_or_notify_cancel()
+        return future
+    monkeypatch.setattr(committer, 'submit', lambda row: running())
+    response = client.post('/api/movies', json=movie,
+                           headers=dict(auth_headers, **{'Idempotency-Key': 'heat'}))
+    assert response.status_code == 503 and 'may have been saved' in response.json['message']
+    assert 'Idempotency-Key' not in response.json['message']
+
+    def failing(error):
+        future = Future()
+        future.set_exception(error)
+        return future
+    monkeypatch.setattr(committer, 'submit', lambda row: failing(
+        sa.exc.OperationalError('INSERT', {}, Exception('database is locked'))))
+    assert client.post('/api/movies', json=movie, headers=auth_headers).status_code == 503
+    monkeypatch.setattr(committer, 'submit', lambda row: failing(
+        sa.exc.InternalError('INSERT', {}, Exception('broken'))))
+    assert client.post('/api/movies', json=movie, headers=auth_headers).status_code == 500
+    assert db.session.scalar(sa.select(sa.func.count()).select_from(Movie)) == 0
+
+
+def test_idempotency_keys_replay_the_first_response(app, client, auth_headers, user, monkeypatch):
+    def movie_count():
+        return db.session.scalar(sa.select(sa.func.count()).select_from(Movie))
+
+    movie = {'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'}
+    headers = dict(auth_headers, **{'Idempotency-Key': 'heat'})
+    first = client.post('/api/movies', json=movie, headers=headers)
+    again = client.post('/api/movies', json=movie, headers=headers)
+    assert first.status_code == again.status_code == 201
+    assert again.json == first.json and again.headers['Location'] == first.headers['Location']
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert movie_count() == 1
+    assert client.post('/api/movies', json=dict(movie, year=1996), headers=headers).status_code == 422
+
+    # Rejected requests are replayed too, failed ones are not stored
+    headers['Idempotency-Key'] = 'bad'
+    assert client.post('/api/movies', json={}, headers=headers).status_code == 400
+    assert client.post('/api/movies', json={}, headers=headers).headers['Idempotent-Replayed']
+    assert movie_count() == 1
+
+    # A key still held by a request of another worker
+    monkeypatch.setitem(app.config, 'IDEMPOTENCY_WAIT', 0.1)
+    db.session.execute(sa.update(IdempotencyKey).where(IdempotencyKey.key == 'heat').values(
+        status=None, body=None))
+    db.session.commit()
+    assert client.post('/api/movies', json=movie, headers=dict(
+        headers, **{'Idempotency-Key': 'heat'})).status_code == 409
+    assert movie_count() == 1
+
+    # Unless it held the key for longer than its lease, then the retry runs
+    def age(key, **delta):
+        record = db.session.get(IdempotencyKey, ('1', key))
+        record.created_at -= timedelta(**delta)
+        db.session.commit()
+    age('heat', minutes=5)
+    headers['Idempotency-Key'] = 'heat'
+    retried = client.post('/api/movies', json=movie, headers=headers)
+    assert retried.status_code == 201 and retried.json['id'] != first.json['id']
+    assert client.post('/api/movies', json=movie, headers=headers).json == retried.json
+    assert movie_count() == 2
+
+    # Expired responses are not replayed, and are swept from time to time
+    age('bad', days=2)
+    headers['Idempotency-Key'] = 'fresh'
+    client.post('/api/movies', json={}, headers=headers)
+    assert db.session.get(IdempotencyKey, ('1', 'bad')) is not None
+    monkeypatch.setattr('app.api.idempotency.next_sweep', 0)
+    headers['Idempotency-Key'] = 'heat'
+    assert client.post('/api/movies', json=dict(movie, year=1996),
+                       headers=headers).status_code == 422
+    assert db.session.get(IdempotencyKey, ('1', 'bad')) is None
+    age('heat', days=2)
+    assert client.post('/api/movies', json=dict(movie, year=1996),
+                       headers=headers).status_code == 201
+
+
+def test_idempotency_keys_are_scoped_to_the_user(client, auth_headers):
+    headers = {'Idempotency-Key': 'signup'}
+    user = {'username': 'tom', 'email': 'tom@example.com', 'password': 'dog'}
+    first = client.post('/api/users', json=user, headers=headers)
+    assert client.post('/api/users', json=user, headers=headers).json == first.json
+    # The same key means another request for another user
+    movie = {'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'}
+    assert client.post('/api/movies', json=movie,
+                       headers=dict(auth_headers, **headers)).status_code == 201
+
+
+def test_changes_stream_follows_every_write_path(client, auth_headers, user):
+    def sync(since, limit=2):
+        changes, url = [], f'/api/movies/changes?since={since}&limit={limit}'
+        while True:
+            page = client.get(url, headers=auth_headers).json
+            changes += page['changes']
+            if not page['_meta']['has_more']:
+                return changes, page['_meta']['cursor']
+            url = page['_links']['next']
+
+    assert sync(0) == ([], '0')
+    movie = {'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'}
+    first = client.post('/api/movies', json=movie, headers=auth_headers).json['id']
+    second = client.post('/api/movies', json=movie, headers=auth_headers).json['id']
+    client.post('/api/movies/import', data='name,year,oscars,genre\nRonin,1998,0,\n',
+                headers=dict(auth_headers, **{'Content-Type': 'text/csv'}))
+    client.post('/login', data={'username': 'susan', 'password': 'cat'})
+    client.post('/add_movie', data={'name': 'Thief', 'year': 1981, 'oscars': 0})
+    changes, cursor = sync(0)
+    ids = [change['id'] for change in changes]
+    assert ids[:2] == [first, second] and len(ids) == 4
+    assert [change['name'] for change in changes] == ['Heat', 'Heat', 'Ronin', 'Thief']
+    assert not any(change['deleted'] for change in changes)
+    # ISO-8601 in UTC with microseconds, whichever path wrote the row
+    assert all(re.fullmatch(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}\+00:00', change['updated_at'])
+               for change in changes)
+    imported, added = ids[2:]
+
+    client.put(f'/api/movies/{first}', json={'name': 'Heat II'}, headers=auth_headers)
+    client.post('/api/movies/batch', headers=auth_headers, json=[
+        {'op': 'update', 'id': imported, 'data': {'oscars': 1}},
+        {'op': 'delete', 'id': second}])
+    client.post(f'/delete_movie/{added}')
+    changes, cursor = sync(cursor)
+    assert changes[0]['id'] == first and changes[0]['name'] == 'Heat II'
+    assert changes[1]['id'] == imported and changes[1]['oscars'] == 1
+    assert changes[2:] == [{'id': second, 'deleted': True}, {'id': added, 'deleted': True}]
+    assert sync(cursor) == ([], cursor)
+
+    # A full sync lists every movie once, at its latest change
+    assert [change['id'] for change in sync(0, limit=100)[0]] == [first, imported, second, added]
+    assert sync(0, limit=100)[0] == sync(0, limit=1)[0]
+    other = client.get(f'/api/movies/changes?user_id={user.id + 1}', headers=auth_headers).json
+    assert other['changes'] == []
+    assert client.get('/api/movies/changes?since=x', headers=auth_headers).status_code == 400
@@ -0,0 +1,49 @@
+import pytest
+
+from app import db
+from app.models import User, Movie
+
+
+@pytest.fixture
+def movies(user):
+    other = User(username='john', email='john@example.com')
+    db.session.add(other)
+    db.session.flush()
+    for i in range(7):
+        db.session.add(Movie(name=f'Movie {i}', year=2000 + i, oscars=0, genre='Drama',
+                             user_id=user.id if i % 2 == 0 else other.id))
+    db.session.commit()
+
+
+def pages(client, url, headers):
+    """Follow the next links of a collection and return its pages."""
+    pages = []
+    while url is not None:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        pages.append(response.json)
+        url = response.json['_links']['next']
+    return pages
+
+
+def test_pages_follow_next_links(client, auth_headers, movies):
+    result = pages(client, '/api/movies?limit=3', auth_headers)
+    assert [page['_meta']['count'] for page in result] == [3, 3, 1]
+    assert [movie['name'] for page in result for movie in page['movies']] == \
+        [f'Movie {i}' for i in range(7)]
+    assert result[-1]['_meta']['next_cursor'] is None
+
+
+def test_user_movies_are_paginated(client, auth_headers, user, movies):
+    result = pages(client, f'/api/users/{user.id}/movies?limit=2', auth_headers)
+    assert [movie['name'] for page in result for movie in page['movies']] == \
+        ['Movie 0', 'Movie 2', 'Movie 4', 'Movie 6']
+    assert client.get(f'/api/users/{user.id + 1}/movies', headers=auth_headers).status_code == 403
+
+
+def test_page_size_is_checked_and_capped(app, client, auth_headers, movies, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_MOVIES_PER_PAGE', 5)
+    page = client.get('/api/movies?limit=50', headers=auth_headers).json
+    assert page['_meta']['limit'] == 5 and page['_meta']['count'] == 5
+    for limit in ('0', 'many'):
+        assert client.get(f'/api/movies?limit={limit}', headers=auth_headers).status_code == 400
@@ -0,0 +1,80 @@
+import json
+import logging
+
+import pytest
+import sqlalchemy as sa
+from flask import g
+
+from app.profiling import EndpointStats, RequestProfile
+
+
+@pytest.fixture
+def profiling(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PROFILING', True)
+    app.extensions['profiling'].clear()
+    yield app.extensions['profiling']
+    app.extensions['profiling'].clear()
+
+
+def server_timing(response):
+    return {name: dict(param.split('=', 1) for param in params)
+            for name, *params in (metric.split(';') for metric in
+                                  response.headers['Server-Timing'].split(', '))}
+
+
+def test_requests_report_database_and_serialization_time(client, auth_headers, profiling):
+    timing = server_timing(client.get('/api/movies', headers=auth_headers))
+    assert set(timing) == {'db', 'db-slowest', 'serialize', 'total'}
+    queries = int(timing['db']['desc'].strip('"').split()[0])
+    assert queries > 0 and float(timing['serialize']['dur']) > 0
+    assert float(timing['db-slowest']['dur']) <= float(timing['db']['dur'])
+
+    stats = client.get('/api/profile', headers=auth_headers).json['endpoints']
+    assert stats['api.get_movies']['requests'] == 1
+    assert stats['api.get_movies']['queries'] == queries
+    assert not stats['api.get_movies']['n_plus_one']
+
+
+def test_profiling_is_off_by_default(client, auth_headers):
+    assert 'Server-Timing' not in client.get('/api/movies', headers=auth_headers).headers
+    assert client.get('/api/profile', headers=auth_headers).status_code == 404
+
+
+def test_other_engines_are_not_profiled(app, profiling, tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path}/other.db')
+    with app.test_request_context('/'):
+        app.preprocess_request()
+        with engine.connect() as connection:
+            connection.exec_driver_sql('SELECT 1')
+        assert g.profile.queries == 0
+    engine.dispose()
+
+
+def test_slow_queries_are_logged(app, client, auth_headers, profiling, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, 'SLOW_QUERY_MS', 0)
+    with caplog.at_level(logging.WARNING, logger='app.slow_queries'):
+        client.get('/api/movies', headers=auth_headers)
+    entries = [json.loads(record.getMessage()) for record in caplog.records]
+    assert entries and all(entry['event'] == 'slow_query' for entry in entries)
+    assert any(entry['endpoint'] == 'api.get_movies' and 'FROM movie' in entry['statement']
+               for entry in entries)
+
+    caplog.clear()
+    monkeypatch.setitem(app.config, 'SLOW_QUERY_SAMPLE_RATE', 0)
+    with caplog.at_level(logging.WARNING, logger='app.slow_queries'):
+        client.get('/api/movies', headers=auth_headers)
+    assert not caplog.records
+
+
+def test_repeated_statements_flag_an_endpoint_once(caplog):
+    stats = EndpointStats(n_plus_one=3)
+    for repeats in (2, 3, 5):
+        profile = RequestProfile()
+        profile.add('SELECT * FROM user', 0.001)
+        for _ in range(repeats):
+            profile.add('SELECT * FROM movie WHERE user_id = ?', 0.001)
+        with caplog.at_level(logging.WARNING, logger='app.slow_queries'):
+            stats.record('api.get_users', profile)
+        assert stats.stats()['api.get_users']['n_plus_one'] == (repeats >= 3)
+    assert [json.loads(record.getMessage())['repeats'] for record in caplog.records] == [3]
+    assert stats.stats()['api.get_users']['max_queries'] == 6
@@ -0,0 +1,81 @@
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import User, Movie, token_cache
+
+
+def add_users(count):
+    for i in range(count):
+        user = User(username=f'user{i}', email=f'user{i}@example.com', movies_count=i % 3)
+        db.session.add(user)
+        db.session.flush()
+        for j in range(i % 3):
+            db.session.add(Movie(name=f'Movie {i}.{j}', year=2000, oscars=0, user_id=user.id))
+    db.session.commit()
+
+
+def count_statements(client, url, headers):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sa.event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', count)
+    assert response.status_code == 200
+    return len(statements), response
+
+
+@pytest.mark.parametrize('extra_users', [0, 1, 20])
+def test_get_users_issues_fixed_number_of_queries(client, auth_headers, extra_users, monkeypatch):
+    # look the token up on every request so that both requests do the same work
+    monkeypatch.setattr(token_cache, 'ttl', 0)
+    baseline, _ = count_statements(client, '/api/users', auth_headers)
+    add_users(extra_users)
+    db.session.expunge_all()
+    statements, response = count_statements(client, '/api/users', auth_headers)
+    assert statements == baseline
+    counts = {u['username']: u['movies_count'] for u in response.json['users']}
+    assert counts == {'susan': 0, **{f'user{i}': i % 3 for i in range(extra_users)}}
+
+
+def test_movies_count_follows_every_write_path(client, auth_headers, user):
+    def stored_and_actual():
+        db.session.expire_all()
+        actual = db.session.scalar(sa.select(sa.func.count()).where(Movie.user_id == user.id))
+        return db.session.get(User, user.id).movies_count, actual
+
+    movie = {'name': 'Heat', 'year': 1995, 'oscars': 0, 'genre': 'Crime'}
+    id = client.post('/api/movies', json=movie, headers=auth_headers).json['id']
+    client.post('/api/movies/batch', headers=auth_headers, json=[
+        {'op': 'create', 'data': movie}, {'op': 'create', 'data': movie},
+        {'op': 'delete', 'id': id}])
+    client.post('/api/movies/import', data='name,year,oscars,genre\nRonin,1998,0,\n',
+                headers=dict(auth_headers, **{'Content-Type': 'text/csv'}))
+    assert stored_and_actual() == (3, 3)
+
+    client.post('/login', data={'username': 'susan', 'password': 'cat'})
+    client.post('/add_movie', data={'name': 'Thief', 'year': 1981, 'oscars': 0})
+    assert stored_and_actual() == (4, 4)
+    last = db.session.scalar(sa.select(sa.func.max(Movie.id)))
+    client.post(f'/delete_movie/{last}')
+    client.delete(f'/api/movies/{last - 1}', headers=auth_headers)
+    assert stored_and_actual() == (2, 2)
+    assert client.get(f'/api/users/{user.id}', headers=auth_headers).json['movies_count'] == 2
+
+
+def test_repairing_movie_counts_changes_the_etag(app, client, auth_headers, user):
+    db.session.execute(sa.update(User).values(movies_count=99))
+    db.session.commit()
+    response = client.get(f'/api/users/{user.id}', headers=auth_headers)
+    assert response.json['movies_count'] == 99
+
+    result = app.test_cli_runner().invoke(args=['check-movie-counts', '--repair'])
+    assert result.exit_code == 0 and 'Repaired 1 users' in result.output
+    again = client.get(f'/api/users/{user.id}', headers=dict(
+        auth_headers, **{'If-None-Match': response.headers['ETag']}))
+    assert again.status_code == 200 and again.json['movies_count'] == 0